@@ -1,3 +1,4 @@
-#from .celery import celery
- 
+# load the celery app when django starts so @shared_task uses it
+from .celery import celery
 
+__all__ = ("celery",)
@@ -3,7 +3,6 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'BookingApplication.settings.dev')
 
-print("ASGI application is starting...")  # Debugging line
 #next time leave the imports after the below lunch
 
 django_asgi_app = get_asgi_application()
@@ -12,6 +11,7 @@ django_asgi_app = get_asgi_application()
 from booking.middleware import JWTAuthMiddlewareStack
 from channels.routing import ProtocolTypeRouter, URLRouter
 from booking.routing import websocket_urlpatterns
+from booking.autocomplete import autocomplete_index
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
@@ -19,3 +19,6 @@ application = ProtocolTypeRouter({
             URLRouter(websocket_urlpatterns)
     ),
 })
+
+# the autocomplete index is built in the background, before the first search instead of during it
+autocomplete_index.warm()
@@ -0,0 +1,77 @@
+import asyncio
+import time
+from copy import deepcopy
+from channels.exceptions import ChannelFull
+from channels.layers import InMemoryChannelLayer
+
+
+class LocalChannelLayer(InMemoryChannelLayer):
+    """
+    In process channel layer for single node deployments and tests, same semantics as channels'
+    InMemoryChannelLayer (capacity, message expiry, group expiry) without its per operation costs:
+    * the sweep of every channel and group for expired entries runs at most once per `clean_interval`
+      seconds instead of on each receive and group_send, receive still drops the expired messages of
+      its own channel so an expired message is never delivered
+    * group_send copies the message once and queues it directly on each member's channel,
+      rather than one task and one deepcopy per member
+    handlers must therefore treat group events as read only, as they would with a network layer.
+    """
+
+    def __init__(self, clean_interval=1, **kwargs):
+        super().__init__(**kwargs)
+        self.clean_interval = clean_interval
+        self._next_clean = 0
+
+    def _clean_expired(self):
+        now = time.monotonic()
+        if now < self._next_clean:
+            return
+        self._next_clean = now + self.clean_interval
+        super()._clean_expired()
+
+    def _queue(self, channel):
+        queue = self.channels.get(channel)
+        if queue is None:
+            queue = self.channels[channel] = asyncio.Queue(maxsize=self.get_capacity(channel))
+        return queue
+
+    async def receive(self, channel):
+        assert self.valid_channel_name(channel)
+        self._clean_expired()
+
+        queue = self._queue(channel)
+        try:
+            while True:
+                expires, message = await queue.get()
+                if expires >= time.time():
+                    return message
+                # what the sweep does with an expired message: the channel leaves its groups
+                self._remove_from_groups(channel)
+        finally:
+            if queue.empty():
+                self.channels.pop(channel, None)
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        assert "__asgi_channel__" not in message
+        try:
+            self._queue(channel).put_nowait((time.time() + self.expiry, deepcopy(message)))
+        except asyncio.QueueFull:
+            raise ChannelFull(channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        assert self.valid_group_name(group), "Invalid group name"
+        self._clean_expired()
+
+        channels = self.groups.get(group)
+        if not channels:
+            return
+        item = (time.time() + self.expiry, deepcopy(message))
+        for channel in list(channels):
+            try:
+                self._queue(channel).put_nowait(item)
+            except asyncio.QueueFull:
+                # same as channels' layers: a full member just misses the event
+                pass
@@ -19,3 +19,16 @@ class PROPERTY_STATUS_CHOICES(models.TextChoices):
     PENDING = 'PENDING', 'Pending'
     CANCELED = 'CANCELED', 'Canceled'
     CONFIRMED = 'CONFIRMED', "Confirmed"
+
+
+class PAYMENT_SESSION_STATUS_CHOICES(models.TextChoices):
+    PENDING = 'PENDING', 'Pending'
+    READY = 'READY', 'Ready'
+    FAILED = 'FAILED', 'Failed'
+
+
+class EMAIL_STATUS_CHOICES(models.TextChoices):
+    PENDING = 'PENDING', 'Pending'
+    SENDING = 'SENDING', 'Sending'
+    SENT = 'SENT', 'Sent'
+    FAILED = 'FAILED', 'Failed'
@@ -0,0 +1,159 @@
+import contextvars
+import hmac
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseNotFound
+
+# timings of the request being handled, None outside of MetricsMiddleware so timers cost nothing
+current_metrics = contextvars.ContextVar('current_metrics', default=None)
+_serializer_depth = contextvars.ContextVar('serializer_depth', default=0)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram:
+    """
+    Cumulative histogram per label set, rendered in the Prometheus text format.
+    """
+
+    def __init__(self, name, documentation, label_names, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            counts, total = self._values.get(labels, ([0] * (len(self.buckets) + 1), 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self._values[labels] = (counts, total + value)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            values = {labels: (list(counts), total) for labels, (counts, total) in self._values.items()}
+        for labels, (counts, total) in sorted(values.items()):
+            label_str = ','.join(f'{name}="{value}"' for name, value in zip(self.label_names, labels))
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{label_str},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{label_str},le="+Inf"}} {counts[-1]}')
+            lines.append(f'{self.name}_sum{{{label_str}}} {total}')
+            lines.append(f'{self.name}_count{{{label_str}}} {counts[-1]}')
+        return '\n'.join(lines)
+
+
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Wall time of a request.', ('view', 'method', 'status'), DURATION_BUCKETS)
+DB_QUERIES = Histogram(
+    'http_request_db_queries', 'Database queries run by a request.', ('view',), QUERY_COUNT_BUCKETS)
+DB_DURATION = Histogram(
+    'http_request_db_duration_seconds', 'Time a request spent in the database.', ('view',), DURATION_BUCKETS)
+SERIALIZER_DURATION = Histogram(
+    'http_request_serializer_duration_seconds', 'Time a request spent serializing.', ('view',), DURATION_BUCKETS)
+RESPONSE_SIZE = Histogram(
+    'http_response_size_bytes', 'Size of a response body.', ('view',), SIZE_BUCKETS)
+
+HISTOGRAMS = [REQUEST_DURATION, DB_QUERIES, DB_DURATION, SERIALIZER_DURATION, RESPONSE_SIZE]
+
+
+class QueryTimer:
+    """connection.execute_wrapper counting the queries and database time of the current request"""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.metrics['db_time'] += time.perf_counter() - start
+            self.metrics['db_queries'] += 1
+
+
+@contextmanager
+def serializer_timer():
+    """
+    Add the time spent in the outermost serializer to the current request,
+    nested serializers run inside it so they aren't counted twice.
+    """
+    metrics = current_metrics.get()
+    depth = _serializer_depth.get()
+    if metrics is None or depth:
+        token = _serializer_depth.set(depth + 1)
+        try:
+            yield
+        finally:
+            _serializer_depth.reset(token)
+        return
+    token = _serializer_depth.set(1)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics['serializer_time'] += time.perf_counter() - start
+        _serializer_depth.reset(token)
+
+
+class TimedSerializerMixin:
+    """Serializer mixin reporting to_representation time to MetricsMiddleware."""
+
+    def to_representation(self, instance):
+        with serializer_timer():
+            return super().to_representation(instance)
+
+
+class MetricsMiddleware:
+    """
+    Record wall time, query count, database time, serializer time and response size of every
+    request into the in-process histograms served by metrics_view, labelled by url name.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = {'db_queries': 0, 'db_time': 0.0, 'serializer_time': 0.0}
+        token = current_metrics.set(metrics)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(QueryTimer(metrics)))
+                response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+
+        match = request.resolver_match
+        view = (match.view_name or match.route) if match else 'unmatched'
+        REQUEST_DURATION.observe((view, request.method, str(response.status_code)), time.perf_counter() - start)
+        DB_QUERIES.observe((view,), metrics['db_queries'])
+        DB_DURATION.observe((view,), metrics['db_time'])
+        SERIALIZER_DURATION.observe((view,), metrics['serializer_time'])
+        if not response.streaming:
+            RESPONSE_SIZE.observe((view,), len(response.content))
+        return response
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint guarded by the METRICS_TOKEN bearer token, only open without one when DEBUG is on.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if not token:
+        if not settings.DEBUG:
+            return HttpResponseNotFound()
+    elif not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponseNotFound()
+    body = '\n'.join(histogram.render() for histogram in HISTOGRAMS) + '\n'
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,89 @@
+import contextvars
+import json
+import logging
+import random
+import time
+import uuid
+from django.conf import settings
+
+# the request being handled by the current thread/task, read lazily by RequestContextFilter
+current_request = contextvars.ContextVar('current_request', default=None)
+logger = logging.getLogger('BookingApplication.request')
+
+
+class RequestContextMiddleware:
+    """
+    Give every request an id (X-Request-ID is reused when the proxy sends one), every record logged
+    meanwhile carries the same context.
+    the line logged when a request finishes is DEBUG, access logs are the proxy's job in production
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+        request.started_at = time.perf_counter()
+        token = current_request.set(request)
+        try:
+            response = self.get_response(request)
+            response['X-Request-ID'] = request.request_id
+            # NOTE: checked up front so a disabled access log costs no record nor filter pass
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('request finished', extra={'status': response.status_code})
+            return response
+        finally:
+            current_request.reset(token)
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    Attach request_id, user_id, method, path and elapsed_ms of the current request to the record.
+    the user is read at log time because DRF authenticates inside the view
+    """
+
+    def filter(self, record):
+        request = current_request.get()
+        if request is None:
+            record.request_id = record.user_id = record.method = record.path = record.elapsed_ms = None
+            return True
+        user = getattr(request, 'user', None)
+        record.request_id = request.request_id
+        record.user_id = user.pk if user is not None and user.is_authenticated else None
+        record.method = request.method
+        record.path = request.path
+        record.elapsed_ms = round((time.perf_counter() - request.started_at) * 1000, 2)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only LOG_SAMPLE_RATE of the records below WARNING, warnings and errors always pass.
+    """
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        return random.random() < getattr(settings, 'LOG_SAMPLE_RATE', 1.0)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, fields passed with extra={...} are included as they are.
+    """
+    _reserved = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        data.update({
+            key: value for key, value in vars(record).items()
+            if key not in self._reserved and value is not None
+        })
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
@@ -18,7 +18,6 @@ INSTALLED_APPS = [
     "rest_framework_simplejwt",
     'django_filters',
     'corsheaders',
-    "debug_toolbar",
     'channels',
     "adminapp",
     "authapp",
@@ -26,6 +25,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "BookingApplication.request_logging.RequestContextMiddleware",
+    "BookingApplication.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     'whitenoise.middleware.WhiteNoiseMiddleware',
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -35,7 +36,6 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
 
 ]
 
@@ -122,11 +122,140 @@ REST_FRAMEWORK = {
 
 
 
-CHANNEL_LAYERS = {
+# structured json logs, records below WARNING are sampled with LOG_SAMPLE_RATE (see BookingApplication.request_logging)
+# LOG_LEVEL=DEBUG adds one "request finished" line per request
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '1.0'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'request_context': {'()': 'BookingApplication.request_logging.RequestContextFilter'},
+        'sampling': {'()': 'BookingApplication.request_logging.SamplingFilter'},
+    },
+    'formatters': {
+        'json': {'()': 'BookingApplication.request_logging.JsonFormatter'},
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'json',
+            'filters': ['sampling', 'request_context'],
+        },
+    },
+    'loggers': {
+        'BookingApplication': {'handlers': ['console'], 'level': LOG_LEVEL, 'propagate': False},
+        'authapp': {'handlers': ['console'], 'level': LOG_LEVEL, 'propagate': False},
+        'booking': {'handlers': ['console'], 'level': LOG_LEVEL, 'propagate': False},
+    },
+}
+
+# bearer token required by the /metrics/ endpoint (see BookingApplication.metrics), without one it is
+# only served when DEBUG is on
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# per process memory by default, dev/prod switch to redis when REDIS_CACHE_URL is set (see cache_and_channel_layers_from_env)
+CACHES = {
     'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# seconds a public property list/detail response stays cached (see booking.cache)
+PROPERTY_CACHE_TIMEOUT = 300
+# seconds an autocomplete index may miss the property writes of other processes (see booking.autocomplete)
+AUTOCOMPLETE_REFRESH_INTERVAL = 5
+
+
+# chat channel layers, dev/prod pick one with the CHANNEL_LAYER env var:
+# * redis : channels_redis, required as soon as websockets are served by more than one process
+# * local : in process (see BookingApplication.channel_layers), single node deployments and tests
+# * memory : channels' own InMemoryChannelLayer, kept to compare against
+CHANNEL_LAYER_BACKENDS = {
+    'redis': {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
         'CONFIG': {
             "hosts": [('127.0.0.1', 6379)],
         },
     },
+    'local': {
+        'BACKEND': 'BookingApplication.channel_layers.LocalChannelLayer',
+    },
+    'memory': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+    },
 }
+
+CHANNEL_LAYER = 'redis'
+CHANNEL_LAYERS = {
+    'default': CHANNEL_LAYER_BACKENDS[CHANNEL_LAYER],
+}
+
+
+def cache_and_channel_layers_from_env():
+    """
+    CACHES, CHANNEL_LAYER and CHANNEL_LAYERS as set by the environment, called by dev/prod once it is loaded.
+    * REDIS_CACHE_URL : redis cache instead of the per process memory
+    * CHANNEL_LAYER : a CHANNEL_LAYER_BACKENDS name, `local` runs chat without redis on a single process
+    * REDIS_CHANNEL_URL : moves the redis channel layer
+    """
+    caches = CACHES
+    if os.getenv('REDIS_CACHE_URL'):
+        caches = {
+            'default': {
+                'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+                'LOCATION': os.getenv('REDIS_CACHE_URL'),
+            }
+        }
+    channel_layer = os.getenv('CHANNEL_LAYER', 'redis')
+    backend = CHANNEL_LAYER_BACKENDS[channel_layer]
+    if channel_layer == 'redis' and os.getenv('REDIS_CHANNEL_URL'):
+        backend = dict(backend, CONFIG={'hosts': [os.getenv('REDIS_CHANNEL_URL')]})
+    return caches, channel_layer, {'default': backend}
+
+# chat messages are written in batches (see booking.message_buffer), at most this many seconds
+# after they were received or as soon as this many are waiting
+CHAT_FLUSH_INTERVAL = 0.1
+CHAT_FLUSH_BATCH_SIZE = 500
+# read receipts only move an in memory position, stored every this many seconds
+CHAT_READ_FLUSH_INTERVAL = 5
+# seconds a websocket handshake can reuse the cached user/participant lookup
+CHAT_MEMBERSHIP_CACHE_TIMEOUT = 60
+# access tokens remembered per process by the websocket auth middleware (see booking.middleware)
+WEBSOCKET_TOKEN_CACHE_SIZE = 1024
+
+
+CELERY_BEAT_SCHEDULE = {
+    # safety net for webhook events whose processing task was lost
+    'process-stripe-events': {
+        'task': 'booking.tasks.process_stripe_events',
+        'schedule': 60.0,
+    },
+    # retries of the email outbox, new emails wake the worker themselves
+    'send-queued-emails': {
+        'task': 'authapp.tasks.send_queued_emails',
+        'schedule': 30.0,
+    },
+    # expires waitlist offers and offers freed dates to the next guests
+    'process-waitlist': {
+        'task': 'booking.tasks.process_waitlist',
+        'schedule': 60.0,
+    },
+    # frees the nights of card bookings whose checkout session was never created
+    'expire-unpaid-bookings': {
+        'task': 'booking.tasks.expire_unpaid_bookings',
+        'schedule': 300.0,
+    },
+}
+
+# a card booking without a checkout session after this long is canceled (see booking.tasks.expire_unpaid_bookings)
+BOOKING_SESSION_TIMEOUT_MINUTES = 30
+
+# an outbox email is retried with exponential backoff (see authapp.tasks) before being marked FAILED
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+# seconds after which an email claimed by a worker that never marked it (crashed mid batch) is sent again
+EMAIL_OUTBOX_CLAIM_TIMEOUT = 600
+
+# how long the guest at the head of a waitlist has to confirm an offer before it moves to the next guest
+WAITLIST_OFFER_HOURS = 24
@@ -10,10 +10,19 @@ load_dotenv()
 ALLOWED_HOSTS = ["*"]
 DEBUG = True
 
+# debug toolbar is a development tool only, production relies on BookingApplication.metrics
+INSTALLED_APPS += ["debug_toolbar"]
+MIDDLEWARE += ["debug_toolbar.middleware.DebugToolbarMiddleware"]
+
 STRIPE_KEY=os.getenv("STRIPE_KEY")
 
 STRIPE_PUBLIC_KEY = os.getenv('STRIPE_PUBLISHER_KEY')
 
+STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
+
+# point stripe to a local fake server (e.g. stripe-mock on http://localhost:12111) during development
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE')
+
 SECRET_KEY = "django-insecure-lxhoqp8y=l(4u6iakgix*edo!s(6fe1@kk^j&g!%$6%)^_@$$w"
 
 SIMPLE_JWT = {
@@ -37,6 +46,8 @@ DATABASES = {
     }
 }
 
+CACHES, CHANNEL_LAYER, CHANNEL_LAYERS = cache_and_channel_layers_from_env()
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
@@ -60,3 +71,5 @@ CORS_ALLOWED_ORIGINS=[
 ]
 
 CELERY_BROKER_URL = 'redis://localhost:6379/1'
+# run tasks inline when no worker is started
+CELERY_TASK_ALWAYS_EAGER = os.getenv('CELERY_TASK_ALWAYS_EAGER') == 'True'
@@ -25,6 +25,10 @@ DATABASES={
 
 }
 
+CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL')
+
+CACHES, CHANNEL_LAYER, CHANNEL_LAYERS = cache_and_channel_layers_from_env()
+
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 
 ALLOWED_HOSTS = ['.herokuapp.com']
@@ -0,0 +1,218 @@
+import asyncio
+import json
+import logging
+import sys
+import time
+from datetime import date
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from channels.exceptions import ChannelFull
+
+from authapp.models import User
+from BookingApplication import metrics, request_logging
+from BookingApplication.channel_layers import LocalChannelLayer
+from BookingApplication.request_logging import JsonFormatter, RequestContextFilter, SamplingFilter, current_request
+
+
+def make_record(level=logging.INFO, msg='hello', **extra):
+    record = logging.LogRecord('booking', level, __file__, 1, msg, None, None)
+    record.__dict__.update(extra)
+    return record
+
+
+@override_settings(ALLOWED_HOSTS=['*'])
+class RequestContextMiddlewareTests(SimpleTestCase):
+
+    def setUp(self):
+        level = request_logging.logger.level
+        self.addCleanup(request_logging.logger.setLevel, level)
+
+    def test_finished_request_is_logged_at_debug(self):
+        request_logging.logger.setLevel(logging.DEBUG)
+        with self.assertLogs('BookingApplication.request', 'DEBUG') as logs:
+            response = self.client.get('/missing/', headers={'X-Request-ID': 'abc123'})
+        self.assertEqual(response['X-Request-ID'], 'abc123')
+        [record] = logs.records
+        self.assertEqual((record.levelno, record.getMessage(), record.status), (logging.DEBUG, 'request finished', 404))
+
+    def test_no_record_is_built_when_debug_is_off(self):
+        request_logging.logger.setLevel(logging.INFO)
+        with mock.patch.object(request_logging.logger, 'debug') as debug:
+            response = self.client.get('/missing/')
+        debug.assert_not_called()
+        # the id is still generated for the response and the other records
+        self.assertEqual(len(response['X-Request-ID']), 32)
+
+
+class RequestContextFilterTests(SimpleTestCase):
+
+    def in_request(self, request):
+        token = current_request.set(request)
+        self.addCleanup(current_request.reset, token)
+
+    def test_record_outside_a_request_has_empty_context(self):
+        record = make_record()
+        self.assertTrue(RequestContextFilter().filter(record))
+        self.assertEqual([record.request_id, record.user_id, record.method, record.path, record.elapsed_ms], [None] * 5)
+
+    def test_record_carries_the_current_request(self):
+        request = RequestFactory().post('/api/v0/booking/bookings/')
+        request.request_id, request.started_at = 'abc123', time.perf_counter() - 0.5
+        request.user = User(pk=7)
+        self.in_request(request)
+        record = make_record()
+        RequestContextFilter().filter(record)
+        self.assertEqual((record.request_id, record.user_id, record.method, record.path),
+                         ('abc123', 7, 'POST', '/api/v0/booking/bookings/'))
+        self.assertGreaterEqual(record.elapsed_ms, 500)
+
+    def test_anonymous_user_has_no_user_id(self):
+        request = RequestFactory().get('/')
+        request.request_id, request.started_at, request.user = 'abc123', time.perf_counter(), AnonymousUser()
+        self.in_request(request)
+        record = make_record()
+        RequestContextFilter().filter(record)
+        self.assertIsNone(record.user_id)
+
+
+class SamplingFilterTests(SimpleTestCase):
+
+    @override_settings(LOG_SAMPLE_RATE=0.25)
+    def test_records_below_warning_are_sampled(self):
+        sampling = SamplingFilter()
+        with mock.patch('BookingApplication.request_logging.random.random', side_effect=[0.1, 0.5]):
+            self.assertTrue(sampling.filter(make_record(logging.INFO)))
+            self.assertFalse(sampling.filter(make_record(logging.DEBUG)))
+
+    @override_settings(LOG_SAMPLE_RATE=0)
+    def test_warnings_and_errors_always_pass(self):
+        sampling = SamplingFilter()
+        self.assertFalse(sampling.filter(make_record(logging.INFO)))
+        self.assertTrue(sampling.filter(make_record(logging.WARNING)))
+        self.assertTrue(sampling.filter(make_record(logging.ERROR)))
+
+
+class JsonFormatterTests(SimpleTestCase):
+
+    def test_extra_fields_are_included_and_empty_ones_dropped(self):
+        record = make_record(msg='booking %s confirmed', status=201, request_id='abc123', user_id=None)
+        record.args = (42,)
+        data = json.loads(JsonFormatter().format(record))
+        self.assertEqual({key: data[key] for key in ('level', 'logger', 'message', 'status', 'request_id')}, {
+            'level': 'INFO', 'logger': 'booking', 'message': 'booking 42 confirmed', 'status': 201, 'request_id': 'abc123',
+        })
+        self.assertNotIn('user_id', data)
+        self.assertNotIn('args', data)
+
+    def test_exception_is_formatted(self):
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            record = make_record(logging.ERROR, exc_info=sys.exc_info())
+        data = json.loads(JsonFormatter().format(record))
+        self.assertIn('ValueError: boom', data['exc_info'])
+
+    def test_values_json_does_not_know_are_stringified(self):
+        data = json.loads(JsonFormatter().format(make_record(day=date(2026, 10, 18))))
+        self.assertEqual(data['day'], '2026-10-18')
+
+
+def histogram_count(histogram, labels):
+    counts, _ = histogram._values.get(labels, ([0], 0))
+    return counts[-1]
+
+
+@override_settings(ALLOWED_HOSTS=['*'], METRICS_TOKEN='secret')
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_requests_are_recorded_per_view(self):
+        before = histogram_count(metrics.REQUEST_DURATION, ('properties-list', 'GET', '404'))
+        queries_before = metrics.DB_QUERIES._values.get(('properties-list',), (None, 0))[1]
+        self.client.get('/api/v0/booking/properties/')
+        self.assertEqual(histogram_count(metrics.REQUEST_DURATION, ('properties-list', 'GET', '404')), before + 1)
+        # the empty listing still ran its query
+        self.assertGreater(metrics.DB_QUERIES._values[('properties-list',)][1], queries_before)
+        self.assertGreater(histogram_count(metrics.RESPONSE_SIZE, ('properties-list',)), 0)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram('test_seconds', 'Test.', ('view',), (0.1, 1))
+        for value in (0.05, 0.5, 5):
+            histogram.observe(('home',), value)
+        self.assertEqual(histogram.render().splitlines(), [
+            '# HELP test_seconds Test.',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{view="home",le="0.1"} 1',
+            'test_seconds_bucket{view="home",le="1"} 2',
+            'test_seconds_bucket{view="home",le="+Inf"} 3',
+            'test_seconds_sum{view="home"} 5.55',
+            'test_seconds_count{view="home"} 3',
+        ])
+
+    def test_metrics_endpoint_serves_the_exposition_format(self):
+        self.client.get('/api/v0/booking/properties/')
+        response = self.client.get('/metrics/', headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        body = response.content.decode()
+        for histogram in metrics.HISTOGRAMS:
+            self.assertIn(f'# TYPE {histogram.name} histogram', body)
+        self.assertIn('http_request_duration_seconds_count{view="properties-list",method="GET",status="404"}', body)
+
+    def test_metrics_endpoint_needs_the_token(self):
+        self.assertEqual(self.client.get('/metrics/').status_code, 404)
+        self.assertEqual(self.client.get('/metrics/', headers={'Authorization': 'Bearer wrong'}).status_code, 404)
+        with self.settings(METRICS_TOKEN=None, DEBUG=False):
+            self.assertEqual(self.client.get('/metrics/').status_code, 404)
+
+
+class LocalChannelLayerTests(SimpleTestCase):
+
+    async def test_send_to_a_full_channel_raises(self):
+        layer = LocalChannelLayer(capacity=2)
+        await layer.send('chat.1', {'type': 'a'})
+        await layer.send('chat.1', {'type': 'b'})
+        with self.assertRaises(ChannelFull):
+            await layer.send('chat.1', {'type': 'c'})
+        self.assertEqual([(await layer.receive('chat.1'))['type'] for _ in range(2)], ['a', 'b'])
+
+    async def test_group_send_reaches_every_member(self):
+        layer = LocalChannelLayer(capacity=1)
+        for channel in ('chat.1', 'chat.2', 'chat.3'):
+            await layer.group_add('room', channel)
+        await layer.send('chat.3', {'type': 'busy'})
+
+        message = {'type': 'chat.message', 'text': 'hi'}
+        await layer.group_send('room', message)
+        message['text'] = 'changed'
+        self.assertEqual(await layer.receive('chat.1'), {'type': 'chat.message', 'text': 'hi'})
+        self.assertEqual(await layer.receive('chat.2'), {'type': 'chat.message', 'text': 'hi'})
+        # a full member misses the event, the others still get it
+        self.assertEqual(await layer.receive('chat.3'), {'type': 'busy'})
+        await layer.group_discard('room', 'chat.2')
+        await layer.group_send('room', {'type': 'chat.message', 'text': 'again'})
+        self.assertNotIn('chat.2', layer.channels)
+
+    async def test_expired_messages_are_not_delivered(self):
+        # the sweep already ran, only receive's own check can drop the message
+        layer = LocalChannelLayer(expiry=60, clean_interval=3600)
+        layer._clean_expired()
+        await layer.group_add('room', 'chat.1')
+        await layer.send('chat.1', {'type': 'old'})
+        with mock.patch('time.time', return_value=time.time() + 120):
+            await layer.send('chat.1', {'type': 'new'})
+            self.assertEqual(await layer.receive('chat.1'), {'type': 'new'})
+        self.assertNotIn('chat.1', layer.groups['room'])
+
+    async def test_receive_waits_for_a_message(self):
+        layer = LocalChannelLayer()
+        receive = asyncio.ensure_future(layer.receive('chat.1'))
+        await asyncio.sleep(0)
+        await layer.send('chat.1', {'type': 'late'})
+        self.assertEqual(await asyncio.wait_for(receive, 1), {'type': 'late'})
@@ -3,10 +3,11 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
+from BookingApplication.metrics import metrics_view
 
 urlpatterns = [
     path("admin/", admin.site.urls),
-    path("__debug__/",include('debug_toolbar.urls')),
+    path("metrics/", metrics_view, name="metrics"),
 
     # verification-related routes (activation and password reset confirmation...etc) without any prefix
     path('', include('authapp.verification_via_email.urls')),
@@ -21,3 +22,6 @@ urlpatterns = [
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL,
                           document_root=settings.MEDIA_ROOT)
+
+if "debug_toolbar" in settings.INSTALLED_APPS:
+    urlpatterns += [path("__debug__/", include('debug_toolbar.urls'))]
@@ -4,3 +4,6 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "BookingApplication.settings.dev")
 application = get_wsgi_application()
 
+# the autocomplete index is built in the background, before the first search instead of during it
+from booking.autocomplete import autocomplete_index
+autocomplete_index.warm()
@@ -25,3 +25,18 @@ class ProfileAdmin(admin.ModelAdmin):
     def user_name(self,profile):
         return profile.user.username
     autocomplete_fields=['user']
+
+
+@admin.register(models.OutgoingEmail)
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display=[
+        'to',
+        'subject',
+        'status',
+        'attempts',
+        'created_at',
+        'claimed_at',
+        'sent_at'
+    ]
+    list_filter=['status']
+    search_fields=['to']
@@ -1,11 +1,38 @@
 from django.contrib.sites.shortcuts import get_current_site
 from django.conf import settings
 from django.core import mail
+from django.dispatch import receiver
+from django.template.base import TextNode, Variable, VariableNode
 from django.template.context import make_context
 from django.template.loader import get_template
+from django.utils.autoreload import file_changed
 from django.views.generic.base import ContextMixin
+from authapp.models import OutgoingEmail
 from authapp.utils import make_token
 
+# template_name, blocks map -> (compiled template, [(block node, attribute)]), see BaseEmailMessage.get_compiled_template
+_compiled_templates = {}
+# template_name, blocks map, site context -> [(block node, attribute, segments)], see BaseEmailMessage.get_prerendered_blocks
+_prerendered_blocks = {}
+
+SITE_CONTEXT_KEYS = ("domain", "protocol", "site_name")
+
+
+@receiver(file_changed)
+def clear_compiled_templates(sender, file_path, **kwargs):
+    # the dev server reloads templates on change, so must these caches
+    _compiled_templates.clear()
+    _prerendered_blocks.clear()
+
+
+def variable_names(node):
+    """
+    Root names of the variables a {{ }} node reads, filter arguments included.
+    """
+    expression = node.filter_expression
+    variables = [expression.var] + [arg for _, args in expression.filters for lookup, arg in args if lookup]
+    return {var.lookups[0] for var in variables if isinstance(var, Variable) and var.lookups}
+
 
 class BaseEmailMessage(mail.EmailMultiAlternatives, ContextMixin):
     template_name = None
@@ -23,13 +50,83 @@ class BaseEmailMessage(mail.EmailMultiAlternatives, ContextMixin):
         self.request = request
         self.context = {} if context is None else context
         self.html = None
+        if template_name:
+            self.template_name = template_name
 
-    def get_context_data(self, **kwargs):
+    @classmethod
+    def render_many(cls, users, request=None, context=None, **kwargs):
         """
-        Build the context that will be used in the email template
+        One rendered email per user in a single call, for bulk sends.
+        The site part of the context is built once, the template and its pre-rendered blocks are cached anyway.
         """
-        contx = super().get_context_data(**kwargs)
-        context = dict(contx, **self.context)
+        context = dict(context or {})
+        site_context = cls(request=request, context=context).get_site_context()
+        emails = []
+        for user in users:
+            email = cls(request=request, context=dict(context, user=user, **site_context), **kwargs)
+            email.to = [user.email]
+            email.render()
+            emails.append(email)
+        return emails
+
+    @classmethod
+    def queue_many(cls, users, request=None, context=None, **kwargs):
+        """
+        render_many() then store every email in the outbox with one insert.
+        """
+        from authapp.tasks import wake_email_worker
+        emails = cls.render_many(users, request=request, context=context, **kwargs)
+        OutgoingEmail.objects.bulk_create([email.to_outbox() for email in emails])
+        wake_email_worker()
+        return emails
+
+    def get_compiled_template(self):
+        """
+        The compiled template and the blocks of it listed in _blocks_map, found once per template_name.
+        """
+        key = (self.template_name, tuple(self._blocks_map.items()))
+        compiled = _compiled_templates.get(key)
+        if compiled is None:
+            template = get_template(self.template_name)
+            blocks = [
+                (node, self._blocks_map[node.name]) for node in template.template.nodelist
+                if getattr(node, 'name', None) in self._blocks_map
+            ]
+            compiled = _compiled_templates[key] = (template, blocks)
+        return compiled
+
+    def get_prerendered_blocks(self, site_context):
+        """
+        Each block as a list of segments: text, with the {{ }} reading only site values (site_name, domain...)
+        already rendered, and the nodes left to render per email. Built once per template and site.
+        """
+        key = (self.template_name, tuple(self._blocks_map.items()), tuple(sorted(site_context.items())))
+        blocks = _prerendered_blocks.get(key)
+        if blocks is None:
+            template, compiled = self.get_compiled_template()
+            site = make_context(site_context)
+            blocks = []
+            with site.bind_template(template.template):
+                for block, attr in compiled:
+                    segments = []
+                    for node in block.nodelist:
+                        if isinstance(node, TextNode):
+                            node = node.s
+                        elif isinstance(node, VariableNode) and variable_names(node) <= site_context.keys():
+                            node = node.render_annotated(site)
+                        if isinstance(node, str) and segments and isinstance(segments[-1], str):
+                            segments[-1] += node
+                        else:
+                            segments.append(node)
+                    blocks.append((block, attr, segments))
+            blocks = _prerendered_blocks[key] = blocks
+        return blocks
+
+    def get_site_context(self):
+        """
+        domain, protocol and site_name of the links in the email, from the context, the request or the settings
+        """
+        context = self.context
         if self.request:
             site = get_current_site(self.request)
             domain = context.get('domain') or (settings.DOMAIN or site.domain)
@@ -37,44 +134,74 @@ class BaseEmailMessage(mail.EmailMultiAlternatives, ContextMixin):
                 "https" if self.request.is_secure() else "http")
             site_name = context.get("site_name") or (
                 settings.SITE_NAME or site.name)
-            user = context.get("user") or self.request.user
         else:
             # when we don't have request this mainly for development `django shell` but even if we send emails in background tasks it will work properly
             domain = context.get("domain") or settings.DOMAIN
             protocol = context.get("protocol") or "http"
             site_name = context.get("site_name") or settings.SITE_NAME
-            user = context.get("user")
-
-        context.update({
+        return {
             "domain": domain,
             "protocol": protocol,
             "site_name": site_name,
-            "user": user,
-        })
-        return context
+        }
 
-    def _process_blocks(self, block, context):
+    def get_context_data(self, **kwargs):
         """
-        This method process blocks provided in template , it render the content of each block and assign the rendered content to BaseEmailMessage instance  
-        This method processes template blocks (e.g., for the subject, body, HTML) and assigns the rendered content to the corresponding attributes on the BaseEmailMessage instance
+        Build the context that will be used in the email template
         """
-        block_name = block.name if hasattr(block, 'name') else None
-        if block_name and block_name in self._blocks_map:
-            attr = self._blocks_map[block_name]
-            # eg: self.subject = block.render(context).strip()
-            setattr(self, attr, block.render(context).strip())
+        contx = super().get_context_data(**kwargs)
+        context = dict(contx, **self.context)
+        context.update(self.get_site_context())
+        if self.request:
+            context["user"] = context.get("user") or self.request.user
+        else:
+            context["user"] = context.get("user")
+        return context
 
     def render(self):
         """
         Render the email template and process the blocks.
         """
-        context = make_context(self.get_context_data(), request=self.request)
-        template = get_template(self.template_name)
-        with context.bind_template(template.template):
-            for block in template.template.nodelist:
-                self._process_blocks(block, context)
+        context_data = self.get_context_data()
+        site_context = {key: context_data[key] for key in SITE_CONTEXT_KEYS}
+        context = make_context(context_data, request=self.request)
+        template, _ = self.get_compiled_template()
+        with context.bind_template(template.template), context.push():
+            for block, attr, segments in self.get_prerendered_blocks(site_context):
+                # same as block.render(context) without redoing the parts every email shares
+                context["block"] = block
+                rendered = "".join(
+                    segment if isinstance(segment, str) else segment.render_annotated(context)
+                    for segment in segments
+                )
+                # eg: self.subject = rendered.strip()
+                setattr(self, attr, rendered.strip())
         self._attach_body()
 
+    def to_outbox(self):
+        """
+        Unsaved OutgoingEmail of this rendered email.
+        """
+        return OutgoingEmail(
+            to=self.to[0],
+            from_email=self.from_email,
+            subject=self.subject,
+            # an html only email has its html copied in body by _attach_body
+            body=self.body if self.content_subtype != "html" else "",
+            html=self.html,
+        )
+
+    def queue(self, email):
+        """
+        Render the email now, while the request is around, and store it in the outbox.
+        A worker sends it (see authapp.tasks.send_queued_emails) once the current transaction commits.
+        """
+        from authapp.tasks import wake_email_worker
+        self.to = [email]
+        self.render()
+        self.to_outbox().save()
+        wake_email_worker()
+
     def _attach_body(self):
         """
         Attach the body (HTML or text) to the email.
@@ -0,0 +1,52 @@
+import time
+from django.core.management.base import BaseCommand
+from django.template.context import make_context
+from django.template.loader import get_template
+from authapp.email import ActivationEmail, SendPasswordResetEmail
+from authapp.models import User
+
+
+class UncachedMixin:
+    """render() as it used to be: template lookup and nodelist walk for every email."""
+
+    def render(self):
+        context = make_context(self.get_context_data(), request=self.request)
+        template = get_template(self.template_name)
+        with context.bind_template(template.template):
+            for block in template.template.nodelist:
+                attr = self._blocks_map.get(getattr(block, 'name', None))
+                if attr:
+                    setattr(self, attr, block.render(context).strip())
+        self._attach_body()
+
+
+class Command(BaseCommand):
+    help = (
+        'Render activation and password reset emails for unsaved users and report emails/sec: '
+        'uncached (template lookup per email), cached one by one, and render_many(). Nothing is sent.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--emails', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        users = [User(id=i + 1, username=f'bench{i}', email=f'bench{i}@fastbook.io') for i in range(options['emails'])]
+        for email_class in (ActivationEmail, SendPasswordResetEmail):
+            uncached_class = type(f'Uncached{email_class.__name__}', (UncachedMixin, email_class), {})
+            self.stdout.write(self.style.MIGRATE_HEADING(f'\n{email_class.__name__}'))
+            self.report('uncached', users, lambda: [self.render_one(uncached_class, user) for user in users])
+            self.report('cached', users, lambda: [self.render_one(email_class, user) for user in users])
+            self.report('render_many', users, lambda: email_class.render_many(users))
+
+    def render_one(self, email_class, user):
+        email = email_class(context={'user': user})
+        email.to = [user.email]
+        email.render()
+        return email
+
+    def report(self, label, users, render):
+        started = time.perf_counter()
+        emails = render()
+        elapsed = time.perf_counter() - started
+        assert len(emails) == len(users) and all(email.subject and email.html for email in emails)
+        self.stdout.write(f'{label:<12} {len(users) / elapsed:>8.0f} emails/s')
@@ -0,0 +1,99 @@
+import asyncio
+import mailbox
+from email import message_from_bytes
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        'Run a local SMTP server that accepts every email and prints its recipients and subject '
+        '(or appends it to an mbox file), to develop and load test the email outbox without a mail server. '
+        'Listens on EMAIL_HOST:EMAIL_PORT by default, which dev settings point at localhost:1025.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default=getattr(settings, 'EMAIL_HOST', 'localhost'))
+        parser.add_argument('--port', type=int, default=getattr(settings, 'EMAIL_PORT', 1025))
+        parser.add_argument('--mbox', help='Append the received emails to this mbox file')
+        parser.add_argument('--quiet', action='store_true', help='Only print a count every 100 emails')
+
+    def handle(self, *args, **options):
+        self.mbox = mailbox.mbox(options['mbox']) if options['mbox'] else None
+        self.quiet = options['quiet']
+        self.received = 0
+        try:
+            asyncio.run(self.serve(options['host'], options['port']))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if self.mbox is not None:
+                self.mbox.close()
+            self.stdout.write(f'{self.received} emails received')
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle_client, host, port)
+        self.stdout.write(f'SMTP sink listening on {host}:{port}')
+        async with server:
+            await server.serve_forever()
+
+    async def handle_client(self, reader, writer):
+        """
+        The subset of SMTP Django's backend speaks without TLS nor auth: EHLO/HELO, MAIL, RCPT, DATA, RSET, NOOP, QUIT.
+        """
+        def reply(line):
+            writer.write(f'{line}\r\n'.encode())
+
+        reply('220 localhost SMTP sink')
+        recipients = []
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode('latin1').strip()
+                verb = command[:4].upper()
+                if verb == 'EHLO':
+                    reply('250-localhost')
+                    reply('250 8BITMIME')
+                elif verb == 'RCPT':
+                    recipients.append(command.partition(':')[2].strip(' <>'))
+                    reply('250 OK')
+                elif verb in ('HELO', 'MAIL', 'NOOP'):
+                    reply('250 OK')
+                elif verb == 'RSET':
+                    recipients = []
+                    reply('250 OK')
+                elif verb == 'DATA':
+                    reply('354 End data with <CR><LF>.<CR><LF>')
+                    await writer.drain()
+                    self.store(await self.read_data(reader), recipients)
+                    recipients = []
+                    reply('250 OK queued')
+                elif verb == 'QUIT':
+                    reply('221 Bye')
+                    break
+                else:
+                    reply('502 Command not implemented')
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def read_data(self, reader):
+        lines = []
+        while True:
+            line = await reader.readline()
+            if line in (b'.\r\n', b'.\n', b''):
+                return b''.join(lines)
+            # undo the dot stuffing of lines starting with a dot
+            lines.append(line[1:] if line.startswith(b'..') else line)
+
+    def store(self, data, recipients):
+        self.received += 1
+        message = message_from_bytes(data)
+        if self.mbox is not None:
+            self.mbox.add(message)
+        if not self.quiet:
+            self.stdout.write(f"{', '.join(recipients)}: {message['Subject']}")
+        elif self.received % 100 == 0:
+            self.stdout.write(f'{self.received} emails received')
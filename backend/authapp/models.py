@@ -1,8 +1,9 @@
 from django.core.validators import MinValueValidator
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.utils import timezone
 
-from BookingApplication.constants import LANGUAGES
+from BookingApplication.constants import EMAIL_STATUS_CHOICES, LANGUAGES
 
 
 
@@ -46,3 +47,31 @@ class Profile(models.Model):
 
     def __str__(self) -> str:
         return f"{self.user.username}"
+
+
+class OutgoingEmail(models.Model):
+    """
+    Outbox of rendered emails, sent in batches by authapp.tasks.send_queued_emails.
+    """
+    to = models.EmailField()
+    from_email = models.CharField(max_length=254)
+    subject = models.CharField(max_length=255)
+    body = models.TextField(blank=True)
+    html = models.TextField(null=True,blank=True)
+    status = models.CharField(max_length=10,choices=EMAIL_STATUS_CHOICES.choices,default=EMAIL_STATUS_CHOICES.PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True,blank=True)
+    # when a worker took the email to send it (SENDING), see authapp.tasks.claim_due_emails
+    claimed_at = models.DateTimeField(null=True,blank=True)
+
+    class Meta:
+        indexes = [
+            # the worker's queue: due pending emails, oldest first
+            models.Index(fields=['status','next_attempt_at'],name='email_outbox_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.subject} to {self.to} ({self.status})'
@@ -0,0 +1,120 @@
+import logging
+from datetime import timedelta
+from celery import shared_task
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db import transaction
+from django.db.models import Q
+from django.utils.timezone import now
+from authapp.models import OutgoingEmail
+from BookingApplication.constants import EMAIL_STATUS_CHOICES
+
+logger = logging.getLogger(__name__)
+
+
+def wake_email_worker():
+    """
+    Ask a worker to send the outbox once the current transaction commits,
+    if the broker is unreachable the periodic send-queued-emails run picks the emails up.
+    """
+    def wake():
+        try:
+            send_queued_emails.apply_async(retry=False)
+        except Exception as e:
+            logger.warning("Could not enqueue send_queued_emails, leaving it to the beat schedule: %s", e)
+    transaction.on_commit(wake)
+
+
+def retry_delay(attempts):
+    # 30s, 1m, 2m, 4m ... capped at an hour
+    return timedelta(seconds=min(30 * 2 ** (attempts - 1), 3600))
+
+
+def schedule_retry(email, error):
+    email.attempts += 1
+    email.last_error = str(error)
+    if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        email.status = EMAIL_STATUS_CHOICES.FAILED
+        logger.error("Giving up on email %s to %s after %s attempts: %s", email.id, email.to, email.attempts, error)
+    else:
+        email.status = EMAIL_STATUS_CHOICES.PENDING
+        email.next_attempt_at = now() + retry_delay(email.attempts)
+
+
+def build_message(email, connection):
+    from authapp.email import BaseEmailMessage
+    message = BaseEmailMessage(
+        subject=email.subject,
+        body=email.body,
+        from_email=email.from_email,
+        to=[email.to],
+        connection=connection,
+    )
+    message.html = email.html
+    message._attach_body()
+    return message
+
+
+def claim_due_emails(batch_size):
+    """
+    Take a batch of due emails for this worker: they move to SENDING in a short transaction, so no row lock
+    or transaction stays open while talking to SMTP. Emails claimed longer than EMAIL_OUTBOX_CLAIM_TIMEOUT
+    ago belong to a worker that died before marking them and are claimed again.
+    """
+    claimed_at = now()
+    stale = claimed_at - timedelta(seconds=settings.EMAIL_OUTBOX_CLAIM_TIMEOUT)
+    with transaction.atomic():
+        emails = list(
+            OutgoingEmail.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(status=EMAIL_STATUS_CHOICES.PENDING, next_attempt_at__lte=claimed_at)
+                | Q(status=EMAIL_STATUS_CHOICES.SENDING, claimed_at__lt=stale)
+            )
+            .order_by('next_attempt_at')[:batch_size]
+        )
+        OutgoingEmail.objects.filter(id__in=[email.id for email in emails]).update(
+            status=EMAIL_STATUS_CHOICES.SENDING, claimed_at=claimed_at)
+    for email in emails:
+        email.status, email.claimed_at = EMAIL_STATUS_CHOICES.SENDING, claimed_at
+    return emails
+
+
+@shared_task
+def send_queued_emails(batch_size=100):
+    """
+    Send the due outbox emails, one SMTP connection per batch instead of one per email.
+    * emails are claimed first (see claim_due_emails), then sent outside any transaction
+    * each email is marked SENT as soon as the server took it, a failure later in the batch doesn't send it twice
+    * a failed email is retried with exponential backoff and marked FAILED after EMAIL_OUTBOX_MAX_ATTEMPTS
+    * if the server can't be reached the whole batch is rescheduled
+    """
+    sent = 0
+    while True:
+        emails = claim_due_emails(batch_size)
+        if not emails:
+            return sent
+
+        connection = get_connection()
+        try:
+            connection.open()
+        except Exception as e:
+            logger.warning("Could not connect to the SMTP server, %s emails rescheduled: %s", len(emails), e)
+            for email in emails:
+                schedule_retry(email, e)
+            OutgoingEmail.objects.bulk_update(emails, ['status', 'attempts', 'next_attempt_at', 'last_error'])
+            return sent
+
+        try:
+            for email in emails:
+                try:
+                    build_message(email, connection).send()
+                except Exception as e:
+                    logger.warning("Failed to send email %s to %s: %s", email.id, email.to, e)
+                    schedule_retry(email, e)
+                    email.save(update_fields=['status', 'attempts', 'next_attempt_at', 'last_error'])
+                else:
+                    email.status, email.sent_at = EMAIL_STATUS_CHOICES.SENT, now()
+                    email.save(update_fields=['status', 'sent_at'])
+                    sent += 1
+        finally:
+            connection.close()
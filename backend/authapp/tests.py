@@ -1,3 +1,153 @@
-from django.test import TestCase
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.db import connection
+from django.template import engines
+from django.template.loader import render_to_string
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils.autoreload import file_changed
+from django.utils.timezone import now
+
+from authapp import email, tasks
+from authapp.email import ActivationEmail, SendPasswordResetEmail
+from authapp.models import OutgoingEmail, User
+from authapp.tasks import send_queued_emails
+from BookingApplication.constants import EMAIL_STATUS_CHOICES
+
+
+def queue_emails(count):
+    return OutgoingEmail.objects.bulk_create([
+        OutgoingEmail(to=f'guest{i}@fastbook.io', from_email='noreply@fastbook.io', subject=f'Email {i}', body='Hello')
+        for i in range(count)
+    ])
+
+
+def failing_for(*subjects):
+    """build_message whose send() raises for the given subjects."""
+    build_message = tasks.build_message
+
+    def build(email, smtp_connection):
+        message = build_message(email, smtp_connection)
+        if email.subject in subjects:
+            message.send = mock.Mock(side_effect=OSError('connection reset'))
+        return message
+    return build
+
+
+class EmailOutboxTests(TestCase):
+
+    def statuses(self):
+        return dict(OutgoingEmail.objects.values_list('subject', 'status'))
+
+    def test_due_emails_are_sent_once(self):
+        queue_emails(3)
+        self.assertEqual(send_queued_emails(), 3)
+        self.assertEqual(send_queued_emails(), 0)
+        self.assertEqual(sorted(message.subject for message in mail.outbox), ['Email 0', 'Email 1', 'Email 2'])
+        self.assertEqual(set(self.statuses().values()), {EMAIL_STATUS_CHOICES.SENT})
+
+    def test_a_failure_mid_batch_keeps_the_sent_emails_sent(self):
+        queue_emails(3)
+        with mock.patch('authapp.tasks.build_message', failing_for('Email 1')), self.assertLogs('authapp.tasks', 'WARNING'):
+            self.assertEqual(send_queued_emails(), 2)
+        self.assertEqual(self.statuses(), {
+            'Email 0': EMAIL_STATUS_CHOICES.SENT, 'Email 1': EMAIL_STATUS_CHOICES.PENDING, 'Email 2': EMAIL_STATUS_CHOICES.SENT,
+        })
+        failed = OutgoingEmail.objects.get(subject='Email 1')
+        self.assertEqual(failed.attempts, 1)
+        self.assertGreater(failed.next_attempt_at, now())
+
+        # once due again only the failed email goes out
+        OutgoingEmail.objects.filter(id=failed.id).update(next_attempt_at=now())
+        self.assertEqual(send_queued_emails(), 1)
+        self.assertEqual([message.subject for message in mail.outbox].count('Email 0'), 1)
+
+    def test_email_is_given_up_after_max_attempts(self):
+        queue_emails(1)
+        OutgoingEmail.objects.update(attempts=4)
+        with self.settings(EMAIL_OUTBOX_MAX_ATTEMPTS=5), self.assertLogs('authapp.tasks', 'WARNING'), \
+                mock.patch('authapp.tasks.build_message', failing_for('Email 0')):
+            send_queued_emails()
+        self.assertEqual(self.statuses(), {'Email 0': EMAIL_STATUS_CHOICES.FAILED})
+
+    def test_unreachable_server_reschedules_the_batch(self):
+        queue_emails(2)
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.open', side_effect=OSError('refused')), \
+                self.assertLogs('authapp.tasks', 'WARNING'):
+            self.assertEqual(send_queued_emails(), 0)
+        self.assertEqual(set(self.statuses().values()), {EMAIL_STATUS_CHOICES.PENDING})
+        self.assertEqual(set(OutgoingEmail.objects.values_list('attempts', flat=True)), {1})
+
+    def test_emails_of_a_dead_worker_are_claimed_again(self):
+        stale, recent = queue_emails(2)
+        OutgoingEmail.objects.filter(id=stale.id).update(
+            status=EMAIL_STATUS_CHOICES.SENDING, claimed_at=now() - timedelta(hours=1))
+        OutgoingEmail.objects.filter(id=recent.id).update(status=EMAIL_STATUS_CHOICES.SENDING, claimed_at=now())
+        self.assertEqual(send_queued_emails(), 1)
+        self.assertEqual(self.statuses(), {'Email 0': EMAIL_STATUS_CHOICES.SENT, 'Email 1': EMAIL_STATUS_CHOICES.SENDING})
+
+
+class EmailOutboxTransactionTests(TransactionTestCase):
+
+    def test_emails_are_sent_outside_any_transaction(self):
+        queue_emails(2)
+        seen = []
+        build_message = tasks.build_message
+
+        def build(email, smtp_connection):
+            # the claim is committed and no transaction holds the rows while SMTP is slow
+            seen.append((connection.in_atomic_block, OutgoingEmail.objects.get(id=email.id).status))
+            return build_message(email, smtp_connection)
+
+        with mock.patch('authapp.tasks.build_message', build):
+            self.assertEqual(send_queued_emails(), 2)
+        self.assertEqual(seen, [(False, EMAIL_STATUS_CHOICES.SENDING)] * 2)
+
+
+class EmailTemplateCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        email.clear_compiled_templates(sender=None, file_path=None)
+        self.addCleanup(email.clear_compiled_templates, sender=None, file_path=None)
+        patcher = mock.patch('authapp.email.make_token', return_value='token123')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User(id=7, username='guest', email='guest@fastbook.io')
+
+    def assertMatchesPlainRender(self, message):
+        # the blocks are the whole template, only whitespace lies around them
+        plain = render_to_string(message.template_name, message.get_context_data())
+        position = 0
+        for part in (message.subject, message.body, message.html):
+            start = plain.index(part, position)
+            self.assertEqual(plain[position:start].strip(), '')
+            position = start + len(part)
+        self.assertEqual(plain[position:].strip(), '')
+
+    def test_cached_render_matches_a_plain_render(self):
+        for email_class in (ActivationEmail, SendPasswordResetEmail):
+            with self.subTest(email_class.__name__):
+                for site_name in ('FastBook', 'Other'):
+                    # the second pass renders from the cached template and pre-rendered blocks
+                    for _ in range(2):
+                        message = email_class(context={'user': self.user, 'site_name': site_name})
+                        message.render()
+                        self.assertIn('token123', message.html)
+                        self.assertIn(site_name, message.subject)
+                        self.assertMatchesPlainRender(message)
+
+    def test_template_changes_clear_the_caches(self):
+        ActivationEmail(context={'user': self.user}).render()
+        edited = engines['django'].from_string(
+            '{% block subject %}Edited {{ site_name }}{% endblock %}{% block text_body %}{{ activation_url }}{% endblock %}')
+        with mock.patch('authapp.email.get_template', return_value=edited):
+            message = ActivationEmail(context={'user': self.user, 'site_name': 'FastBook'})
+            message.render()
+            self.assertEqual(message.subject, 'Activate your account on FastBook')
+
+            file_changed.send(sender=None, file_path=Path('authapp/templates/email/activation.html'))
+            message = ActivationEmail(context={'user': self.user, 'site_name': 'FastBook'})
+            message.render()
+            self.assertEqual((message.subject, message.body), ('Edited FastBook', 'http://localhost:8080/activate/token123/'))
@@ -1,9 +1,12 @@
+import logging
 from rest_framework_simplejwt.tokens import AccessToken
 from datetime import timedelta
 from django.conf import settings
 
 from authapp.models import User
 
+logger = logging.getLogger(__name__)
+
 
 def send_activation_email(request, user):
     from authapp.email import ActivationEmail
@@ -13,10 +16,9 @@ def send_activation_email(request, user):
             request=request,
             context={"user": user},
         )
-        email.send(user.email)
-    except Exception as e:
-        print(f"Failed to send activation email: {e}")
-     #    logger.error(f"Failed to send activation email: {e}")
+        email.queue(user.email)
+    except Exception:
+        logger.exception("Failed to queue activation email to user %s", user.id)
 
 
 def send_reset_password_email(request, user):
@@ -27,10 +29,9 @@ def send_reset_password_email(request, user):
             request=request,
             context={"user": user},
         )
-        email.send(user.email)
-    except Exception as e:
-        print(f"Failed to send reset password email: {e}")
-     #    logger.error(f"Failed to send activation email: {e}")
+        email.queue(user.email)
+    except Exception:
+        logger.exception("Failed to queue reset password email to user %s", user.id)
 
 
 def make_token(user):
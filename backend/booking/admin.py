@@ -1,11 +1,18 @@
 from django.contrib import admin
-from .models import Property, PropertyImage, Booking, Conversation, Message, WaitListEntry
+from .models import City, Property, PropertyImage, Booking, Conversation, Message, WaitListEntry
+
+@admin.register(City)
+class CityAdmin(admin.ModelAdmin):
+    list_display = ('name', 'slug')
+    search_fields = ('name', 'slug')
 
 @admin.register(Property)
 class PropertyAdmin(admin.ModelAdmin):
-    list_display = ('title', 'host', 'price_per_night', 'address')
-    search_fields = ('title', 'address')
-    list_filter = ('host',)
+    list_display = ('title', 'host', 'city', 'price_per_night', 'address')
+    search_fields = ('title', 'address', 'city_name')
+    list_filter = ('host', 'city')
+    # save() files the property under the City of city_name
+    readonly_fields = ('city',)
 
 @admin.register(PropertyImage)
 class PropertyImageAdmin(admin.ModelAdmin):
@@ -32,5 +39,5 @@ class MessageAdmin(admin.ModelAdmin):
 
 @admin.register(WaitListEntry)
 class WaitListEntryAdmin(admin.ModelAdmin):
-    list_display = ('related_property', 'guest', 'created_at')
-    list_filter = ('related_property', 'guest')
+    list_display = ('related_property', 'guest', 'created_at', 'notified_at', 'confirmed', 'expired_at')
+    list_filter = ('related_property', 'guest', 'confirmed')
@@ -0,0 +1,168 @@
+import heapq
+import logging
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from django.conf import settings
+from django.db import connection
+from .cache import AUTOCOMPLETE_VERSION_KEY, bump_version, get_version
+from .models import Property
+
+logger = logging.getLogger(__name__)
+
+CITY, TITLE = 'city', 'title'
+DEFAULT_LIMIT = 8
+PRECOMPUTED_PREFIX_LENGTH = 3
+# sorts after every character a key can hold, prefix + LAST_CHAR bounds the keys starting with prefix
+LAST_CHAR = '\U0010ffff'
+
+
+def normalize(text):
+    """Lowercase without accents and with single spaces, so "bejaia" suggests "Béjaïa"."""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ' '.join(''.join(char for char in decomposed if not unicodedata.combining(char)).lower().split())
+
+
+def suggestions_of(title, city, is_available):
+    """The (kind, text) suggestions a property contributes, only listed properties are suggested."""
+    if not is_available:
+        return []
+    return [(kind, text.strip()) for kind, text in ((CITY, city), (TITLE, title)) if text and text.strip()]
+
+
+def best(keys, entries, prefix, limit):
+    """Top `limit` suggestions of the sorted keys starting with prefix."""
+    start = bisect_left(keys, prefix)
+    end = bisect_left(keys, prefix + LAST_CHAR, start)
+    top = heapq.nsmallest(limit, (keys[i] for i in range(start, end)), key=lambda key: (-entries[key][2], key))
+    return [{'text': entries[key][1], 'kind': entries[key][0], 'count': entries[key][2]} for key in top]
+
+
+class AutocompleteIndex:
+    """
+    In-memory prefix index of the cities and titles of the listed properties, one per process.
+    * suggestions live in a sorted array of normalized keys, a prefix is the slice found by two bisects
+    * each suggestion is weighted by the number of listed properties sharing it, the top k of a prefix
+      are remembered until a property under that prefix changes, those of 1-3 characters are computed with the index
+    * built from the database by a background thread, started when the web process boots (warm()), then kept
+      up to date by the Property signals of this process; writes from other processes bump AUTOCOMPLETE_VERSION_KEY
+      and the index is rebuilt when it notices, checking at most every `refresh_interval` seconds
+    * requests never wait for a build: the previous index answers until the new one is swapped in,
+      an index that was never built answers nothing
+    """
+
+    def __init__(self, refresh_interval=None, max_cached_prefixes=10_000):
+        self.refresh_interval = refresh_interval or getattr(settings, 'AUTOCOMPLETE_REFRESH_INTERVAL', 5)
+        self.max_cached_prefixes = max_cached_prefixes
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0.0
+        self._builder = None
+        self._reset()
+
+    def _reset(self):
+        self._keys = []
+        self._entries = {}  # key -> [kind, display text, count]
+        self._top = {}  # prefix -> {limit: suggestions}
+
+    def build(self):
+        version = get_version(AUTOCOMPLETE_VERSION_KEY)
+        counts = {}
+        rows = Property.objects.filter(is_available=True).values_list('title', 'city_name').iterator(chunk_size=5000)
+        for title, city in rows:
+            for kind, text in suggestions_of(title, city, True):
+                key = f'{normalize(text)}\0{kind}'
+                entry = counts.setdefault(key, [kind, text, 0])
+                entry[2] += 1
+        keys = sorted(counts)
+        # the shortest prefixes span most of the array, their top k is ready before the first keystroke
+        top = {
+            prefix: {DEFAULT_LIMIT: best(keys, counts, prefix, DEFAULT_LIMIT)}
+            for prefix in {key[:length] for key in keys for length in range(1, PRECOMPUTED_PREFIX_LENGTH + 1)}
+        }
+        # the new index replaces the old one at once, suggest() kept answering from the old one meanwhile
+        with self._lock:
+            self._entries, self._keys, self._top = counts, keys, top
+            self._version = version
+            self._checked_at = time.monotonic()
+
+    def warm(self):
+        """Build the index in a background thread unless a build is already running."""
+        with self._lock:
+            if self._builder is not None and self._builder.is_alive():
+                return
+            self._builder = threading.Thread(target=self._build_in_background, name='autocomplete-index', daemon=True)
+            self._builder.start()
+
+    def _build_in_background(self):
+        try:
+            self.build()
+        except Exception:
+            logger.exception('Failed to build the autocomplete index')
+        finally:
+            # the thread's own connection, nothing else would close it
+            connection.close()
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < self.refresh_interval:
+            return
+        self._checked_at = now
+        if self._version is None or get_version(AUTOCOMPLETE_VERSION_KEY) != self._version:
+            self.warm()
+
+    def suggest(self, text, limit=DEFAULT_LIMIT):
+        """Top `limit` suggestions starting with the text, most listings first."""
+        prefix = normalize(text)
+        if not prefix:
+            return []
+        self._refresh()
+        with self._lock:
+            top = self._top.get(prefix, {}).get(limit)
+            if top is None:
+                if len(self._top) >= self.max_cached_prefixes:
+                    self._top.clear()
+                top = self._top.setdefault(prefix, {})[limit] = self._best(prefix, limit)
+            return top
+
+    def _best(self, prefix, limit):
+        return best(self._keys, self._entries, prefix, limit)
+
+    def apply(self, removed, added, version):
+        """
+        Move a property's suggestions from `removed` to `added` ((kind, text) pairs) after this process
+        wrote it. version is AUTOCOMPLETE_VERSION_KEY after the write, an index that missed another
+        write in between is left stale for _refresh to rebuild.
+        """
+        with self._lock:
+            if self._version is None or self._version != version - 1:
+                return
+            self._version = version
+            for (kind, text), delta in [(pair, -1) for pair in removed] + [(pair, 1) for pair in added]:
+                key = f'{normalize(text)}\0{kind}'
+                entry = self._entries.get(key)
+                if entry is None:
+                    if delta < 0:
+                        continue
+                    entry = self._entries[key] = [kind, text, 0]
+                    insort(self._keys, key)
+                entry[2] += delta
+                if entry[2] <= 0:
+                    del self._entries[key]
+                    del self._keys[bisect_left(self._keys, key)]
+                # forget the remembered top k of every prefix of the key
+                normalized = key.split('\0', 1)[0]
+                for length in range(1, len(normalized) + 1):
+                    self._top.pop(normalized[:length], None)
+
+
+autocomplete_index = AutocompleteIndex()
+
+
+def suggestions_changed(removed, added):
+    """
+    A property of this process moved from the `removed` suggestions to the `added` ones, to call once committed:
+    the other processes rebuild, this one updates its index in place.
+    """
+    autocomplete_index.apply(removed, added, bump_version(AUTOCOMPLETE_VERSION_KEY))
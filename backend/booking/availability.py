@@ -0,0 +1,94 @@
+from datetime import date, datetime, timedelta
+from django.db.models import Exists, OuterRef, Q
+from django.utils.dateparse import parse_date
+from BookingApplication.constants import PROPERTY_STATUS_CHOICES
+from .models import Booking, UnavailableNight
+
+# booking statuses that hold their nights, a canceled booking frees them
+BLOCKING_STATUSES = [PROPERTY_STATUS_CHOICES.PENDING, PROPERTY_STATUS_CHOICES.CONFIRMED]
+
+
+def nights_between(check_in, check_out):
+    """Every night of a stay, the check out day itself is not a night."""
+    return [check_in + timedelta(days=x) for x in range((check_out - check_in).days)]
+
+
+def as_date(value):
+    # a date field assigned a 'YYYY-MM-DD' string keeps the string after save()
+    return value if isinstance(value, date) else parse_date(value)
+
+
+def parse_blocked_dates(blocked_dates):
+    """
+    Parse Property.blocked_dates ('YYYY-MM-DD' strings), only called on write.
+    Malformed legacy values are skipped instead of breaking the whole calendar.
+    """
+    dates = set()
+    for value in blocked_dates or []:
+        try:
+            dates.add(datetime.strptime(value, '%Y-%m-%d').date())
+        except (TypeError, ValueError):
+            continue
+    return dates
+
+
+def sync_booking_nights(booking):
+    """Rewrite the calendar rows held by a booking according to its dates and status."""
+    UnavailableNight.objects.filter(booking=booking).delete()
+    if booking.status not in BLOCKING_STATUSES:
+        return
+    UnavailableNight.objects.bulk_create([
+        UnavailableNight(related_property_id=booking.property_id, booking=booking, date=night)
+        for night in nights_between(as_date(booking.check_in_date), as_date(booking.check_out_date))
+    ])
+
+
+def sync_blocked_nights(property_instance):
+    """Rewrite the host blocked rows of a property from its blocked_dates."""
+    UnavailableNight.objects.filter(related_property=property_instance, booking__isnull=True).delete()
+    UnavailableNight.objects.bulk_create([
+        UnavailableNight(related_property=property_instance, date=night)
+        for night in parse_blocked_dates(property_instance.blocked_dates)
+    ])
+
+
+def has_overlapping_booking(property_id, check_in, check_out):
+    """
+    True when a PENDING/CONFIRMED booking shares at least one night with [check_in, check_out).
+    Back to back stays don't overlap: a guest can check in the day another checks out.
+    """
+    return Booking.objects.filter(
+        property_id=property_id,
+        status__in=BLOCKING_STATUSES,
+        check_in_date__lt=check_out,
+        check_out_date__gt=check_in,
+    ).exists()
+
+
+def first_unavailable_night(property_id, check_in, check_out):
+    """
+    Return the first unavailable night (date, booking_id) in [check_in, check_out) or None.
+    booking_id is None when the night was blocked by the host.
+    """
+    return UnavailableNight.objects.filter(
+        related_property_id=property_id,
+        date__gte=check_in,
+        date__lt=check_out,
+    ).order_by('date').values_list('date', 'booking_id').first()
+
+
+def filter_available_between(queryset, check_in, check_out):
+    """
+    Narrow a Property queryset to listings bookable for the whole [check_in, check_out) stay.
+    Bookings and blocked dates are excluded with an anti-join on the calendar, the
+    available_from/available_to window is checked in the same query.
+    """
+    unavailable = UnavailableNight.objects.filter(
+        related_property=OuterRef('pk'),
+        date__gte=check_in,
+        date__lt=check_out,
+    )
+    return queryset.filter(
+        Q(available_from__isnull=True) | Q(available_from__date__lte=check_in),
+        Q(available_to__isnull=True) | Q(available_to__date__gte=check_out),
+    ).filter(~Exists(unavailable))
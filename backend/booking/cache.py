@@ -0,0 +1,91 @@
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+# Cached responses are never deleted, their keys embed version counters instead and a write
+# bumps the counters it affects (see booking.signals.handlers) so stale entries just expire:
+# * LIST_VERSION_KEY : any property or image change, every listing page
+# * AVAILABILITY_VERSION_KEY : bookings, only listings searched by check in/out dates
+# * property_version_key(pk) : one property and its images, its detail page
+# * AUTOCOMPLETE_VERSION_KEY : titles/cities of listed properties, the in-process autocomplete indexes
+LIST_VERSION_KEY = 'property-cache:list-version'
+AVAILABILITY_VERSION_KEY = 'property-cache:availability-version'
+AUTOCOMPLETE_VERSION_KEY = 'property-cache:autocomplete-version'
+
+
+def property_version_key(pk):
+    return f'property-cache:property-version:{pk}'
+
+
+def cluster_key_prefix(precision, filters, version_keys):
+    """
+    Prefix of the keys of the map clusters, `<prefix>:<tile>` holds the clusters of one tile.
+    the listing filters and versions are part of it like for responses
+    """
+    params = sorted((key, sorted(values)) for key, values in filters.items())
+    versions = [get_version(key) for key in version_keys]
+    raw = f'{precision}|{params}|{versions}'
+    return 'property-cache:clusters:' + hashlib.md5(raw.encode()).hexdigest()
+
+
+# ChatConsumer caches whether a user takes part in a conversation, the participants m2m handler drops it
+def chat_member_key(conversation_id, user_id):
+    return f'chat:member:{conversation_id}:{user_id}'
+
+
+def get_version(key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, 1, timeout=None)
+        version = cache.get(key, 1)
+    return version
+
+
+def bump_version(key):
+    """Returns the new version."""
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # first write since the cache was cleared, any value other than the old one works
+        cache.set(key, 2, timeout=None)
+        return 2
+
+
+class PropertyCacheMixin:
+    """
+    Serve public property reads from the cache and answer If-None-Match with a 304.
+    The ETag is derived from the versioned key so a conditional request costs a few cache reads
+    and no database query nor serialization.
+    """
+
+    @property
+    def cache_timeout(self):
+        # read on every write so the setting can change without reloading the views
+        return getattr(settings, 'PROPERTY_CACHE_TIMEOUT', 300)
+
+    def get_cache_key(self, request, *version_keys):
+        # absolute urls (images, cursor links) depend on the host so it is part of the key
+        params = sorted((key, sorted(request.query_params.getlist(key))) for key in request.query_params)
+        versions = [get_version(key) for key in version_keys]
+        raw = f'{request.scheme}://{request.get_host()}{request.path}|{params}|{versions}'
+        return 'property-cache:response:' + hashlib.md5(raw.encode()).hexdigest()
+
+    def cached_response(self, request, cache_key, build_response):
+        etag = f'"{cache_key.rsplit(":", 1)[-1]}"'
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match and (etag in parse_etags(if_none_match) or if_none_match.strip() == '*'):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        data = cache.get(cache_key)
+        if data is None:
+            response = build_response()
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            cache.set(cache_key, response.data, self.cache_timeout)
+        else:
+            response = Response(data, status=status.HTTP_200_OK)
+        response['ETag'] = etag
+        return response
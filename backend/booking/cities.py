@@ -0,0 +1,11 @@
+import unicodedata
+from django.utils.text import slugify
+
+
+def city_slug(name):
+    """
+    Key of a City: case, accents and spacing insensitive, arabic names keep their letters.
+    plain function without models so migration 0015 shares it with City.for_names
+    """
+    decomposed = unicodedata.normalize('NFKD', name or '')
+    return slugify(''.join(char for char in decomposed if not unicodedata.combining(char)), allow_unicode=True)
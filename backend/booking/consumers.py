@@ -1,86 +1,208 @@
 import json
-from authapp.utils import send_reset_password_email
-from .models import Message, Conversation
+import time
+from .cache import chat_member_key
+from .message_buffer import message_buffer, read_state_buffer
+from .models import Message
 from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from rest_framework import serializers
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
+    """
+    Frames sent by the client, told apart by `type` (a frame without one is a message):
+    * {"message": "..."} : a chat message, stored and broadcast with its id
+    * {"type": "typing", "is_typing": true} : relayed to the room, nothing is stored
+    * {"type": "read", "message_id": 42} : relayed to the room, stored lazily (see ReadStateBuffer)
+    The room also receives {"type": "presence", "user": {...}, "online": bool} when someone joins or leaves,
+    presence lives in the channel layer: members already in the room answer a newcomer's announcement.
+    """
+    # seconds between two "is typing" relays of the same client
+    typing_interval = 1
+
     async def connect(self):
         self.room_name = self.scope['url_route']['kwargs']['conversation_id']
         self.room_group_name = f'chat_{self.room_name}'
-        user_id= self.scope['user_id']
-        print(f'user_id: {user_id}')
-        self.user=await self.get_user(user_id)
-        print(self.user)
-        
-        
+        self.user = await self.get_member(self.scope.get('user_id'), self.room_name)
+        self.typing_sent_at = 0
+
+        # Reject the handshake before joining the group: no valid token or not a participant
+        if self.user is None:
+            await self.close()
+            return
 
         # Join room group
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
-        await self.accept()
+        # read positions can't go past the latest message this client may have seen
+        self.latest_message_id = await self.load_latest_message_id(self.room_name)
+
+        # echo the subprotocol the token came in, browsers drop the connection otherwise
+        await self.accept(self.scope.get('auth_subprotocol'))
+        await self.send_presence(online=True, reply_to=self.channel_name)
 
     async def disconnect(self, close_code):
+        if self.user is None:
+            return
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
+        await self.send_presence(online=False)
+        # don't keep what this client sent waiting for the next timer
+        await message_buffer.flush()
+        await read_state_buffer.flush()
 
     async def receive(self, text_data):
         text_data_json = json.loads(text_data)
-        message = text_data_json.get('message')
+        kind = text_data_json.get('type', 'message')
+
+        if kind == 'typing':
+            await self.receive_typing(bool(text_data_json.get('is_typing', True)))
+        elif kind == 'read':
+            await self.receive_read(text_data_json.get('message_id'))
+        elif kind == 'message':
+            await self.receive_message(text_data_json.get('message'))
 
+    async def receive_message(self, message):
         if not message:
             return
 
-        # Save message to the database
-        await self.save_message(self.user, self.room_name, message)
+        # Queued, written with the other consumers' messages by the next flush
+        saved = await message_buffer.add(self.room_name, self.user['id'], message)
+        if saved is None:
+            # the conversation was deleted
+            return
 
         # Send message to the room group
         await self.channel_layer.group_send(
             self.room_group_name,
             {
                 'type': 'chat_message',
-                'message': message,
+                'id': saved.id,
+                'sender': self.user,
+                'content': saved.content,
+                'created_at': serializers.DateTimeField().to_representation(saved.created_at),
             }
         )
 
+    async def receive_typing(self, is_typing):
+        # keystrokes arrive far more often than anyone needs to know, stopping always goes through
+        now = time.monotonic()
+        if is_typing and now - self.typing_sent_at < self.typing_interval:
+            return
+        self.typing_sent_at = now if is_typing else 0
+        await self.channel_layer.group_send(self.room_group_name, {
+            'type': 'chat_typing',
+            'user': self.user,
+            'is_typing': is_typing,
+            'channel': self.channel_name,
+        })
+
+    async def receive_read(self, message_id):
+        try:
+            message_id = int(message_id)
+        except (TypeError, ValueError):
+            return
+        # capped at the latest message, a made up id would mark every future message as read
+        message_id = min(message_id, self.latest_message_id)
+        if message_id <= 0:
+            return
+        # only positions past the previous one are relayed, the database write is deferred
+        if read_state_buffer.mark(self.room_name, self.user['id'], message_id):
+            await self.channel_layer.group_send(self.room_group_name, {
+                'type': 'chat_read',
+                'user': self.user,
+                'message_id': message_id,
+                'channel': self.channel_name,
+            })
+
+    async def send_presence(self, online, reply_to=None):
+        await self.channel_layer.group_send(self.room_group_name, {
+            'type': 'chat_presence',
+            'user': self.user,
+            'online': online,
+            'channel': self.channel_name,
+            'reply_to': reply_to,
+        })
+
     async def chat_message(self, event):
-        message = event['message']
-        # Send message to WebSocket
+        self.latest_message_id = max(self.latest_message_id, event['id'])
+        # Send message to WebSocket, same fields as MessageSerializer plus the ones older clients read
         await self.send(text_data=json.dumps({
-            'message': message,
-            'user': self.user.id,
+            'type': 'message',
+            'id': event['id'],
+            'sender': event['sender'],
+            'content': event['content'],
+            'created_at': event['created_at'],
+            'message': event['content'],
+            'user': event['sender']['id'],
         }))
 
-    @database_sync_to_async
-    def save_message(self, sender, conversation_id, content):
+    async def chat_typing(self, event):
+        if event['channel'] != self.channel_name:
+            await self.send(text_data=json.dumps({
+                'type': 'typing', 'user': event['user'], 'is_typing': event['is_typing'],
+            }))
+
+    async def chat_read(self, event):
+        if event['channel'] != self.channel_name:
+            await self.send(text_data=json.dumps({
+                'type': 'read', 'user': event['user'], 'message_id': event['message_id'],
+            }))
+
+    async def chat_presence(self, event):
+        if event['channel'] == self.channel_name:
+            return
+        if event['user']['id'] == self.user['id']:
+            # another tab of the same user closed, this one keeps them online
+            if not event['online']:
+                await self.send_presence(online=True)
+            return
+        await self.send(text_data=json.dumps({
+            'type': 'presence', 'user': event['user'], 'online': event['online'],
+        }))
+        # a newcomer asks who is already here, answer on its channel only
+        if event['reply_to']:
+            await self.channel_layer.send(event['reply_to'], {
+                'type': 'chat_presence',
+                'user': self.user,
+                'online': True,
+                'channel': self.channel_name,
+                'reply_to': None,
+            })
+
+    async def get_member(self, user_id, conversation_id):
         """
-        This function remains synchronous because Django ORM is not async,
-        so it uses @database_sync_to_async.
+        {'id', 'username'} of the user when they take part in the conversation, None otherwise.
+        Answers, refusals included, are cached CHAT_MEMBERSHIP_CACHE_TIMEOUT seconds so reconnects cost no query.
         """
-        try:
-            conversation = Conversation.objects.get(id=conversation_id)
-            Message.objects.create(
-                sender=sender,
-                conversation=conversation,
-                content=content
-            )
-        except Conversation.DoesNotExist:
-            pass
+        if user_id is None:
+            return None
+        key = chat_member_key(conversation_id, user_id)
+        member = await cache.aget(key)
+        if member is None:
+            member = await self.load_member(user_id, conversation_id) or False
+            await cache.aset(key, member, settings.CHAT_MEMBERSHIP_CACHE_TIMEOUT)
+        return member or None
 
     @database_sync_to_async
-    def get_user(self, user_id):
+    def load_latest_message_id(self, conversation_id):
+        latest = Message.objects.filter(conversation_id=conversation_id).order_by('-created_at', '-id').values_list('id', flat=True).first()
+        return latest or 0
+
+    @database_sync_to_async
+    def load_member(self, user_id, conversation_id):
         """
-        This function is also synchronous and wrapped with @database_sync_to_async.
+        This function is synchronous and wrapped with @database_sync_to_async.
         """
-        try:
-            User = get_user_model()
-            return User.objects.get(id=user_id)
-        except User.DoesNotExist:
-            return None
+        User = get_user_model()
+        return User.objects.filter(
+            id=user_id, conversations__id=conversation_id
+        ).values('id', 'username').first()
@@ -0,0 +1,5 @@
+from authapp.email import BaseEmailMessage
+
+
+class WaitlistOfferEmail(BaseEmailMessage):
+    template_name = "email/waitlist_offer.html"
@@ -0,0 +1,178 @@
+import math
+from django.db.models import Avg, Count, F, FloatField, Min, Q, Value
+from django.db.models.functions import ASin, Cos, Least, Power, Radians, Sin, Sqrt, Substr
+
+# NOTE: properties are indexed on a geohash grid, the stored hash is the cell of the property at GEOHASH_PRECISION
+# and every shorter prefix is the enclosing coarser cell, so a map area is a few ranges of the geohash index
+# instead of a scan of every coordinate. The exact bounds/distance are then checked on those rows.
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9  # cells of ~5m
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+# a search area is covered with at most this many cells, more cells means a tighter but longer OR of ranges
+MAX_COVER_CELLS = 32
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        # bits alternate between longitude and latitude, starting with longitude
+        value, bounds = (longitude, lng_range) if even else (latitude, lat_range)
+        middle = (bounds[0] + bounds[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            bounds[0] = middle
+        else:
+            bounds[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits = bit_count = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """(height, width) in degrees of the cells of a geohash precision."""
+    lat_bits = 5 * precision // 2
+    lng_bits = 5 * precision - lat_bits
+    return 180 / 2 ** lat_bits, 360 / 2 ** lng_bits
+
+
+def split_antimeridian(south, west, north, east):
+    if west <= east:
+        return [(south, west, north, east)]
+    return [(south, west, north, 180.0), (south, -180.0, north, east)]
+
+
+def grid_cells(south, west, north, east, precision, max_cells):
+    """Geohash cells of the precision covering the bounding box, None if more than max_cells are needed."""
+    height, width = cell_size(precision)
+    cells = set()
+    for box_south, box_west, box_north, box_east in split_antimeridian(south, west, north, east):
+        # snap to the cell grid, one sample point per cell is enough to get its hash
+        first_row, last_row = math.floor((box_south + 90) / height), math.floor((min(box_north, 90 - 1e-9) + 90) / height)
+        first_col, last_col = math.floor((box_west + 180) / width), math.floor((min(box_east, 180 - 1e-9) + 180) / width)
+        if len(cells) + (last_row - first_row + 1) * (last_col - first_col + 1) > max_cells:
+            return None
+        for row in range(first_row, last_row + 1):
+            for col in range(first_col, last_col + 1):
+                cells.add(encode(-90 + (row + 0.5) * height, -180 + (col + 0.5) * width, precision))
+    return cells
+
+
+def cover(south, west, north, east, max_cells=MAX_COVER_CELLS):
+    """
+    Geohash prefixes of the cells covering the bounding box, at the finest precision that needs
+    at most max_cells of them.
+    """
+    cells = {''}
+    for precision in range(1, GEOHASH_PRECISION + 1):
+        finer = grid_cells(south, west, north, east, precision, max_cells)
+        if finer is None:
+            return cells
+        cells = finer
+    return cells
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """(south, west, north, east) enclosing the circle, the whole longitude band near the poles."""
+    delta_lat = radius_km / KM_PER_DEGREE
+    south, north = max(latitude - delta_lat, -90.0), min(latitude + delta_lat, 90.0)
+    if south == -90.0 or north == 90.0 or math.cos(math.radians(latitude)) < 1e-6:
+        return south, -180.0, north, 180.0
+    delta_lng = delta_lat / math.cos(math.radians(max(abs(south), abs(north))))
+    if delta_lng >= 180:
+        return south, -180.0, north, 180.0
+    west, east = longitude - delta_lng, longitude + delta_lng
+    # wrap around the antimeridian, split_antimeridian handles west > east
+    return south, (west + 540) % 360 - 180, north, (east + 540) % 360 - 180
+
+
+def next_prefix(prefix):
+    """The first geohash after every hash starting with prefix, None past the last cell ('zzz')."""
+    prefix = prefix.rstrip(GEOHASH_ALPHABET[-1])
+    if not prefix:
+        return None
+    return prefix[:-1] + GEOHASH_ALPHABET[GEOHASH_ALPHABET.index(prefix[-1]) + 1]
+
+
+def in_cells(cells):
+    """
+    Condition matching the hashes inside the cells, as `start <= geohash < end` ranges any btree index serves.
+    neighbouring cells along the Z curve are merged into one range
+    """
+    ranges = []
+    for prefix in sorted(cells):
+        if ranges and ranges[-1][1] == prefix:
+            ranges[-1][1] = next_prefix(prefix)
+        else:
+            ranges.append([prefix, next_prefix(prefix)])
+    condition = Q()
+    for start, end in ranges:
+        condition |= Q(geohash__gte=start, geohash__lt=end) if end else Q(geohash__gte=start)
+    return condition
+
+
+def within_bbox(queryset, south, west, north, east):
+    """Properties inside the box, located through the grid cells covering it."""
+    in_box = Q()
+    for box_south, box_west, box_north, box_east in split_antimeridian(south, west, north, east):
+        in_box |= Q(latitude__range=(box_south, box_north), longitude__range=(box_west, box_east))
+    return queryset.filter(in_cells(cover(south, west, north, east)), in_box)
+
+
+def distance_km(latitude, longitude):
+    """Haversine great-circle distance in km from the point to each property, as a query expression."""
+    lat, lng = math.radians(latitude), math.radians(longitude)
+    half_chord = (
+        Power(Sin((Radians(F('latitude')) - Value(lat)) / 2), 2)
+        + Value(math.cos(lat)) * Cos(Radians(F('latitude'))) * Power(Sin((Radians(F('longitude')) - Value(lng)) / 2), 2)
+    )
+    # rounding can push the chord a hair over 1 at antipodes, asin would fail on it
+    return Value(2 * EARTH_RADIUS_KM) * ASin(Least(Sqrt(half_chord), Value(1.0)), output_field=FloatField())
+
+
+def within_radius(queryset, latitude, longitude, radius_km):
+    """Properties at most radius_km away, annotated with their `distance` and nearest first."""
+    return (
+        within_bbox(queryset, *bounding_box(latitude, longitude, radius_km))
+        .annotate(distance=distance_km(latitude, longitude))
+        .filter(distance__lte=radius_km)
+        .order_by('distance', 'id')
+    )
+
+
+def precision_for_zoom(zoom):
+    """
+    Geohash precision whose cells are closest to a quarter of a map tile at the zoom level,
+    so a screen shows a few dozen clusters whatever the zoom.
+    """
+    target_width = 360 / 2 ** (zoom + 2)
+    return min(range(1, GEOHASH_PRECISION + 1), key=lambda precision: abs(math.log(cell_size(precision)[1] / target_width)))
+
+
+def clusters(queryset, precision):
+    """
+    Markers of the properties grouped by geohash cell of the precision, in one grouped query:
+    count, centroid and lowest price, plus the property id when the cell holds a single one.
+    """
+    rows = (
+        queryset.exclude(geohash='').order_by()
+        .values(cell=Substr('geohash', 1, precision))
+        .annotate(count=Count('id'), latitude=Avg('latitude'), longitude=Avg('longitude'),
+                  min_price=Min('price_per_night'), first_id=Min('id'))
+    )
+    return [
+        {
+            'geohash': row['cell'],
+            'count': row['count'],
+            'latitude': row['latitude'],
+            'longitude': row['longitude'],
+            'min_price': str(row['min_price']),
+            'property': row['first_id'] if row['count'] == 1 else None,
+        }
+        for row in rows
+    ]
@@ -0,0 +1,63 @@
+import random
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from booking.autocomplete import DEFAULT_LIMIT, AutocompleteIndex, CITY, normalize
+from booking.models import Property
+
+
+class Command(BaseCommand):
+    help = (
+        'Build the autocomplete index from the current properties and report its build time and the p50/p99 '
+        'latency of suggestions, first time and remembered, against the istartswith queries it replaces. '
+        'Seed listings first, e.g. with benchmark_property_search.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=2000)
+        parser.add_argument('--limit', type=int, default=DEFAULT_LIMIT)
+
+    def handle(self, *args, **options):
+        index = AutocompleteIndex()
+        started = time.perf_counter()
+        index.build()
+        self.stdout.write(f'built {len(index._keys)} suggestions from {Property.objects.count()} properties '
+                          f'in {(time.perf_counter() - started) * 1000:.0f}ms')
+
+        # what a user types: the first 1 to 6 characters of existing cities and titles
+        rng = random.Random(3)
+        texts = [entry[1] for entry in index._entries.values()]
+        prefixes = [normalize(text)[:rng.randint(1, 6)] for text in rng.choices(texts, k=options['iterations'])]
+        limit = options['limit']
+
+        # first keystrokes after a build, then the same prefixes again once remembered
+        first_time = list(dict.fromkeys(prefixes))
+        self.report('index, first time', lambda prefix: index.suggest(prefix, limit), first_time)
+        self.report('index, remembered', lambda prefix: index.suggest(prefix, limit), prefixes)
+        self.report('istartswith query', lambda prefix: self.query(prefix, limit), prefixes[:200])
+
+        removed, added = [(CITY, texts[0])], [(CITY, texts[0] + ' bis')]
+        timings = []
+        for _ in range(200):
+            version = index._version
+            start = time.perf_counter()
+            index.apply(removed, added, version + 1)
+            timings.append((time.perf_counter() - start) * 1000)
+            removed, added = added, removed
+        self.stdout.write(f'{"update in place":<20} p50 {statistics.median(timings):.4f} ms')
+
+    def query(self, prefix, limit):
+        listed = Property.objects.filter(is_available=True)
+        cities = listed.filter(city_name__istartswith=prefix).values('city_name').annotate(count=Count('id')).order_by('-count')
+        titles = listed.filter(title__istartswith=prefix).values('title').annotate(count=Count('id')).order_by('-count')
+        return list(cities[:limit]) + list(titles[:limit])
+
+    def report(self, label, suggest, prefixes):
+        timings = []
+        for prefix in prefixes:
+            start = time.perf_counter()
+            suggest(prefix)
+            timings.append((time.perf_counter() - start) * 1000)
+        percentiles = statistics.quantiles(timings, n=100)
+        self.stdout.write(f'{label:<20} p50 {percentiles[49]:.4f} ms  p99 {percentiles[98]:.4f} ms')
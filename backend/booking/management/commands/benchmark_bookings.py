@@ -0,0 +1,126 @@
+import random
+import statistics
+import time
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand
+from authapp.models import User
+from booking.availability import BLOCKING_STATUSES
+from booking.models import Booking, City, Property, WaitListEntry
+from BookingApplication.constants import PROPERTY_STATUS_CHOICES
+
+BENCH_PREFIX = 'bench_'
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a large number of bookings and report query plans and p50/p99 latency of the '
+        'booking overlap and waitlist queries. To compare before/after the indexes run it once, '
+        'then `migrate booking 0007`, run it again with --no-seed and migrate forward.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bookings', type=int, default=1_000_000)
+        parser.add_argument('--properties', type=int, default=10_000)
+        parser.add_argument('--iterations', type=int, default=500)
+        parser.add_argument('--batch-size', type=int, default=10_000)
+        parser.add_argument('--no-seed', action='store_true', help='Reuse previously seeded rows')
+        parser.add_argument('--cleanup', action='store_true', help='Delete the seeded rows and exit')
+
+    def handle(self, *args, **options):
+        if options['cleanup']:
+            deleted, _ = User.objects.filter(username__startswith=BENCH_PREFIX).delete()
+            self.stdout.write(f'Deleted {deleted} benchmark rows')
+            return
+
+        if not options['no_seed']:
+            self.seed(options['properties'], options['bookings'], options['batch_size'])
+
+        property_ids = list(
+            Property.objects.filter(host__username__startswith=BENCH_PREFIX).values_list('id', flat=True)
+        )
+        if not property_ids:
+            self.stderr.write('No benchmark data, run without --no-seed first')
+            return
+
+        rng = random.Random(42)
+        today = date.today()
+
+        def overlap_query():
+            check_in = today + timedelta(days=rng.randrange(730))
+            check_out = check_in + timedelta(days=rng.randrange(1, 14))
+            return Booking.objects.filter(
+                property_id=rng.choice(property_ids),
+                status__in=BLOCKING_STATUSES,
+                check_in_date__lt=check_out,
+                check_out_date__gt=check_in,
+            )
+
+        def waitlist_query():
+            return WaitListEntry.objects.filter(
+                related_property_id=rng.choice(property_ids),
+                confirmed=False,
+                notified_at=None,
+            ).order_by('created_at')
+
+        self.report('booking overlap', overlap_query, lambda qs: qs.exists(), options['iterations'])
+        self.report('waitlist next entry', waitlist_query, lambda qs: qs.first(), options['iterations'])
+
+    def seed(self, property_count, booking_count, batch_size):
+        rng = random.Random(7)
+        host = User.objects.create(username=f'{BENCH_PREFIX}host', email='bench_host@fastbook.io')
+        guests = User.objects.bulk_create([
+            User(username=f'{BENCH_PREFIX}guest_{i}', email=f'bench_guest_{i}@fastbook.io')
+            for i in range(100)
+        ])
+        city = City.for_names(['Alger'])['Alger']
+        properties = Property.objects.bulk_create([
+            Property(title=f'Bench {i}', address='bench', city_name=city.name, city=city, max_guests=4,
+                     price_per_night=rng.randrange(2000, 20000), host=host)
+            for i in range(property_count)
+        ], batch_size=batch_size)
+
+        statuses = list(PROPERTY_STATUS_CHOICES.values)
+        today = date.today()
+        start = time.perf_counter()
+        created = 0
+        while created < booking_count:
+            size = min(batch_size, booking_count - created)
+            batch = []
+            for _ in range(size):
+                check_in = today + timedelta(days=rng.randrange(-365, 730))
+                nights = rng.randrange(1, 14)
+                batch.append(Booking(
+                    guest=rng.choice(guests),
+                    property=rng.choice(properties),
+                    check_in_date=check_in,
+                    check_out_date=check_in + timedelta(days=nights),
+                    total_price=nights * 5000,
+                    status=rng.choice(statuses),
+                ))
+            Booking.objects.bulk_create(batch)
+            created += size
+            self.stdout.write(f'\rSeeded {created}/{booking_count} bookings', ending='')
+        self.stdout.write(f'\nSeeded bookings in {time.perf_counter() - start:.1f}s')
+
+        WaitListEntry.objects.bulk_create([
+            WaitListEntry(guest=rng.choice(guests), related_property=rng.choice(properties),
+                          confirmed=rng.random() < 0.3)
+            for _ in range(booking_count // 10)
+        ], batch_size=batch_size)
+
+    def report(self, label, build_queryset, run, iterations):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'\n{label}'))
+        self.stdout.write(build_queryset().explain())
+
+        timings = []
+        for _ in range(iterations):
+            queryset = build_queryset()
+            start = time.perf_counter()
+            run(queryset)
+            timings.append((time.perf_counter() - start) * 1000)
+
+        percentiles = statistics.quantiles(timings, n=100)
+        self.stdout.write(
+            f'p50 {percentiles[49]:.3f} ms  p99 {percentiles[98]:.3f} ms  '
+            f'max {max(timings):.3f} ms over {iterations} queries'
+        )
@@ -0,0 +1,116 @@
+import asyncio
+import json
+import statistics
+import time
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from authapp.models import User
+from booking.models import Conversation
+from booking.routing import websocket_urlpatterns
+
+BENCH_PREFIX = 'benchlayer_'
+
+
+class Command(BaseCommand):
+    help = (
+        'Fan chat_message events out to rooms of ChatConsumer clients through each channel layer '
+        'of CHANNEL_LAYER_BACKENDS and report frames/sec and delivery latency per room size. '
+        'Events are group_send straight to the room, message persistence is left out.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backends', nargs='+', default=['local', 'memory', 'redis'])
+        parser.add_argument('--room-sizes', nargs='+', type=int, default=[2, 10, 50, 200])
+        parser.add_argument('--messages', type=int, default=200, help='Events sent to each room')
+
+    def handle(self, *args, **options):
+        backends = dict(settings.CHANNEL_LAYER_BACKENDS)
+        if getattr(settings, 'CHANNEL_LAYER', None) == 'redis':
+            # honour REDIS_CHANNEL_URL
+            backends['redis'] = settings.CHANNEL_LAYERS['default']
+
+        biggest = max(options['room_sizes'])
+        User.objects.bulk_create([
+            User(username=f'{BENCH_PREFIX}{i}', email=f'{BENCH_PREFIX}{i}@fastbook.io') for i in range(biggest)
+        ])
+        users = list(User.objects.filter(username__startswith=BENCH_PREFIX).order_by('id'))
+        rooms = {}
+        try:
+            for size in options['room_sizes']:
+                conversation = Conversation.objects.create()
+                conversation.participants.set(users[:size])
+                rooms[size] = (conversation.id, [user.id for user in users[:size]])
+
+            for backend in options['backends']:
+                self.stdout.write(self.style.MIGRATE_HEADING(f'\n{backend}'))
+                with override_settings(CHANNEL_LAYERS={'default': backends[backend]}):
+                    for size, (conversation_id, members) in rooms.items():
+                        try:
+                            result = asyncio.run(self.run(conversation_id, members, options['messages']))
+                        except Exception as e:
+                            self.stdout.write(self.style.ERROR(f'skipped: {type(e).__name__}: {e}'))
+                            break
+                        self.report(size, *result)
+        finally:
+            Conversation.objects.filter(id__in=[conversation_id for conversation_id, _ in rooms.values()]).delete()
+            User.objects.filter(username__startswith=BENCH_PREFIX).delete()
+
+    async def run(self, conversation_id, members, messages):
+        application = URLRouter(websocket_urlpatterns)
+        clients = []
+        try:
+            for user_id in members:
+                communicator = WebsocketCommunicator(application, f'/ws/chat/{conversation_id}/')
+                communicator.scope['user_id'] = user_id
+                connected, _ = await communicator.connect(timeout=5)
+                if not connected:
+                    raise RuntimeError(f'client {user_id} could not join conversation {conversation_id}')
+                clients.append(communicator)
+
+            layer = get_channel_layer()
+            group = f'chat_{conversation_id}'
+            sender = {'id': members[0], 'username': f'{BENCH_PREFIX}0'}
+            latencies = []
+            progress = asyncio.Event()
+            # events in flight per client, kept under the layers' default channel capacity (100)
+            # so nothing is dropped and the numbers measure delivery, not loss
+            window = 50
+
+            async def read(communicator):
+                received = 0
+                while received < messages:
+                    frame = json.loads(await communicator.receive_from(timeout=30))
+                    # presence of the other clients joining
+                    if frame['type'] != 'message':
+                        continue
+                    latencies.append(time.perf_counter() - float(frame['content']))
+                    received += 1
+                    progress.set()
+
+            async def write():
+                for i in range(messages):
+                    while len(latencies) < (i - window) * len(clients):
+                        progress.clear()
+                        await progress.wait()
+                    await layer.group_send(group, {
+                        'type': 'chat_message', 'id': i, 'sender': sender,
+                        'content': str(time.perf_counter()), 'created_at': None,
+                    })
+
+            started = time.perf_counter()
+            await asyncio.gather(write(), *(read(communicator) for communicator in clients))
+            return time.perf_counter() - started, latencies
+        finally:
+            await asyncio.gather(*(communicator.disconnect() for communicator in clients), return_exceptions=True)
+
+    def report(self, size, elapsed, latencies):
+        latencies.sort()
+        self.stdout.write(
+            f'room of {size:>4}: {len(latencies) / elapsed:>8.0f} frames/s   '
+            f'p50 {statistics.median(latencies) * 1000:.2f}ms   '
+            f'p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.2f}ms'
+        )
@@ -0,0 +1,100 @@
+import random
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from authapp.models import User
+from booking import geo
+from booking.models import City, Property
+
+BENCH_HOST = 'bench_geo_host'
+# listings concentrate around cities, the rest is spread over the country
+CITIES = [(36.75, 3.06), (35.70, -0.63), (36.36, 6.61), (36.90, 7.76), (34.88, -1.32), (36.19, 5.41), (31.61, -2.22)]
+COUNTRY = (19.0, -8.6, 37.1, 11.9)
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed properties with coordinates in growing steps and report p50 latency of radius and bounding '
+        'box searches through the geohash grid index against the same searches on the raw coordinates.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='25000,50000,100000,200000',
+                            help='Comma separated listing counts, seeded cumulatively')
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--radius', type=float, default=5.0, help='Radius of the searches in km')
+        parser.add_argument('--batch-size', type=int, default=10_000)
+        parser.add_argument('--cleanup', action='store_true', help='Delete the seeded rows and exit')
+
+    def handle(self, *args, **options):
+        if options['cleanup']:
+            deleted, _ = User.objects.filter(username=BENCH_HOST).delete()
+            self.stdout.write(f'Deleted {deleted} benchmark rows')
+            return
+
+        host, _ = User.objects.get_or_create(username=BENCH_HOST, defaults={'email': 'bench_geo_host@fastbook.io'})
+        self.rng = random.Random(11)
+        radius = options['radius']
+        self.stdout.write(f'{"listings":>9} {"search":<7} {"grid p50":>10} {"scan p50":>10} {"rows":>6}')
+        for size in map(int, options['sizes'].split(',')):
+            self.seed(host, size, options['batch_size'])
+            queries = [self.random_point() for _ in range(options['iterations'])]
+
+            def grid_radius(point):
+                return geo.within_radius(Property.objects.all(), *point, radius)
+
+            def scan_radius(point):
+                return (
+                    Property.objects.annotate(distance=geo.distance_km(*point))
+                    .filter(distance__lte=radius).order_by('distance', 'id')
+                )
+
+            def grid_bbox(point):
+                return geo.within_bbox(Property.objects.all(), *geo.bounding_box(*point, radius))
+
+            def scan_bbox(point):
+                south, west, north, east = geo.bounding_box(*point, radius)
+                return Property.objects.filter(Q(latitude__range=(south, north), longitude__range=(west, east)))
+
+            for label, grid, scan in (('radius', grid_radius, scan_radius), ('bbox', grid_bbox, scan_bbox)):
+                grid_p50, rows = self.measure(grid, queries)
+                scan_p50, scan_rows = self.measure(scan, queries)
+                assert rows == scan_rows, 'the grid search must return what the scan returns'
+                self.stdout.write(f'{size:>9} {label:<7} {grid_p50:>8.3f}ms {scan_p50:>8.3f}ms {rows / len(queries):>6.1f}')
+
+        self.stdout.write(self.style.MIGRATE_HEADING('\nplan of a radius search'))
+        self.stdout.write(grid_radius(queries[0]).explain())
+
+    def random_point(self):
+        latitude, longitude = self.rng.choice(CITIES)
+        return latitude + self.rng.gauss(0, 0.2), longitude + self.rng.gauss(0, 0.2)
+
+    def seed(self, host, size, batch_size):
+        existing = Property.objects.filter(host=host).count()
+        city = City.for_names(['Alger'])['Alger']
+        while existing < size:
+            batch = []
+            for i in range(existing, min(size, existing + batch_size)):
+                if self.rng.random() < 0.7:
+                    latitude, longitude = self.random_point()
+                else:
+                    south, west, north, east = COUNTRY
+                    latitude, longitude = self.rng.uniform(south, north), self.rng.uniform(west, east)
+                property = Property(title=f'Bench geo {i}', address='bench', city_name=city.name, city=city, max_guests=4,
+                                    price_per_night=self.rng.randrange(2000, 20000), host=host,
+                                    latitude=latitude, longitude=longitude)
+                property.set_geohash()
+                batch.append(property)
+            Property.objects.bulk_create(batch)
+            existing += len(batch)
+            self.stderr.write(f'\rSeeded {existing}/{size} listings', ending='')
+        self.stderr.write('')
+
+    def measure(self, build_queryset, queries):
+        timings, rows = [], 0
+        for point in queries:
+            start = time.perf_counter()
+            rows += len(list(build_queryset(point).values_list('id', flat=True)))
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings), rows
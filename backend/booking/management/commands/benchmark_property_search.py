@@ -0,0 +1,89 @@
+import random
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Q
+from authapp.models import User
+from booking.models import City, Property
+from booking.search import search
+
+BENCH_HOST = 'bench_search_host'
+KINDS = ['villa', 'studio', 'apartment', 'house', 'riad', 'chalet', 'duplex', 'loft']
+CITIES = ['Alger', 'Oran', 'Constantine', 'Annaba', 'Tlemcen', 'Bejaia', 'Setif', 'Ghardaia', 'Tamanrasset', 'Blida']
+WORDS = [
+    'sea', 'view', 'pool', 'garden', 'quiet', 'family', 'center', 'beach', 'mountain', 'terrace', 'modern',
+    'traditional', 'spacious', 'cozy', 'parking', 'wifi', 'balcony', 'desert', 'luxury', 'bright', 'renovated',
+]
+# searches as typed in the search box: whole words, word starts, several words and typos
+QUERIES = {
+    'word': ['villa', 'oran', 'pool', 'terrace', 'chalet'],
+    'prefix': ['vil', 'const', 'terr', 'tlem', 'bea'],
+    'words': ['villa oran', 'studio sea view', 'quiet garden alger', 'pool family'],
+    'typo': ['vila', 'constantin', 'anaba', 'ghardia', 'apartement'],
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed listings with generated text and report p50/p99 latency of the ranked search (`q=`) '
+        'against the icontains matching SearchFilter used to do, with the query plan of a search.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=100_000)
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--batch-size', type=int, default=10_000)
+        parser.add_argument('--no-seed', action='store_true', help='Reuse previously seeded rows')
+        parser.add_argument('--cleanup', action='store_true', help='Delete the seeded rows and exit')
+
+    def handle(self, *args, **options):
+        if options['cleanup']:
+            deleted, _ = User.objects.filter(username=BENCH_HOST).delete()
+            self.stdout.write(f'Deleted {deleted} benchmark rows')
+            return
+        if not options['no_seed']:
+            self.seed(options['listings'], options['batch_size'])
+
+        self.stdout.write(f'{connection.vendor}, {Property.objects.count()} listings')
+        self.stdout.write(f'{"query":<8} {"search p50":>11} {"p99":>9} {"rows":>6}   {"icontains p50":>13} {"p99":>9} {"rows":>6}')
+        for kind, texts in QUERIES.items():
+            ranked = self.measure(lambda text: search(Property.objects.all(), text)[:20], texts, options['iterations'])
+            contains = self.measure(
+                lambda text: Property.objects.filter(Q(title__icontains=text) | Q(description__icontains=text))[:20],
+                texts, options['iterations'],
+            )
+            self.stdout.write(f'{kind:<8} {ranked[0]:>9.2f}ms {ranked[1]:>7.2f}ms {ranked[2]:>6.1f}   '
+                              f'{contains[0]:>11.2f}ms {contains[1]:>7.2f}ms {contains[2]:>6.1f}')
+
+        self.stdout.write(self.style.MIGRATE_HEADING('\nplan of a search'))
+        self.stdout.write(search(Property.objects.all(), 'villa oran')[:20].explain())
+
+    def seed(self, count, batch_size):
+        rng = random.Random(5)
+        host, _ = User.objects.get_or_create(username=BENCH_HOST, defaults={'email': 'bench_search_host@fastbook.io'})
+        cities = City.for_names(CITIES)
+        created = 0
+        while created < count:
+            batch = []
+            for i in range(created, min(count, created + batch_size)):
+                kind, city = rng.choice(KINDS), rng.choice(CITIES)
+                batch.append(Property(
+                    title=f'{kind.title()} {" ".join(rng.sample(WORDS, 2))} {city}'[:50],
+                    city_name=city, city=cities[city], category=kind, address=f'{rng.randrange(1, 200)} rue {rng.choice(WORDS)}',
+                    description=' '.join(rng.choices(WORDS, k=30)), max_guests=4,
+                    price_per_night=rng.randrange(2000, 20000), host=host,
+                ))
+            Property.objects.bulk_create(batch)
+            created += len(batch)
+            self.stderr.write(f'\rSeeded {created}/{count} listings', ending='')
+        self.stderr.write('')
+
+    def measure(self, build_queryset, texts, iterations):
+        timings, rows = [], 0
+        for i in range(iterations):
+            start = time.perf_counter()
+            rows += len(list(build_queryset(texts[i % len(texts)]).values_list('id', flat=True)))
+            timings.append((time.perf_counter() - start) * 1000)
+        percentiles = statistics.quantiles(timings, n=100)
+        return percentiles[49], percentiles[98], rows / iterations
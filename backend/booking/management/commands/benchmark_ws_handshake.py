@@ -0,0 +1,74 @@
+import asyncio
+import statistics
+import time
+from channels.db import database_sync_to_async
+from django.core.management.base import BaseCommand
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from authapp.models import User
+from booking.middleware import JWTAuthMiddlewareStack
+
+
+class ThreadPoolJWTAuth(JWTAuthMiddlewareStack):
+    """The handshake as it used to run: every token decoded on the sync thread pool, nothing remembered."""
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope, user_id=await database_sync_to_async(self.decode)(self.get_token_from_scope(scope)))
+        return await self.inner(scope, receive, send)
+
+    def decode(self, token):
+        return AccessToken(token)[api_settings.USER_ID_CLAIM]
+
+
+async def accept_scope(scope, receive, send):
+    return scope.get('user_id')
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure websocket handshakes/sec through the JWT auth middleware: the previous thread pool '
+        'path, the event loop path with every token new (cold) and with tokens seen before (warm). '
+        'Only the auth step runs, the consumer and the channel layer are left out.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--handshakes', type=int, default=5000)
+        parser.add_argument('--concurrency', type=int, default=100, help='Handshakes in flight at once')
+        parser.add_argument('--users', type=int, default=200, help='Distinct tokens of the warm run')
+
+    def handle(self, *args, **options):
+        count = options['handshakes']
+        # tokens are signed for unsaved users, the middleware never reads the database
+        cold_tokens = [str(AccessToken.for_user(User(id=i % 1000 + 1))) for i in range(count)]
+        warm_pool = [str(AccessToken.for_user(User(id=i + 1))) for i in range(options['users'])]
+        warm_tokens = [warm_pool[i % len(warm_pool)] for i in range(count)]
+
+        runs = [
+            ('thread pool (previous)', ThreadPoolJWTAuth(accept_scope), cold_tokens),
+            ('event loop, cold cache', JWTAuthMiddlewareStack(accept_scope), cold_tokens),
+            ('event loop, warm cache', JWTAuthMiddlewareStack(accept_scope), warm_tokens),
+        ]
+        for label, middleware, tokens in runs:
+            elapsed, latencies = asyncio.run(self.run(middleware, tokens, options['concurrency']))
+            latencies.sort()
+            self.stdout.write(
+                f'{label:<24} {len(tokens) / elapsed:>8.0f} handshakes/s   '
+                f'p50 {statistics.median(latencies) * 1000:.2f}ms   '
+                f'p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.2f}ms'
+            )
+
+    async def run(self, middleware, tokens, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def handshake(token):
+            scope = {'type': 'websocket', 'query_string': f'token={token}'.encode(), 'headers': []}
+            async with semaphore:
+                start = time.perf_counter()
+                if not await middleware(scope, None, None):
+                    raise RuntimeError('token rejected')
+                latencies.append(time.perf_counter() - start)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(handshake(token) for token in tokens))
+        return time.perf_counter() - started, latencies
@@ -9,11 +9,11 @@ class Command(BaseCommand):
         self.stdout.write(f'Number of properties in database: {property_count}')
         
         if property_count > 0:
-            properties = Property.objects.all()
+            properties = Property.objects.select_related('host').iterator(chunk_size=2000)
             self.stdout.write('\nProperty details:')
             for prop in properties:
                 self.stdout.write(f'\n- {prop.title} (ID: {prop.id})')
                 self.stdout.write(f'  Host: {prop.host.username}')
                 self.stdout.write(f'  Available: {prop.is_available}')
-                self.stdout.write(f'  City: {prop.city}')
+                self.stdout.write(f'  City: {prop.city_name}')
                 self.stdout.write(f'  Price: ${prop.price_per_night}/night')
@@ -0,0 +1,62 @@
+import csv
+import json
+import sys
+import time
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from booking.models import Property
+
+# the CreatePropertySerializer fields with the host username, so an export can be fed back to import_properties
+EXPORT_FIELDS = [
+    'id', 'title', 'city', 'address', 'price_per_night', 'max_guests', 'description', 'category',
+    'latitude', 'longitude', 'host',
+]
+# the model columns behind the exported names that differ
+EXPORT_COLUMNS = {'city': 'city_name', 'host': 'host__username'}
+
+
+class Command(BaseCommand):
+    help = 'Stream properties to a CSV or JSONL file (`-` for stdout) without loading them all in memory.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to the file extension')
+        parser.add_argument('--host', help='Only export the properties of this username')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+
+        queryset = Property.objects.order_by('id')
+        if options['host']:
+            queryset = queryset.filter(host__username=options['host'])
+        # the host username comes from the join, rows are plain tuples fetched chunk by chunk
+        columns = [EXPORT_COLUMNS.get(field, field) for field in EXPORT_FIELDS]
+        rows = (
+            dict(zip(EXPORT_FIELDS, values)) for values in
+            queryset.values_list(*columns).iterator(chunk_size=options['chunk_size'])
+        )
+
+        started = time.perf_counter()
+        exported = 0
+        stream = sys.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+        try:
+            if file_format == 'csv':
+                writer = csv.DictWriter(stream, fieldnames=EXPORT_FIELDS)
+                writer.writeheader()
+                for row in rows:
+                    writer.writerow(row)
+                    exported += 1
+            else:
+                for row in rows:
+                    stream.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+                    exported += 1
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+
+        elapsed = time.perf_counter() - started
+        self.stderr.write(self.style.SUCCESS(
+            f'Exported {exported} properties in {elapsed:.1f}s ({exported / max(elapsed, 1e-9):.0f} rows/s)'
+        ))
@@ -0,0 +1,113 @@
+import csv
+import json
+import sys
+import time
+from itertools import islice
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from authapp.models import User
+from booking.cache import AUTOCOMPLETE_VERSION_KEY, LIST_VERSION_KEY, bump_version
+from booking.models import City, Property
+from booking.serializers import CreatePropertySerializer
+
+
+def read_rows(stream, file_format):
+    if file_format == 'csv':
+        # csv has no null, an empty cell is a missing value (e.g. a property exported without coordinates)
+        for row in csv.DictReader(stream):
+            yield {key: value for key, value in row.items() if value != ''}
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream properties from a CSV or JSONL file (`-` for stdin) and insert them in batches. '
+        'Rows are validated with the CreatePropertySerializer rules, invalid rows are reported and skipped. '
+        'The host is --host for every row, or the username in a `host` column.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to the file extension')
+        parser.add_argument('--host', help='Username owning every imported property')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Validate only, nothing is written')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        # NOTE: hosts and cities are resolved once per batch and remembered, never looked up per row
+        self.hosts, self.cities = {}, {}
+        self.dry_run = options['dry_run']
+        if options['host']:
+            try:
+                self.default_host = User.objects.get(username=options['host'])
+            except User.DoesNotExist:
+                raise CommandError(f'No user named {options["host"]}')
+        else:
+            self.default_host = None
+
+        self.imported = self.skipped = 0
+        started = time.perf_counter()
+
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            rows = enumerate(read_rows(stream, file_format), start=1)
+            while batch := list(islice(rows, options['batch_size'])):
+                properties = self.build(batch)
+                if properties and not options['dry_run']:
+                    with transaction.atomic():
+                        Property.objects.bulk_create(properties)
+                self.imported += len(properties)
+                self.stderr.write(f'\r{self.imported} rows imported, {self.skipped} skipped', ending='')
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        # bulk_create sends no post_save, drop the cached listing pages and autocomplete indexes once for the whole import
+        if self.imported and not options['dry_run']:
+            bump_version(LIST_VERSION_KEY)
+            bump_version(AUTOCOMPLETE_VERSION_KEY)
+
+        elapsed = time.perf_counter() - started
+        self.stderr.write('')
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Validated" if options["dry_run"] else "Imported"} {self.imported} properties, '
+            f'skipped {self.skipped} in {elapsed:.1f}s ({(self.imported + self.skipped) / max(elapsed, 1e-9):.0f} rows/s)'
+        ))
+
+    def build(self, batch):
+        if not self.default_host:
+            usernames = {row.get('host') for _, row in batch} - self.hosts.keys() - {None, ''}
+            self.hosts.update(User.objects.filter(username__in=usernames).in_bulk(field_name='username'))
+
+        properties = []
+        for line, row in batch:
+            host = self.default_host or self.hosts.get(row.get('host'))
+            if host is None:
+                self.reject(line, {'host': [f'No user named {row.get("host")!r}']})
+                continue
+            # a serializer per row as the API does, validators may keep state on the instance
+            serializer = CreatePropertySerializer(data=row)
+            if not serializer.is_valid():
+                self.reject(line, serializer.errors)
+                continue
+            property = Property(host=host, **serializer.validated_data)
+            property.set_geohash()
+            properties.append(property)
+
+        # a dry run creates no City, the names stay as typed
+        if not self.dry_run:
+            # in file order, a new City is named after the first spelling seen
+            names = [name for name in dict.fromkeys(property.city_name for property in properties) if name not in self.cities]
+            self.cities.update(City.for_names(names))
+            for property in properties:
+                property.set_city(self.cities.get(property.city_name))
+        return properties
+
+    def reject(self, line, errors):
+        self.skipped += 1
+        self.stderr.write(f'\nrow {line} skipped: {json.dumps(errors)}')
@@ -0,0 +1,126 @@
+import asyncio
+import json
+import statistics
+import time
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from authapp.models import User
+from booking.message_buffer import message_buffer
+from booking.models import Conversation, Message
+from booking.routing import websocket_urlpatterns
+
+LOADTEST_PREFIX = 'loadchat_'
+
+
+class Command(BaseCommand):
+    help = (
+        'Connect many simulated websocket clients to ChatConsumer in process, spread over a few '
+        'conversations, have each send messages and report messages/sec, end to end latency '
+        '(send -> broadcast received by every member of the room) and how many messages were persisted.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=200)
+        parser.add_argument('--rooms', type=int, default=20)
+        parser.add_argument('--messages', type=int, default=10, help='Messages sent by each client')
+        parser.add_argument('--rate', type=float, default=0, help='Messages/sec per client, 0 sends as fast as possible')
+        parser.add_argument('--flush-interval', type=float, help='Override CHAT_FLUSH_INTERVAL')
+        parser.add_argument('--batch-size', type=int, help='Override CHAT_FLUSH_BATCH_SIZE')
+        parser.add_argument('--in-memory', action='store_true', help='Use InMemoryChannelLayer instead of CHANNEL_LAYERS')
+
+    def handle(self, *args, **options):
+        if options['flush_interval'] is not None:
+            message_buffer.flush_interval = options['flush_interval']
+        if options['batch_size'] is not None:
+            message_buffer.batch_size = options['batch_size']
+
+        rooms = self.create_rooms(options['clients'], options['rooms'])
+        try:
+            if options['in_memory']:
+                layers = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+                with override_settings(CHANNEL_LAYERS=layers):
+                    asyncio.run(self.run(rooms, options['messages'], options['rate']))
+            else:
+                asyncio.run(self.run(rooms, options['messages'], options['rate']))
+        finally:
+            Conversation.objects.filter(id__in=rooms).delete()
+            User.objects.filter(username__startswith=LOADTEST_PREFIX).delete()
+
+    def create_rooms(self, clients, room_count):
+        User.objects.bulk_create([
+            User(username=f'{LOADTEST_PREFIX}{i}', email=f'{LOADTEST_PREFIX}{i}@fastbook.io')
+            for i in range(clients)
+        ])
+        users = list(User.objects.filter(username__startswith=LOADTEST_PREFIX).order_by('id'))
+        rooms = {}
+        for i in range(room_count):
+            members = users[i::room_count]
+            if not members:
+                continue
+            conversation = Conversation.objects.create()
+            conversation.participants.set(members)
+            rooms[conversation.id] = [user.id for user in members]
+        return rooms
+
+    async def run(self, rooms, messages, rate):
+        application = URLRouter(websocket_urlpatterns)
+        clients = []
+        for conversation_id, members in rooms.items():
+            for user_id in members:
+                communicator = WebsocketCommunicator(application, f'/ws/chat/{conversation_id}/')
+                communicator.scope['user_id'] = user_id
+                connected, _ = await communicator.connect()
+                if not connected:
+                    raise RuntimeError(f'client {user_id} could not join conversation {conversation_id}')
+                clients.append((communicator, user_id, len(members)))
+        self.stdout.write(f'{len(clients)} clients connected to {len(rooms)} conversations')
+
+        latencies = []
+
+        async def read(communicator, expected):
+            received = 0
+            while received < expected:
+                frame = json.loads(await communicator.receive_from(timeout=30))
+                # presence of the other clients joining
+                if frame['type'] != 'message':
+                    continue
+                latencies.append(time.perf_counter() - float(frame['message'].rsplit(':', 1)[-1]))
+                received += 1
+
+        async def write(communicator, user_id):
+            for seq in range(messages):
+                content = f'{user_id}:{seq}:{time.perf_counter()}'
+                await communicator.send_to(text_data=json.dumps({'message': content}))
+                await asyncio.sleep(1 / rate if rate else 0)
+
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(read(communicator, room_size * messages) for communicator, _, room_size in clients),
+            *(write(communicator, user_id) for communicator, user_id, _ in clients),
+        )
+        delivered = time.perf_counter() - started
+        await message_buffer.flush()
+        persisted_at = time.perf_counter() - started
+
+        for communicator, *_ in clients:
+            await communicator.disconnect()
+
+        sent = len(clients) * messages
+        persisted = await database_sync_to_async(Message.objects.filter(conversation_id__in=rooms).count)()
+        latencies.sort()
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'\nflush interval {message_buffer.flush_interval}s, batch size {message_buffer.batch_size}'))
+        self.stdout.write(
+            f'{sent} messages sent, {len(latencies)} frames delivered in {delivered:.2f}s '
+            f'({sent / delivered:.0f} msg/s, {len(latencies) / delivered:.0f} frames/s)'
+        )
+        self.stdout.write(
+            f'latency p50 {statistics.median(latencies) * 1000:.1f}ms  '
+            f'p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f}ms  '
+            f'max {latencies[-1] * 1000:.1f}ms'
+        )
+        style = self.style.SUCCESS if persisted == sent else self.style.ERROR
+        self.stdout.write(style(f'{persisted}/{sent} messages persisted after {persisted_at:.2f}s'))
@@ -0,0 +1,117 @@
+import random
+import threading
+import time
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+from rest_framework.exceptions import ValidationError
+from authapp.models import User
+from booking.availability import BLOCKING_STATUSES
+from booking.models import Booking, Property
+from booking.serializers import BookingSerializer
+
+STRESS_PREFIX = 'stress_'
+
+
+class Command(BaseCommand):
+    help = (
+        'Create bookings from many threads at once and check that no two active bookings of a '
+        'property overlap. Runs a contended phase (every thread on the same few properties) and a '
+        'non conflicting phase (one property per thread) to compare throughput. Needs a database '
+        'with row locks (PostgreSQL/MySQL), SQLite serializes writers on its own.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=32)
+        parser.add_argument('--attempts', type=int, default=25, help='Booking attempts per thread')
+        parser.add_argument('--contended-properties', type=int, default=2)
+
+    def handle(self, *args, **options):
+        threads = options['threads']
+        attempts = options['attempts']
+        guest = User.objects.create(username=f'{STRESS_PREFIX}guest', email='stress_guest@fastbook.io')
+        host = User.objects.create(username=f'{STRESS_PREFIX}host', email='stress_host@fastbook.io')
+        try:
+            contended = self.create_properties(host, options['contended_properties'])
+            self.run_phase('contended', guest, attempts, [contended] * threads)
+
+            dedicated = self.create_properties(host, threads)
+            self.run_phase('non conflicting', guest, attempts, [[prop] for prop in dedicated])
+        finally:
+            User.objects.filter(username__startswith=STRESS_PREFIX).delete()
+
+    def create_properties(self, host, count):
+        return [
+            Property.objects.create(title=f'Stress {i}', address='stress', city_name='Alger',
+                                    max_guests=2, price_per_night=5000, host=host)
+            for i in range(count)
+        ]
+
+    def run_phase(self, label, guest, attempts, properties_per_thread):
+        results = {'created': 0, 'rejected': 0, 'errors': 0}
+        lock = threading.Lock()
+        start_day = date.today() + timedelta(days=30)
+
+        def worker(properties, seed):
+            rng = random.Random(seed)
+            close_old_connections()
+            try:
+                for _ in range(attempts):
+                    check_in = start_day + timedelta(days=rng.randrange(60))
+                    serializer = BookingSerializer(
+                        data={
+                            'check_in_date': check_in,
+                            'check_out_date': check_in + timedelta(days=rng.randrange(1, 5)),
+                        },
+                        context={'property_id': rng.choice(properties).id, 'user': guest.id},
+                    )
+                    try:
+                        serializer.is_valid(raise_exception=True)
+                        serializer.save()
+                        outcome = 'created'
+                    except ValidationError:
+                        outcome = 'rejected'
+                    except Exception as e:
+                        self.stderr.write(f'{type(e).__name__}: {e}')
+                        outcome = 'errors'
+                    with lock:
+                        results[outcome] += 1
+            finally:
+                connection.close()
+
+        pool = [
+            threading.Thread(target=worker, args=(properties, seed))
+            for seed, properties in enumerate(properties_per_thread)
+        ]
+        started = time.perf_counter()
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        property_ids = {prop.id for properties in properties_per_thread for prop in properties}
+        double_bookings = self.count_double_bookings(property_ids)
+        total = sum(results.values())
+        self.stdout.write(self.style.MIGRATE_HEADING(f'\n{label}'))
+        self.stdout.write(
+            f"{len(pool)} threads, {total} attempts in {elapsed:.2f}s ({total / elapsed:.0f} req/s): "
+            f"{results['created']} created, {results['rejected']} rejected, {results['errors']} errors"
+        )
+        style = self.style.SUCCESS if double_bookings == 0 else self.style.ERROR
+        self.stdout.write(style(f'double bookings: {double_bookings}'))
+
+    def count_double_bookings(self, property_ids):
+        bookings = Booking.objects.filter(
+            property_id__in=property_ids, status__in=BLOCKING_STATUSES
+        ).order_by('property_id', 'check_in_date').values_list('property_id', 'check_in_date', 'check_out_date')
+
+        overlaps = 0
+        previous_property, previous_check_out = None, None
+        for property_id, check_in, check_out in bookings:
+            if property_id == previous_property and check_in < previous_check_out:
+                overlaps += 1
+            if property_id != previous_property or check_out > previous_check_out:
+                previous_check_out = check_out
+            previous_property = property_id
+        return overlaps
@@ -0,0 +1,201 @@
+import asyncio
+import atexit
+import logging
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import DataError, IntegrityError, close_old_connections, connection, transaction
+from django.db.models import Max
+from django.utils.timezone import now
+from .models import Conversation, ConversationReadState, Message
+
+logger = logging.getLogger(__name__)
+
+
+class MessageBuffer:
+    """
+    Write-behind buffer shared by every ChatConsumer of the process.
+    * messages are queued in memory and written with one bulk_create per flush
+    * a flush runs at most `flush_interval` seconds after the first queued message, or as soon as
+      `batch_size` messages are waiting, so a busy room costs one insert per interval instead of one per frame
+    * whatever is still queued is written when a consumer disconnects and at interpreter exit
+    add() returns a future resolved with the saved Message, None when it can't be stored (its conversation
+    doesn't exist, its sender was deleted, ...). a failing flush is retried unless a row itself is at fault
+    """
+
+    def __init__(self, flush_interval=None, batch_size=None):
+        self.flush_interval = flush_interval or getattr(settings, 'CHAT_FLUSH_INTERVAL', 0.1)
+        self.batch_size = batch_size or getattr(settings, 'CHAT_FLUSH_BATCH_SIZE', 500)
+        self._pending = []
+        self._flush_handle = None
+        self._flush_lock = None
+
+    def add(self, conversation_id, sender_id, content):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((int(conversation_id), sender_id, content, future))
+        if len(self._pending) >= self.batch_size:
+            self._schedule(loop, 0)
+        elif self._flush_handle is None:
+            self._schedule(loop, self.flush_interval)
+        return future
+
+    def _schedule(self, loop, delay):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        self._flush_handle = loop.call_later(delay, lambda: asyncio.ensure_future(self.flush()))
+
+    async def flush(self):
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            self._flush_handle = None
+            batch, self._pending = self._pending, []
+            if not batch:
+                return
+            try:
+                saved = await database_sync_to_async(self._write)(batch)
+            except Exception:
+                # database unreachable: keep them queued (in order) and try again on the next interval
+                logger.exception('Failed to flush %s chat messages, retrying', len(batch))
+                self._pending = batch + self._pending
+                self._schedule(asyncio.get_running_loop(), self.flush_interval)
+                return
+            for (*_, future), message in zip(batch, saved):
+                if not future.done():
+                    future.set_result(message)
+
+    def flush_sync(self):
+        """Write what is left without an event loop, used at interpreter exit."""
+        batch, self._pending = self._pending, []
+        if batch:
+            close_old_connections()
+            self._write(batch)
+
+    def _write(self, batch):
+        conversation_ids = {conversation_id for conversation_id, *_ in batch}
+        existing = set(Conversation.objects.filter(id__in=conversation_ids).values_list('id', flat=True))
+        messages = [
+            Message(conversation_id=conversation_id, sender_id=sender_id, content=content)
+            if conversation_id in existing else None
+            for conversation_id, sender_id, content, *_ in batch
+        ]
+        saved = [message for message in messages if message is not None]
+        try:
+            with transaction.atomic():
+                if connection.features.can_return_rows_from_bulk_insert:
+                    Message.objects.bulk_create(saved)
+                else:
+                    # MySQL doesn't return the ids of a multi-row insert and the broadcast needs them,
+                    # still one transaction per flush instead of one per frame
+                    for message in saved:
+                        message.save()
+                # one UPDATE bumps every touched conversation so the inbox ordering stays right
+                Conversation.objects.filter(id__in=existing).update(updated_at=now())
+        except (IntegrityError, DataError):
+            # a row the database refuses would fail every retry of the batch, the others are written one by one
+            return self._write_each(messages, existing)
+        return messages
+
+    def _write_each(self, messages, existing):
+        for i, message in enumerate(messages):
+            if message is None:
+                continue
+            message.pk, message._state.adding = None, True
+            try:
+                with transaction.atomic():
+                    message.save()
+            except (IntegrityError, DataError):
+                logger.exception('Dropping a chat message of user %s in conversation %s',
+                                 message.sender_id, message.conversation_id)
+                messages[i] = None
+        Conversation.objects.filter(id__in=existing).update(updated_at=now())
+        return messages
+
+
+class ReadStateBuffer:
+    """
+    Read positions sent by ChatConsumer, written lazily as one ConversationReadState per participant.
+    * mark() only keeps the highest message id in memory, reading a whole thread costs no query
+    * pending positions are written every `flush_interval` seconds, when a consumer disconnects and
+      at interpreter exit, with the same few queries however many there are
+    * a stored position never moves backwards, nor past the latest message of the conversation
+    """
+
+    def __init__(self, flush_interval=None):
+        self.flush_interval = flush_interval or getattr(settings, 'CHAT_READ_FLUSH_INTERVAL', 5)
+        self._pending = {}
+        self._flush_handle = None
+
+    def mark(self, conversation_id, user_id, message_id):
+        """Remember the position, False when it isn't past the one already pending."""
+        key = (int(conversation_id), user_id)
+        if message_id <= self._pending.get(key, 0):
+            return False
+        self._pending[key] = message_id
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(
+                self.flush_interval, lambda: asyncio.ensure_future(self.flush()))
+        return True
+
+    async def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            await database_sync_to_async(self._write)(pending)
+        except Exception:
+            logger.exception('Failed to flush %s read positions, retrying', len(pending))
+            for key, message_id in pending.items():
+                self._pending[key] = max(message_id, self._pending.get(key, 0))
+            if self._flush_handle is None:
+                self._flush_handle = asyncio.get_running_loop().call_later(
+                    self.flush_interval, lambda: asyncio.ensure_future(self.flush()))
+
+    def save(self, conversation_id, user_id, message_id):
+        """Write one position right away with the rules of a flush, for callers without an event loop."""
+        self._write({(int(conversation_id), user_id): message_id})
+
+    def flush_sync(self):
+        """Write what is left without an event loop, used at interpreter exit."""
+        pending, self._pending = self._pending, {}
+        if pending:
+            close_old_connections()
+            self._write(pending)
+
+    def _write(self, pending):
+        conversation_ids = {conversation_id for conversation_id, _ in pending}
+        existing = set(Conversation.objects.filter(id__in=conversation_ids).values_list('id', flat=True))
+        latest = dict(
+            Message.objects.filter(conversation_id__in=existing).order_by()
+            .values('conversation_id').annotate(latest=Max('id')).values_list('conversation_id', 'latest')
+        )
+        states = {
+            (state.conversation_id, state.user_id): state
+            for state in ConversationReadState.objects.filter(
+                conversation_id__in=existing, user_id__in={user_id for _, user_id in pending})
+        }
+        updated, created = [], []
+        for (conversation_id, user_id), message_id in pending.items():
+            message_id = min(message_id, latest.get(conversation_id, 0))
+            if conversation_id not in existing or message_id <= 0:
+                continue
+            state = states.get((conversation_id, user_id))
+            if state is None:
+                created.append(ConversationReadState(
+                    conversation_id=conversation_id, user_id=user_id, last_read_message_id=message_id))
+            elif message_id > state.last_read_message_id:
+                # bulk_update skips auto_now
+                state.last_read_message_id, state.updated_at = message_id, now()
+                updated.append(state)
+        with transaction.atomic():
+            ConversationReadState.objects.bulk_update(updated, ['last_read_message_id', 'updated_at'])
+            ConversationReadState.objects.bulk_create(created, ignore_conflicts=True)
+
+
+message_buffer = MessageBuffer()
+read_state_buffer = ReadStateBuffer()
+atexit.register(message_buffer.flush_sync)
+atexit.register(read_state_buffer.flush_sync)
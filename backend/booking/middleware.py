@@ -1,56 +1,107 @@
-import token
+import logging
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs
 from channels.middleware import BaseMiddleware
-from rest_framework_simplejwt.exceptions import InvalidToken
+from django.conf import settings
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
 from rest_framework_simplejwt.tokens import AccessToken
-from channels.db import database_sync_to_async
-from django.contrib.auth import get_user_model
 
 
-User=get_user_model()
+logger=logging.getLogger(__name__)
+
+# browsers can't set headers on a websocket, they send the token as a subprotocol instead:
+# new WebSocket(url, ['bearer', token]), the handshake is then accepted with 'bearer'
+TOKEN_SUBPROTOCOL = 'bearer'
+
+
+class VerifiedTokenCache:
+    """
+    LRU of recently verified access tokens -> (user_id, exp) so reconnects skip the signature check.
+    keyed by the whole token, a valid signature glued to another payload never hits it
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._entries = OrderedDict()
+
+    def get(self, token):
+        entry = self._entries.get(token)
+        if entry is None:
+            return None
+        user_id, exp = entry
+        if exp <= time.time():
+            del self._entries[token]
+            return None
+        self._entries.move_to_end(token)
+        return user_id
+
+    def set(self, token, user_id, exp):
+        self._entries[token] = (user_id, exp)
+        self._entries.move_to_end(token)
+        if len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
 
 class JWTAuthMiddlewareStack(BaseMiddleware):
-    
+    """
+    Put the user id of the access token in scope['user_id'], or an error in scope['error'].
+    Decoding a JWT is pure CPU work so it runs on the event loop, no thread pool hop per handshake.
+    """
+
+    def __init__(self, inner):
+        super().__init__(inner)
+        self.verified_tokens = VerifiedTokenCache(getattr(settings, 'WEBSOCKET_TOKEN_CACHE_SIZE', 1024))
+
     async def __call__(self, scope, receive, send):
-    
         token = self.get_token_from_scope(scope)
-        print(f'token:{token}')
-        
-                
-        if token != None:
-            user_id = await self.get_user_from_token(token)
-            if user_id:
-                scope['user_id']=user_id
-                            
 
+        if token is None:
+            scope['error'] = 'provide an auth token'
+        else:
+            user_id = self.get_user_from_token(token)
+            if user_id:
+                scope['user_id'] = user_id
             else:
                 scope['error'] = 'Invalid token'
 
-        if token == None:
-            scope['error'] = 'provide an auth token'    
-    
-                
         return await super().__call__(scope, receive, send)
 
     def get_token_from_scope(self, scope):
-        query = scope.get('query_string', b'').decode('utf-8')
-        token=query.split('token=')[-1] if 'token=' in query else None
-        # token=token.split('%')[-1]
-        print(token)
-        if token :
-            return token
-        else:
-            return None
-        
-    @database_sync_to_async
+        """
+        The token is read from, in order:
+        * the `token` query param : ws://host/ws/chat/1/?token=<jwt>
+        * an `Authorization: Bearer <jwt>` header, for non browser clients
+        * the subprotocols `bearer, <jwt>`, scope['auth_subprotocol'] then tells the consumer what to accept with
+        """
+        query = parse_qs(scope.get('query_string', b'').decode('latin1'))
+        if query.get('token', [''])[0]:
+            return query['token'][0]
+
+        for name, value in scope.get('headers', []):
+            if name == b'authorization':
+                scheme, _, credentials = value.decode('latin1').partition(' ')
+                if scheme.lower() == 'bearer' and credentials.strip():
+                    return credentials.strip()
+
+        subprotocols = scope.get('subprotocols', [])
+        if TOKEN_SUBPROTOCOL in subprotocols:
+            index = subprotocols.index(TOKEN_SUBPROTOCOL)
+            if index + 1 < len(subprotocols):
+                scope['auth_subprotocol'] = TOKEN_SUBPROTOCOL
+                return subprotocols[index + 1]
+        return None
+
     def get_user_from_token(self, token):
-            try:
-                print('--------')
-                access_token = AccessToken(token)
-                print(f'access_token: {access_token['user_id']}')
-                return access_token['user_id']
-            except InvalidToken:
-                print("Invalid token")
-                return None
-            except Exception as e:
-                print(f"Error decoding token: {e}")
-                return None
+        user_id = self.verified_tokens.get(token)
+        if user_id is not None:
+            return user_id
+        try:
+            access_token = AccessToken(token)
+            user_id = access_token[api_settings.USER_ID_CLAIM]
+        except (TokenError, KeyError) as e:
+            logger.info("Rejected websocket connection with an invalid token: %s", e)
+            return None
+        self.verified_tokens.set(token, user_id, access_token['exp'])
+        return user_id
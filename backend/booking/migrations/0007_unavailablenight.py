@@ -0,0 +1,63 @@
+# Generated by Django 5.1.3 on 2026-10-18 13:50
+
+import django.db.models.deletion
+from datetime import datetime, timedelta
+from django.db import migrations, models
+
+
+def nights_between(check_in, check_out):
+    return [check_in + timedelta(days=x) for x in range((check_out - check_in).days)]
+
+
+def parse_blocked_dates(blocked_dates):
+    dates = set()
+    for value in blocked_dates or []:
+        try:
+            dates.add(datetime.strptime(value, '%Y-%m-%d').date())
+        except (TypeError, ValueError):
+            continue
+    return dates
+
+
+def build_calendar(apps, schema_editor):
+    Property = apps.get_model('booking', 'Property')
+    Booking = apps.get_model('booking', 'Booking')
+    UnavailableNight = apps.get_model('booking', 'UnavailableNight')
+
+    nights = []
+    for prop in Property.objects.only('id', 'blocked_dates').iterator(chunk_size=500):
+        nights.extend(
+            UnavailableNight(related_property_id=prop.id, date=night)
+            for night in parse_blocked_dates(prop.blocked_dates)
+        )
+    bookings = Booking.objects.filter(status__in=['PENDING', 'CONFIRMED']).only(
+        'id', 'property_id', 'check_in_date', 'check_out_date')
+    for booking in bookings.iterator(chunk_size=500):
+        nights.extend(
+            UnavailableNight(related_property_id=booking.property_id, booking_id=booking.id, date=night)
+            for night in nights_between(booking.check_in_date, booking.check_out_date)
+        )
+    UnavailableNight.objects.bulk_create(nights, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0006_property_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UnavailableNight',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('booking', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='nights', to='booking.booking')),
+                ('related_property', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='unavailable_nights', to='booking.property')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['related_property', 'date'], name='night_property_date_idx')],
+            },
+        ),
+        migrations.RunPython(build_calendar, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.3 on 2026-10-18 13:51
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0007_unavailablenight'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['property', 'status', 'check_in_date', 'check_out_date'], name='booking_overlap_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='waitlistentry',
+            index=models.Index(fields=['related_property', 'confirmed', 'notified_at', 'created_at'], name='waitlist_queue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='waitlistentry',
+            index=models.Index(fields=['guest', 'related_property'], name='waitlist_guest_property_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.3 on 2026-10-18 14:13
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0011_conversation_history'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WaitListRelease',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='waitlistentry',
+            name='expired_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='waitlistentry',
+            index=models.Index(fields=['confirmed', 'expired_at', 'notified_at'], name='waitlist_offer_expiry_idx'),
+        ),
+        migrations.AddField(
+            model_name='waitlistrelease',
+            name='related_property',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist_releases', to='booking.property'),
+        ),
+        migrations.AddIndex(
+            model_name='waitlistrelease',
+            index=models.Index(fields=['processed_at', 'created_at'], name='waitlist_release_queue_idx'),
+        ),
+    ]
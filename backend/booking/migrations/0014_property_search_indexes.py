@@ -0,0 +1,51 @@
+# Generated by Django 5.1.3 on 2026-10-18 14:24
+
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+# NOTE: these indexes only exist on PostgreSQL, so they are created here rather than declared in
+# Property.Meta which every backend would try to build. The vector is the one booking.search queries,
+# the planner only uses the index while both expressions stay identical.
+SEARCH_CONFIG = 'simple'
+SEARCH_WEIGHTS = {'title': 'A', 'city': 'B', 'category': 'B', 'address': 'C', 'description': 'D'}
+
+
+def search_indexes():
+    vector = None
+    for field, weight in SEARCH_WEIGHTS.items():
+        field_vector = SearchVector(field, weight=weight, config=SEARCH_CONFIG)
+        vector = field_vector if vector is None else vector + field_vector
+    return [
+        GinIndex(vector, name='property_search_idx'),
+        GinIndex(OpClass('title', name='gin_trgm_ops'), name='property_title_trgm_idx'),
+        GinIndex(OpClass('city', name='gin_trgm_ops'), name='property_city_trgm_idx'),
+    ]
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    Property = apps.get_model('booking', 'Property')
+    for index in search_indexes():
+        schema_editor.add_index(Property, index)
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    Property = apps.get_model('booking', 'Property')
+    for index in search_indexes():
+        schema_editor.remove_index(Property, index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0013_property_coordinates'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.1.3 on 2026-10-18 14:31
+
+from collections import Counter, defaultdict
+import django.db.models.deletion
+from django.db import migrations, models
+from booking.cities import city_slug
+
+
+def normalize_cities(apps, schema_editor):
+    """
+    One City per slug of the typed names ("Alger", "alger ", "ALGER" are the same city), named after
+    its most used spelling which every property of the city then carries.
+    """
+    City = apps.get_model('booking', 'City')
+    Property = apps.get_model('booking', 'Property')
+
+    spellings = defaultdict(Counter)
+    property_ids = defaultdict(list)
+    for property_id, name in Property.objects.values_list('id', 'city_name').iterator(chunk_size=2000):
+        slug = city_slug(name)
+        if slug:
+            spellings[slug][' '.join(name.split())] += 1
+            property_ids[slug].append(property_id)
+
+    cities = City.objects.bulk_create([
+        City(name=counter.most_common(1)[0][0], slug=slug) for slug, counter in spellings.items()
+    ])
+    for city in City.objects.filter(slug__in=[city.slug for city in cities]):
+        ids = property_ids[city.slug]
+        for start in range(0, len(ids), 1000):
+            Property.objects.filter(id__in=ids[start:start + 1000]).update(city=city, city_name=city.name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0014_property_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='City',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('slug', models.SlugField(allow_unicode=True, max_length=100, unique=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Cities',
+                'ordering': ['name'],
+            },
+        ),
+        # the text column keeps its data and its search indexes, the foreign key takes the `city` name
+        migrations.RenameField(
+            model_name='property',
+            old_name='city',
+            new_name='city_name',
+        ),
+        migrations.AddField(
+            model_name='property',
+            name='city',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='properties', to='booking.city'),
+        ),
+        migrations.RunPython(normalize_cities, migrations.RunPython.noop),
+    ]
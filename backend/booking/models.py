@@ -2,23 +2,63 @@ from authapp.models import User
 from django.conf import settings 
 from django.db import models
 from django.core.validators import MinValueValidator,MaxValueValidator
-from BookingApplication.constants import PROPERTY_STATUS_CHOICES
+from BookingApplication.constants import PAYMENT_SESSION_STATUS_CHOICES, PROPERTY_STATUS_CHOICES
+from booking import geo
+from booking.cities import city_slug
 import uuid
 from django.core.exceptions import ValidationError
 
 
+class City(models.Model):
+    """
+    One row per city whatever the spelling a host typed, properties filter and facet on its id.
+    """
+    name=models.CharField(max_length=100)
+    slug=models.SlugField(max_length=100,unique=True,allow_unicode=True)
+
+    class Meta:
+        verbose_name_plural=("Cities")
+        ordering=['name']
+
+    def __str__(self) -> str:
+        return self.name
+
+    @classmethod
+    def for_names(cls,names):
+        """
+        {name: City} for the typed names with two queries at most, the missing cities are created
+        with the first spelling seen. names without a usable slug are left out
+        """
+        slugs={name:city_slug(name) for name in names}
+        slugs={name:slug for name,slug in slugs.items() if slug}
+        found=cls.objects.in_bulk(set(slugs.values()),field_name='slug')
+        missing={}
+        for name,slug in slugs.items():
+            if slug not in found:
+                missing.setdefault(slug,' '.join(name.split()))
+        if missing:
+            # ignore_conflicts, a concurrent writer may create the same city, it is read back either way
+            cls.objects.bulk_create([cls(name=name,slug=slug) for slug,name in missing.items()],ignore_conflicts=True)
+            found.update(cls.objects.in_bulk(list(missing),field_name='slug'))
+        return {name:found[slug] for name,slug in slugs.items()}
+
+
 class Property(models.Model):
     
     title=models.CharField(max_length=50)
     address=models.CharField(max_length=255)
-    # TODO add cities package and make this into choice field
-    city=models.CharField(max_length=100)
+    # the spelling of the City, kept on the row for the text search and autocomplete indexes
+    city_name=models.CharField(max_length=100)
+    city=models.ForeignKey(City,on_delete=models.PROTECT,related_name='properties',null=True,blank=True)
     max_guests=models.IntegerField()
     created_at=models.DateTimeField(auto_now_add=True)
     updated_at=models.DateTimeField(auto_now=True)
     # TODO we can change this to be custom table
     price_per_night=models.DecimalField(max_digits=10,decimal_places=2)
-    # TODO add corrdinates
+    latitude=models.FloatField(blank=True,null=True,validators=[MinValueValidator(-90),MaxValueValidator(90)])
+    longitude=models.FloatField(blank=True,null=True,validators=[MinValueValidator(-180),MaxValueValidator(180)])
+    # grid cell of the coordinates (see booking.geo), kept in sync by save()
+    geohash=models.CharField(max_length=12,blank=True,default='',editable=False)
     host=models.ForeignKey(User,related_name='host',on_delete=models.CASCADE)
     description=models.TextField(blank=True,null=True)
     category=models.CharField(max_length=50,blank=True)
@@ -30,9 +70,48 @@ class Property(models.Model):
     class Meta:
         verbose_name = ("Property")
         verbose_name_plural =("Properties")
+        # keyset pagination orderings of the public listing (see booking.pagination)
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='property_created_id_idx'),
+            models.Index(fields=['price_per_night', 'id'], name='property_price_id_idx'),
+            # map searches are ranges of geohash prefixes (see booking.geo)
+            models.Index(fields=['geohash'], name='property_geohash_idx'),
+        ]
 
     def __str__(self) -> str:
         return self.title
+
+    @classmethod
+    def from_db(cls,db,field_names,values):
+        instance=super().from_db(db,field_names,values)
+        # save() only looks the City up again when the name changed since the row was loaded
+        instance._loaded_city_name=instance.__dict__.get('city_name')
+        return instance
+
+    def set_geohash(self):
+        located=self.latitude is not None and self.longitude is not None
+        self.geohash=geo.encode(self.latitude,self.longitude) if located else ''
+
+    def set_city(self,city=None):
+        city=city or City.for_names([self.city_name]).get(self.city_name)
+        self.city=city
+        if city:
+            self.city_name=city.name
+
+    def save(self,*args,**kwargs):
+        # NOTE: bulk_create skips this, callers creating properties in bulk call set_geohash()
+        # and set_city() (with City.for_names for the whole batch) themselves
+        self.set_geohash()
+        update_fields=kwargs.get('update_fields')
+        renamed=self._state.adding or self.city_id is None or self.city_name!=getattr(self,'_loaded_city_name',None)
+        if (update_fields is None or 'city_name' in update_fields) and renamed:
+            self.set_city()
+        if update_fields is not None:
+            extra={'geohash'} if {'latitude','longitude'} & set(update_fields) else set()
+            extra|={'city'} if 'city_name' in update_fields else set()
+            kwargs['update_fields']={*update_fields,*extra}
+        super().save(*args,**kwargs)
+        self._loaded_city_name=self.city_name
     
 class PropertyImage(models.Model):
     image=models.ImageField(upload_to='property_images',null=True,blank=True)
@@ -79,11 +158,58 @@ class Booking(models.Model):
     updated_at=models.DateTimeField(auto_now=True)
     is_paid=models.BooleanField(default=False)
     payment_method=models.CharField(max_length=10, choices=PAYMENT_METHOD_CHOICES, default='card')
-    stripe_session_id=models.CharField(max_length=255,blank=True,null=True)
+    stripe_session_id=models.CharField(max_length=255,blank=True,null=True,db_index=True)
+    # checkout sessions are created by a celery task, clients poll this until READY (see booking.tasks)
+    payment_session_status=models.CharField(choices=PAYMENT_SESSION_STATUS_CHOICES.choices,
+                                            max_length=10,blank=True,null=True)
     ccp_reference=models.CharField(max_length=255,blank=True,null=True)
+
+    class Meta:
+        indexes = [
+            # overlap checks: equality on property/status first, then the date range
+            models.Index(fields=['property', 'status', 'check_in_date', 'check_out_date'], name='booking_overlap_idx'),
+        ]
+
     def __str__(self):
         return f"Booking {self.id} - {self.property.title}"
 
+class UnavailableNight(models.Model):
+    """
+    Materialized availability calendar: one row per night a property can't be booked.
+    * rows with a booking come from PENDING/CONFIRMED bookings, rows without one from Property.blocked_dates
+    * kept in sync by booking.signals.handlers so checking a date range is a single indexed range lookup
+    """
+    related_property=models.ForeignKey("Property",on_delete=models.CASCADE,related_name='unavailable_nights')
+    date=models.DateField()
+    booking=models.ForeignKey("Booking",on_delete=models.CASCADE,related_name='nights',null=True,blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['related_property', 'date'], name='night_property_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.related_property_id} {self.date}"
+
+class StripeEvent(models.Model):
+    """
+    Stripe webhook events waiting to be applied, event_id is unique so redelivered events are dropped.
+    processed by booking.tasks.process_stripe_events in batches
+    """
+    event_id=models.CharField(max_length=255,unique=True)
+    type=models.CharField(max_length=100)
+    payload=models.JSONField()
+    received_at=models.DateTimeField(auto_now_add=True)
+    processed_at=models.DateTimeField(blank=True,null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['processed_at', 'received_at'], name='stripe_event_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.type} {self.event_id}"
+
 class Review(models.Model):
     booking=models.ForeignKey("Booking",on_delete=models.CASCADE)
     guest=models.ForeignKey(User,on_delete=models.CASCADE)
@@ -106,13 +232,40 @@ class WaitListEntry(models.Model):
     created_at=models.DateTimeField(auto_now_add=True)
     notified_at = models.DateTimeField(blank=True,null=True)
     confirmed = models.BooleanField(default=False)
+    # set when the guest let the offer run out without confirming (see booking.waitlist)
+    expired_at = models.DateTimeField(blank=True,null=True)
 
     class Meta :
         ordering= ['created_at']
         verbose_name_plural="WaitList Entries"
+        indexes = [
+            # next guest to notify: FIFO over (related_property, confirmed, notified_at)
+            models.Index(fields=['related_property', 'confirmed', 'notified_at', 'created_at'], name='waitlist_queue_idx'),
+            models.Index(fields=['guest', 'related_property'], name='waitlist_guest_property_idx'),
+            # offers running out: unconfirmed, not expired yet, oldest notification first
+            models.Index(fields=['confirmed', 'expired_at', 'notified_at'], name='waitlist_offer_expiry_idx'),
+        ]
     
     def __str__(self):
         return f" user:{self.guest} confirmed :{self.confirmed}"
+
+
+class WaitListRelease(models.Model):
+    """
+    Dates of a property freed up (booking cancelled or deleted), its waitlist gets a new offer.
+    recorded by booking.signals.handlers and booking.tasks, processed by booking.tasks.process_waitlist in batches
+    """
+    related_property=models.ForeignKey("Property",on_delete=models.CASCADE,related_name='waitlist_releases')
+    created_at=models.DateTimeField(auto_now_add=True)
+    processed_at=models.DateTimeField(blank=True,null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['processed_at', 'created_at'], name='waitlist_release_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"release of {self.related_property_id} at {self.created_at}"
         
 class Conversation(models.Model):
     property = models.ForeignKey('Property', on_delete=models.SET_NULL, related_name='conversations', null=True, blank=True)
@@ -136,6 +289,27 @@ class Message(models.Model):
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            # message history pages: (created_at, id) keyset inside one conversation
+            models.Index(fields=['conversation', 'created_at', 'id'], name='message_history_idx'),
+        ]
 
     def __str__(self):
         return f'Message from {self.sender.username} at {self.created_at}'
+
+class ConversationReadState(models.Model):
+    """
+    Last message a participant has read in a conversation, messages after it count as unread.
+    """
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='read_states')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversation_read_states')
+    last_read_message_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['conversation', 'user'], name='unique_conversation_read_state'),
+        ]
+
+    def __str__(self):
+        return f'{self.user} read {self.conversation_id} up to {self.last_read_message_id}'
@@ -0,0 +1,172 @@
+from django.db.models import Q, Subquery
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, Cursor, CursorPagination
+from rest_framework.response import Response
+
+
+class PropertyCursorPagination(CursorPagination):
+    """
+    Keyset (cursor) pagination for the public property listing.
+    * the cursor encodes the position of the last row of the page, so fetching page N costs the same as page 1
+    * ordering always ends with the primary key so rows sharing a price/date never get skipped or repeated
+    * `?sort=price` orders by (price_per_night, id), anything else by newest first (created_at, id)
+    * radius searches (annotated with `distance`) default to nearest first, text searches to best match first
+    DRF cursors only hold the first ordering field and count rows sharing it with an offset, which a computed
+    float such as `distance` can't be trusted for, nearest first pages are therefore keyed on (distance, id)
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
+    sort_query_param = 'sort'
+    orderings = {
+        'price': ('price_per_night', 'id'),
+        '-price': ('-price_per_night', '-id'),
+        'newest': ('-created_at', '-id'),
+        'oldest': ('created_at', 'id'),
+    }
+
+    def get_ordering(self, request, queryset, view):
+        sort = request.query_params.get(self.sort_query_param)
+        if 'distance' in queryset.query.annotations and sort in (None, 'distance'):
+            return ('distance', 'id')
+        if 'search_rank' in queryset.query.annotations and sort in (None, 'relevance'):
+            return ('-search_rank', 'id')
+        return self.orderings.get(sort, self.ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.nearest = self.get_ordering(request, queryset, view) == ('distance', 'id')
+        if not self.nearest:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.cursor = cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor.reverse
+        queryset = queryset.order_by('-distance', '-id') if reverse else queryset.order_by('distance', 'id')
+        anchored = cursor is not None and cursor.position is not None
+        if anchored:
+            distance, pk = self.parse_nearest_position(cursor.position)
+            if reverse:
+                queryset = queryset.filter(Q(distance__lt=distance) | Q(distance=distance, id__lt=pk))
+            else:
+                queryset = queryset.filter(Q(distance__gt=distance) | Q(distance=distance, id__gt=pk))
+
+        rows = list(queryset[:self.page_size + 1])
+        self.page = rows[:self.page_size]
+        has_more = len(rows) > self.page_size
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = anchored, has_more
+        else:
+            self.has_next, self.has_previous = has_more, anchored
+        return self.page
+
+    def parse_nearest_position(self, position):
+        try:
+            distance, pk = position.rsplit('_', 1)
+            return float(distance), int(pk)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+
+    def nearest_position(self, instance):
+        # repr round-trips the float, the database compares against the exact value it returned
+        return f'{instance.distance!r}_{instance.pk}'
+
+    def get_next_link(self):
+        if not self.nearest:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        position = self.nearest_position(self.page[-1]) if self.page else self.cursor.position
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.nearest:
+            return super().get_previous_link()
+        if not self.has_previous:
+            return None
+        position = self.nearest_position(self.page[0]) if self.page else self.cursor.position
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+    def is_requested(self, request):
+        """
+        The listing stays a plain array unless the client opts in with a cursor or a page size,
+        so existing clients keep working while the frontend migrates.
+        """
+        return (
+            self.cursor_query_param in request.query_params
+            or self.page_size_query_param in request.query_params
+        )
+
+
+class MessageHistoryPagination(BasePagination):
+    """
+    Keyset pagination of a conversation's messages anchored on message ids.
+    * no param : the latest page
+    * `?before=<id>` : older messages, to scroll back
+    * `?after=<id>` : newer messages, to catch up after a reconnect
+    pages are always returned oldest first and the anchor is resolved inside the same query
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            raise ValidationError({"message": "page_size must be an integer"})
+        return max(1, min(size, self.max_page_size))
+
+    def get_anchor(self, request, param):
+        value = request.query_params.get(param)
+        if value is None:
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            raise ValidationError({"message": f"{param} must be a message id"})
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_size = self.get_page_size(request)
+        before = self.get_anchor(request, 'before')
+        after = self.get_anchor(request, 'after')
+
+        if after is not None:
+            anchor = Subquery(queryset.filter(id=after).values('created_at')[:1])
+            queryset = queryset.filter(Q(created_at__gt=anchor) | Q(created_at=anchor, id__gt=after))
+            rows = list(queryset.order_by('created_at', 'id')[:page_size + 1])
+            self.has_more = len(rows) > page_size
+            self.direction = 'after'
+            self.anchor = after
+            self.page = rows[:page_size]
+            return self.page
+
+        if before is not None:
+            anchor = Subquery(queryset.filter(id=before).values('created_at')[:1])
+            queryset = queryset.filter(Q(created_at__lt=anchor) | Q(created_at=anchor, id__lt=before))
+        rows = list(queryset.order_by('-created_at', '-id')[:page_size + 1])
+        self.has_more = len(rows) > page_size
+        self.direction = 'before'
+        self.anchor = None
+        self.page = rows[:page_size][::-1]
+        return self.page
+
+    def get_paginated_response(self, data):
+        """
+        `before` is the id to pass back to scroll further up (None at the start of the conversation),
+        `after` the id to pass back to fetch what arrived since this page.
+        """
+        if not self.page:
+            older, newer = None, self.anchor
+        else:
+            older = self.page[0].id if self.direction == 'after' or self.has_more else None
+            newer = self.page[-1].id
+        return Response({
+            'results': data,
+            'has_more': self.has_more,
+            'before': older,
+            'after': newer,
+        })
@@ -0,0 +1,75 @@
+import re
+from django.contrib.postgres.lookups import TrigramWordSimilar
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity
+from django.db import connections
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Greatest
+from rest_framework.filters import BaseFilterBackend
+
+# NOTE: on PostgreSQL a property's text is matched against a weighted tsvector and its title/city by trigram
+# similarity, both served by GIN expression indexes (see migration 0014_property_search_indexes, the vector
+# below must stay identical to the indexed one). The migration only creates them on PostgreSQL.
+# Other backends (MySQL in development, SQLite) fall back to ranked icontains matching:
+# * every search scans the whole table, `LIKE '%term%'` can't use an index
+# * terms match anywhere in a word, so prefixes still work
+# * there is no typo tolerance, a misspelt title or city finds nothing
+# rankings differ between the two, don't tune relevance against a development database.
+SEARCH_CONFIG = 'simple'  # listings mix French, Arabic and English, no stemming but prefix matching
+SEARCH_WEIGHTS = {'title': 'A', 'city_name': 'B', 'category': 'B', 'address': 'C', 'description': 'D'}
+MAX_SEARCH_TERMS = 10
+
+
+def search_terms(text):
+    return re.findall(r'\w+', text.lower())[:MAX_SEARCH_TERMS]
+
+
+def search_vector():
+    vector = None
+    for field, weight in SEARCH_WEIGHTS.items():
+        field_vector = SearchVector(field, weight=weight, config=SEARCH_CONFIG)
+        vector = field_vector if vector is None else vector + field_vector
+    return vector
+
+
+def postgres_search(queryset, text, terms):
+    # every term must match, as a word or the start of one, so "vill ora" finds "Villa in Oran"
+    query = SearchQuery(' & '.join(f'{term}:*' for term in terms), search_type='raw', config=SEARCH_CONFIG)
+    # typo tolerance, a title or city close enough to the text matches even when no word does
+    similarity = Greatest(TrigramWordSimilarity(text, 'title'), TrigramWordSimilarity(text, 'city_name'))
+    return (
+        queryset.alias(search_document=search_vector())
+        .annotate(search_rank=SearchRank(search_vector(), query) + similarity * Value(0.5))
+        .filter(Q(search_document=query) | TrigramWordSimilar(F('title'), text) | TrigramWordSimilar(F('city_name'), text))
+    )
+
+
+def fallback_search(queryset, terms):
+    matches, rank = Q(), Value(0.0)
+    for term in terms:
+        matches &= Q(title__icontains=term) | Q(city_name__icontains=term) | Q(category__icontains=term) | \
+            Q(address__icontains=term) | Q(description__icontains=term)
+        for field, score in (('title', 4.0), ('city_name', 2.0), ('category', 2.0), ('address', 1.0), ('description', 0.5)):
+            rank += Case(When(**{f'{field}__icontains': term}, then=Value(score)), default=Value(0.0))
+    return queryset.filter(matches).annotate(search_rank=rank / len(terms)).order_by('-search_rank', 'id')
+
+
+def search(queryset, text):
+    """
+    Properties matching the free text in title, description, address, city and category,
+    annotated with their `search_rank` and best match first.
+    """
+    terms = search_terms(text)
+    if not terms:
+        return queryset.none()
+    if connections[queryset.db].vendor == 'postgresql':
+        return postgres_search(queryset, text, terms).order_by('-search_rank', 'id')
+    return fallback_search(queryset, terms)
+
+
+class PropertySearchFilter(BaseFilterBackend):
+    """`?search=` for views listing properties, ranked like the public listing's `q`."""
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        text = request.query_params.get(self.search_param, '').strip()
+        return search(queryset, text) if text else queryset
@@ -1,6 +1,10 @@
+from datetime import datetime
 from authapp.models import User
+from django.db import transaction
 from rest_framework import serializers
 from . import models
+from .availability import first_unavailable_night
+from BookingApplication.metrics import TimedSerializerMixin
 
 class PropertyImagesSerializer(serializers.ModelSerializer):
     images=serializers.ListField(
@@ -68,7 +72,19 @@ class PropertyImagesSerializer(serializers.ModelSerializer):
         return instance
 
 
+def validate_coordinates(attrs, instance=None):
+    # a property is either located with both coordinates or not at all
+    latitude = attrs.get('latitude', getattr(instance, 'latitude', None))
+    longitude = attrs.get('longitude', getattr(instance, 'longitude', None))
+    if (latitude is None) != (longitude is None):
+        raise serializers.ValidationError("latitude and longitude must be given together")
+    return attrs
+
+
 class CreatePropertySerializer(serializers.ModelSerializer):
+    # the name as typed, save() files the property under its City
+    city = serializers.CharField(source='city_name', max_length=100)
+
     class Meta:
         model = models.Property
         fields = [
@@ -80,9 +96,14 @@ class CreatePropertySerializer(serializers.ModelSerializer):
             "max_guests",
             "description",
             "category",
+            "latitude",
+            "longitude",
             "host"
         ]
         read_only_fields = ["host"]
+
+    def validate(self, attrs):
+        return validate_coordinates(attrs)
     
     def validate_price_per_night(self, value):
         if value <= 0:
@@ -101,11 +122,15 @@ class CreatePropertySerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
-class PropertySerializer(serializers.ModelSerializer):
+class PropertySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     images = serializers.SerializerMethodField()
     host = serializers.SerializerMethodField()
     description = serializers.CharField(required=False)
     is_available = serializers.BooleanField(read_only=True)
+    # km from the searched point, only present on radius searches
+    distance = serializers.FloatField(read_only=True)
+    city = serializers.CharField(source='city_name', max_length=100)
+    city_id = serializers.IntegerField(read_only=True)
     
     class Meta:
         model = models.Property
@@ -115,15 +140,31 @@ class PropertySerializer(serializers.ModelSerializer):
             "host",
             "address",
             "city",
+            "city_id",
             "category",
             "max_guests",
             "price_per_night",
             "description",
             "images",
             "blocked_dates",
-            "is_available"
+            "is_available",
+            "latitude",
+            "longitude",
+            "distance"
         ]
 
+    def validate(self, attrs):
+        return validate_coordinates(attrs, self.instance)
+
+    def validate_blocked_dates(self, value):
+        # parsed once here so the availability calendar never meets a malformed date
+        for date in value or []:
+            try:
+                datetime.strptime(date, '%Y-%m-%d')
+            except (TypeError, ValueError):
+                raise serializers.ValidationError(f"Invalid blocked date {date}. Use YYYY-MM-DD")
+        return value
+
     def get_host(self,obj):
         return {
             "id":obj.host.id,
@@ -143,29 +184,34 @@ class PropertySerializer(serializers.ModelSerializer):
         return images
 
 
-class BookingSerializer(serializers.ModelSerializer):
+def check_nights_free(property_id, check_in_date, check_out_date):
+    # the calendar holds the nights of active bookings and the ones the host blocked
+    unavailable = first_unavailable_night(property_id, check_in_date, check_out_date)
+    if unavailable is None:
+        return
+    night, booking_id = unavailable
+    if booking_id is None:
+        raise serializers.ValidationError(f"The host blocked {night} in this period.")
+    raise serializers.ValidationError("This rooms is booked for this period.")
+
+
+class BookingSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model=models.Booking
         fields=['id','property','guest','check_in_date','check_out_date',
-        'total_price','status','stripe_session_id','is_paid']
-        read_only_fields=['guest','property','total_price','status','stripe_session_id','is_paid']
+        'total_price','status','stripe_session_id','payment_session_status','is_paid']
+        read_only_fields=['guest','property','total_price','status','stripe_session_id','payment_session_status','is_paid']
 
     def validate(self, attrs):
-        property_instance=self.context.get('property_id')
+        property_id=self.context.get('property_id')
         check_in_date=attrs['check_in_date']
         check_out_date=attrs['check_out_date']
-        overlapping_bookings=models.Booking.objects.filter(
-                property=property_instance,
-                check_in_date__lte=check_out_date,
-                check_out_date__gt=check_in_date
-        )
-                
 
         if check_out_date<=check_in_date:
             raise serializers.ValidationError("check out must be after the check in ")
 
-        if overlapping_bookings.exists():
-            raise serializers.ValidationError("This rooms is booked for this period.") 
+        # early answer without locking, create() checks again under the property lock
+        check_nights_free(property_id,check_in_date,check_out_date)
         return attrs
     
     def create(self, validated_data):
@@ -177,18 +223,24 @@ class BookingSerializer(serializers.ModelSerializer):
         except User.DoesNotExist:
             raise serializers.ValidationError("User doesn't exist")
 
-        try:
-            property_instance = models.Property.objects.get(id=property_id)
-        except models.Property.DoesNotExist:
-            raise serializers.ValidationError("Property does not exist")
+        # NOTE: the property row lock serializes concurrent bookings of the same property so the
+        # overlap check and the insert can't interleave, other properties are not blocked
+        with transaction.atomic():
+            try:
+                property_instance = models.Property.objects.select_for_update().get(id=property_id)
+            except models.Property.DoesNotExist:
+                raise serializers.ValidationError("Property does not exist")
 
-        booked_nights = (validated_data['check_out_date'] - validated_data['check_in_date']).days
-        validated_data['total_price'] = property_instance.price_per_night * booked_nights
-        validated_data['property'] = property_instance
-        validated_data['guest'] = user_instance
-         
-        
-        booking=super().create(validated_data)
+            check_in_date = validated_data['check_in_date']
+            check_out_date = validated_data['check_out_date']
+            check_nights_free(property_instance.id, check_in_date, check_out_date)
+
+            booked_nights = (check_out_date - check_in_date).days
+            validated_data['total_price'] = property_instance.price_per_night * booked_nights
+            validated_data['property'] = property_instance
+            validated_data['guest'] = user_instance
+
+            booking=super().create(validated_data)
         return booking
 
 class CreateConversationSerializer(serializers.ModelSerializer):
@@ -226,7 +278,7 @@ class UserSerializer(serializers.ModelSerializer):
         model = User
         fields = ['id', 'username']
 
-class MessageSerializer(serializers.ModelSerializer):
+class MessageSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     sender = UserSerializer(read_only=True)
     
     class Meta:
@@ -234,7 +286,7 @@ class MessageSerializer(serializers.ModelSerializer):
         fields = ['id', 'sender', 'content', 'created_at']
         read_only_fields = ['sender']
 
-class ConversationSerializer(serializers.ModelSerializer):
+class ConversationSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     participants = UserSerializer(many=True, read_only=True)
     property = PropertySerializer(read_only=True)
     messages = MessageSerializer(many=True, read_only=True)
@@ -252,3 +304,59 @@ class ConversationSerializer(serializers.ModelSerializer):
             if other_user:
                 return UserSerializer(other_user).data
         return None
+
+
+class ConversationListSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """
+    Conversation summary for the inbox: the last message and the unread count instead of the whole thread.
+    expects the queryset built by ConversationViewSet (prefetched participants/latest_messages, unread_count annotation)
+    """
+    property = serializers.SerializerMethodField()
+    participants = UserSerializer(many=True, read_only=True)
+    other_user = serializers.SerializerMethodField()
+    last_message = serializers.SerializerMethodField()
+    unread_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = models.Conversation
+        fields = ['id', 'property', 'participants', 'other_user', 'last_message', 'unread_count', 'created_at', 'updated_at']
+
+    def get_property(self, obj):
+        if obj.property is None:
+            return None
+        return {
+            "id": obj.property.id,
+            "title": obj.property.title,
+            "city": obj.property.city_name,
+        }
+
+    def get_other_user(self, obj):
+        request = self.context.get('request')
+        if request and request.user:
+            for participant in obj.participants.all():
+                if participant.id != request.user.id:
+                    return UserSerializer(participant).data
+        return None
+
+    def get_last_message(self, obj):
+        if obj.latest_messages:
+            return MessageSerializer(obj.latest_messages[0]).data
+        return None
+
+
+class ConversationDetailSerializer(ConversationListSerializer):
+    """
+    Summary plus the fields ConversationSerializer used to return for a single conversation.
+    `messages` only holds the latest `messages_limit` messages (oldest first), older ones are paged
+    through the messages route with ?before=<id>
+    """
+    property = PropertySerializer(read_only=True)
+    messages = serializers.SerializerMethodField()
+    messages_limit = 50
+
+    class Meta(ConversationListSerializer.Meta):
+        fields = ConversationListSerializer.Meta.fields + ['messages']
+
+    def get_messages(self, obj):
+        latest = obj.messages.select_related('sender').order_by('-created_at', '-id')[:self.messages_limit]
+        return MessageSerializer(list(latest)[::-1], many=True).data
@@ -0,0 +1,127 @@
+from django.dispatch import receiver
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from booking import waitlist
+from booking.autocomplete import suggestions_changed, suggestions_of
+from booking.availability import BLOCKING_STATUSES, sync_blocked_nights, sync_booking_nights
+from booking.cache import AVAILABILITY_VERSION_KEY, LIST_VERSION_KEY, bump_version, chat_member_key, property_version_key
+from booking.models import Booking, Conversation, Property, PropertyImage, WaitListEntry
+from BookingApplication.constants import PROPERTY_STATUS_CHOICES
+
+# NOTE: these keep the UnavailableNight calendar in sync so availability checks never recompute it,
+# fixtures (raw saves) carry their own calendar rows
+@receiver(post_save,sender=Booking)
+def sync_calendar_for_booking(sender,instance,**kwargs):
+    update_fields=kwargs.get('update_fields')
+    if kwargs.get('raw'):
+        return
+    if update_fields and not {'status','check_in_date','check_out_date'} & set(update_fields):
+        return
+    sync_booking_nights(instance)
+
+
+@receiver(post_save,sender=Property)
+def sync_calendar_for_blocked_dates(sender,instance,**kwargs):
+    update_fields=kwargs.get('update_fields')
+    if kwargs.get('raw'):
+        return
+    if update_fields and 'blocked_dates' not in update_fields:
+        return
+    sync_blocked_nights(instance)
+
+
+# NOTE: cached property responses are invalidated by bumping the versions their keys embed (see booking.cache)
+@receiver([post_save,post_delete],sender=Property)
+def invalidate_property_cache(sender,instance,**kwargs):
+    bump_version(LIST_VERSION_KEY)
+    bump_version(property_version_key(instance.pk))
+
+
+@receiver([post_save,post_delete],sender=PropertyImage)
+def invalidate_property_image_cache(sender,instance,**kwargs):
+    bump_version(LIST_VERSION_KEY)
+    bump_version(property_version_key(instance.related_property_id))
+
+
+@receiver([post_save,post_delete],sender=Booking)
+def invalidate_availability_cache(sender,instance,**kwargs):
+    bump_version(AVAILABILITY_VERSION_KEY)
+
+
+# NOTE: ChatConsumer caches who takes part in a conversation, drop the entries a participants change affects
+@receiver(m2m_changed,sender=Conversation.participants.through)
+def invalidate_chat_membership(sender,instance,action,reverse,pk_set,**kwargs):
+    if action=='pre_clear':
+        related=instance.conversations if reverse else instance.participants
+        pk_set=set(related.values_list('pk',flat=True))
+    elif action not in ('post_add','post_remove'):
+        return
+    if reverse:
+        cache.delete_many([chat_member_key(pk,instance.pk) for pk in pk_set])
+    else:
+        cache.delete_many([chat_member_key(instance.pk,pk) for pk in pk_set])
+
+
+# NOTE: freed dates only record a WaitListRelease, process_waitlist sends the offers in batches.
+# only a booking moving into CANCELED frees them, re-saving a canceled booking (admin edits) must not offer them again
+@receiver(pre_save,sender=Booking)
+def remember_booking_status(sender,instance,**kwargs):
+    update_fields=kwargs.get('update_fields')
+    instance._previous_status=None
+    if kwargs.get('raw') or instance._state.adding or instance.status!=PROPERTY_STATUS_CHOICES.CANCELED:
+        return
+    if update_fields and 'status' not in update_fields:
+        return
+    instance._previous_status=Booking.objects.filter(pk=instance.pk).values_list('status',flat=True).first()
+
+
+@receiver(post_save,sender=Booking)
+def release_canceled_booking(sender,instance,created,**kwargs):
+    update_fields=kwargs.get('update_fields')
+    if created or kwargs.get('raw') or (update_fields and 'status' not in update_fields):
+        return
+    canceled=PROPERTY_STATUS_CHOICES.CANCELED
+    if instance.status==canceled and getattr(instance,'_previous_status',None)!=canceled:
+        waitlist.release_properties([instance.property_id])
+
+
+@receiver(post_delete,sender=Booking)
+def release_deleted_booking(sender,instance,**kwargs):
+    if instance.status in BLOCKING_STATUSES:
+        waitlist.release_properties([instance.property_id])
+
+
+@receiver(post_delete,sender=WaitListEntry)
+def release_withdrawn_offer(sender,instance,**kwargs):
+    # a guest leaving the waitlist while holding an offer hands it to the next guest
+    if instance.notified_at and not instance.confirmed and instance.expired_at is None:
+        waitlist.release_properties([instance.related_property_id])
+
+
+# NOTE: the autocomplete index of this process is updated in place once the write commits (see booking.autocomplete)
+@receiver(pre_save,sender=Property)
+def remember_suggestions(sender,instance,**kwargs):
+    update_fields=kwargs.get('update_fields')
+    if update_fields and not {'title','city_name','is_available'} & set(update_fields):
+        instance._previous_suggestions=None
+        return
+    previous=Property.objects.filter(pk=instance.pk).values_list('title','city_name','is_available').first() if instance.pk else None
+    instance._previous_suggestions=suggestions_of(*previous) if previous else []
+
+
+@receiver(post_save,sender=Property)
+def update_suggestions(sender,instance,**kwargs):
+    removed=getattr(instance,'_previous_suggestions',None)
+    if removed is None:
+        return
+    added=suggestions_of(instance.title,instance.city_name,instance.is_available)
+    if removed!=added:
+        transaction.on_commit(lambda: suggestions_changed(removed,added))
+
+
+@receiver(post_delete,sender=Property)
+def remove_suggestions(sender,instance,**kwargs):
+    removed=suggestions_of(instance.title,instance.city_name,instance.is_available)
+    if removed:
+        transaction.on_commit(lambda: suggestions_changed(removed,[]))
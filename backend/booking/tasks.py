@@ -1,30 +1,209 @@
+import logging
+import stripe
+from celery import shared_task
 from django.conf import settings
-from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.shortcuts import reverse
 from django.utils.timezone import now 
 from datetime import timedelta
-from booking.models import WaitListEntry
-from django.core.mail import send_mail
-
-
-def process_next_waitlist_entry(property_id,user_id):
-    User=get_user_model()
-    user=User.objects.get(user=user_id)
-    next_entry = WaitListEntry.objects.filter(
-            related_property=property_id,
-            confirmed=False,
-            notified_at=None
-    ).first()
-    
-    if next_entry:
-        next_entry.notified_at =now()
-        wait_time =next_entry.notified_at
-        next_entry.save()
-
-    subject="Reservation waitlist"
-    message =f" A property on your wishlist is available please confirm reservation before {wait_time} or we or we will be cancel your waitlist reservation"
-
-    from_email = settings.DEFAULT_FROM_EMAIL
-    recipient_list =[user.email]
-
-    send_mail(subject,message,from_email,recipient_list)
-    print("Email sent .")
+from booking import waitlist
+from booking.availability import BLOCKING_STATUSES
+from booking.cache import AVAILABILITY_VERSION_KEY, bump_version
+from booking.models import Booking, StripeEvent, UnavailableNight, WaitListEntry, WaitListRelease
+from BookingApplication.constants import PAYMENT_SESSION_STATUS_CHOICES, PROPERTY_STATUS_CHOICES
+
+logger = logging.getLogger(__name__)
+
+# checkout session events that confirm or abandon the payment of a booking
+STRIPE_PAID_EVENTS = {'checkout.session.completed', 'checkout.session.async_payment_succeeded'}
+STRIPE_FAILED_EVENTS = {'checkout.session.expired', 'checkout.session.async_payment_failed'}
+
+
+def cancel_unpaid_bookings(bookings):
+    """
+    Cancel the unpaid active bookings of a queryset with bulk queries, returns how many were canceled.
+    .update() skips the Booking signals, so their nights, the waitlist and the cached availability are handled here.
+    """
+    ids = list(bookings.filter(status__in=BLOCKING_STATUSES, is_paid=False).values_list('id', flat=True))
+    if not ids:
+        return 0
+    canceled = Booking.objects.filter(id__in=ids)
+    UnavailableNight.objects.filter(booking_id__in=ids).delete()
+    waitlist.release_properties(canceled.values_list('property_id', flat=True))
+    canceled.update(status=PROPERTY_STATUS_CHOICES.CANCELED, updated_at=now())
+    bump_version(AVAILABILITY_VERSION_KEY)
+    return len(ids)
+
+
+@shared_task(bind=True, max_retries=5)
+def create_checkout_session(self, booking_id, domain):
+    """
+    Create the Stripe checkout session of a card booking outside the request cycle.
+    * network errors and rate limits are retried with exponential backoff
+    * the booking ends up READY with its stripe_session_id, or FAILED
+    * STRIPE_API_BASE points the client to a local fake server (e.g. stripe-mock) in development
+    """
+    booking = Booking.objects.select_related('property').get(id=booking_id)
+    if booking.status != PROPERTY_STATUS_CHOICES.PENDING:
+        # canceled by expire_unpaid_bookings while this task waited, its nights may be booked again
+        return
+    stripe.api_key = settings.STRIPE_KEY
+    if getattr(settings, 'STRIPE_API_BASE', None):
+        stripe.api_base = settings.STRIPE_API_BASE
+
+    try:
+        session = stripe.checkout.Session.create(
+            payment_method_types=["card"],
+            line_items=[
+                {
+                    "price_data": {
+                        "currency": "dzd",  # Change to DZD for Algerian Dinar
+                        "product_data": {
+                            "name": f"Booking for {booking.property}",
+                        },
+                        "unit_amount": int(booking.total_price * 100),
+                    },
+                    "quantity": 1,
+                }
+            ],
+            mode="payment",
+            success_url=f'{domain}{reverse("stripe-success")}?session_id={{CHECKOUT_SESSION_ID}}',
+            cancel_url=f'{domain}{reverse("stripe-cancel")}',
+        )
+    except (stripe.error.APIConnectionError, stripe.error.RateLimitError) as e:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e, countdown=2 ** self.request.retries)
+        booking.payment_session_status = PAYMENT_SESSION_STATUS_CHOICES.FAILED
+        booking.save(update_fields=['payment_session_status'])
+        return
+    except stripe.error.StripeError:
+        booking.payment_session_status = PAYMENT_SESSION_STATUS_CHOICES.FAILED
+        booking.save(update_fields=['payment_session_status'])
+        return
+
+    booking.stripe_session_id = session.id
+    booking.payment_session_status = PAYMENT_SESSION_STATUS_CHOICES.READY
+    booking.save(update_fields=['stripe_session_id', 'payment_session_status'])
+
+
+@shared_task(bind=True, max_retries=5)
+def refund_checkout_session(self, booking_id, payment_intent):
+    """
+    Refund a checkout session paid after its booking was canceled, its nights may already be booked again.
+    the idempotency key makes redelivered events and retries refund once
+    """
+    if not payment_intent:
+        logger.error('Booking %s was paid after being canceled without a payment intent, refund it manually', booking_id)
+        return
+    stripe.api_key = settings.STRIPE_KEY
+    if getattr(settings, 'STRIPE_API_BASE', None):
+        stripe.api_base = settings.STRIPE_API_BASE
+    try:
+        stripe.Refund.create(payment_intent=payment_intent, idempotency_key=f'refund-booking-{booking_id}')
+    except (stripe.error.APIConnectionError, stripe.error.RateLimitError) as e:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e, countdown=2 ** self.request.retries)
+        logger.exception('Failed to refund booking %s, refund it manually', booking_id)
+    except stripe.error.StripeError:
+        logger.exception('Failed to refund booking %s, refund it manually', booking_id)
+
+
+@shared_task
+def process_stripe_events(batch_size=500):
+    """
+    Apply stored Stripe webhook events in batches, one UPDATE per transition instead of one per event.
+    * paid sessions confirm their booking and set is_paid, a booking canceled meanwhile stays canceled and is refunded
+    * expired or failed sessions cancel unpaid bookings and free their nights
+    rows are claimed with skip_locked so several workers can drain the queue together
+    """
+    processed = 0
+    while True:
+        with transaction.atomic():
+            events = list(
+                StripeEvent.objects.select_for_update(skip_locked=True)
+                .filter(processed_at=None)
+                .order_by('received_at')[:batch_size]
+            )
+            if not events:
+                return processed
+
+            paid, failed = {}, set()
+            for event in events:
+                session = event.payload.get('data', {}).get('object', {})
+                if event.type in STRIPE_PAID_EVENTS and session.get('payment_status') == 'paid':
+                    paid[session.get('id')] = session.get('payment_intent')
+                elif event.type in STRIPE_FAILED_EVENTS:
+                    failed.add(session.get('id'))
+
+            if paid:
+                Booking.objects.filter(stripe_session_id__in=paid, status__in=BLOCKING_STATUSES).update(
+                    is_paid=True,
+                    status=PROPERTY_STATUS_CHOICES.CONFIRMED,
+                    updated_at=now(),
+                )
+                # paid after being canceled (expired session, unpaid booking sweep): its nights were freed
+                # and may be booked again, so the payment is refunded instead of confirming the booking
+                late = Booking.objects.filter(stripe_session_id__in=paid).exclude(status__in=BLOCKING_STATUSES)
+                for booking_id, session_id in late.values_list('id', 'stripe_session_id'):
+                    logger.warning('Booking %s was paid after being canceled, refunding session %s', booking_id, session_id)
+                    transaction.on_commit(
+                        lambda booking_id=booking_id, session_id=session_id:
+                        refund_checkout_session.delay(booking_id, paid[session_id])
+                    )
+                late.update(is_paid=True, updated_at=now())
+            if failed:
+                # frees the nights and bumps the cached availability, the Booking signals don't run on .update()
+                cancel_unpaid_bookings(Booking.objects.filter(stripe_session_id__in=failed - paid.keys()))
+
+            StripeEvent.objects.filter(id__in=[event.id for event in events]).update(processed_at=now())
+            processed += len(events)
+
+
+@shared_task
+def expire_unpaid_bookings():
+    """
+    Cancel the card bookings that never got a checkout session within BOOKING_SESSION_TIMEOUT_MINUTES
+    (lost or failed create_checkout_session task), so their nights don't stay held. Run by the beat schedule.
+    """
+    cutoff = now() - timedelta(minutes=settings.BOOKING_SESSION_TIMEOUT_MINUTES)
+    with transaction.atomic():
+        stale = Booking.objects.filter(id__in=list(
+            Booking.objects.select_for_update(skip_locked=True).filter(
+                status=PROPERTY_STATUS_CHOICES.PENDING,
+                payment_method='card',
+                stripe_session_id__isnull=True,
+                created_at__lt=cutoff,
+            ).values_list('id', flat=True)
+        ))
+        stale.update(payment_session_status=PAYMENT_SESSION_STATUS_CHOICES.FAILED)
+        return cancel_unpaid_bookings(stale)
+
+
+@shared_task
+def process_waitlist(batch_size=200):
+    """
+    Advance the waitlists, run by the beat schedule:
+    * offers not confirmed within WAITLIST_OFFER_HOURS expire
+    * each property with freed dates (WaitListRelease) or an expired offer gets an offer for the next guest
+      in FIFO order, unless one is already running
+    * the offer emails of a batch go to the outbox with one insert
+    rows are claimed with skip_locked so several workers can run it together
+    """
+    notified = 0
+    while True:
+        with transaction.atomic():
+            releases = list(
+                WaitListRelease.objects.select_for_update(skip_locked=True)
+                .filter(processed_at=None)
+                .order_by('created_at')[:batch_size]
+            )
+            property_ids = {release.related_property_id for release in releases} | waitlist.expire_offers(batch_size)
+            if not property_ids:
+                return notified
+
+            entries = waitlist.next_entries(property_ids)
+            notified_at = now()
+            WaitListEntry.objects.filter(id__in=[entry.id for entry in entries]).update(notified_at=notified_at)
+            WaitListRelease.objects.filter(id__in=[release.id for release in releases]).update(processed_at=notified_at)
+            waitlist.send_offers(entries, notified_at + waitlist.offer_timeout())
+            notified += len(entries)
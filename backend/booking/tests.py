@@ -1,3 +1,1031 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import io
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core import serializers
+from django.core.management import call_command
+from django.core.cache import cache
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils.timezone import now
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+
+from authapp.models import User
+from booking.autocomplete import CITY, TITLE, AutocompleteIndex, autocomplete_index
+from booking.availability import BLOCKING_STATUSES
+from booking.cache import AUTOCOMPLETE_VERSION_KEY, AVAILABILITY_VERSION_KEY, LIST_VERSION_KEY, bump_version, get_version
+from booking.message_buffer import MessageBuffer, ReadStateBuffer
+from booking.middleware import JWTAuthMiddlewareStack, VerifiedTokenCache
+from booking.models import ConversationReadState
+from booking.routing import websocket_urlpatterns
+from booking.models import Booking, City, Conversation, Message, Property, PropertyImage, StripeEvent, UnavailableNight
+from booking.serializers import BookingSerializer
+from booking.tasks import expire_unpaid_bookings, process_stripe_events
+from BookingApplication.constants import PAYMENT_SESSION_STATUS_CHOICES, PROPERTY_STATUS_CHOICES
+
+
+def create_host(username='host'):
+    return User.objects.create(username=username, email=f'{username}@fastbook.io', is_active=True)
+
+
+def create_property(host, **fields):
+    fields = {'title': 'Villa', 'address': '1 rue', 'city_name': 'Alger', 'max_guests': 4,
+              'price_per_night': 5000, **fields}
+    return Property.objects.create(host=host, **fields)
+
+
+@override_settings(ALLOWED_HOSTS=['*'])
+class PropertyListingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(3):
+            host = create_host(f'host{i}')
+            for j in range(10):
+                property = create_property(host, title=f'Villa {i}-{j}', price_per_night=1000 + j)
+                PropertyImage.objects.bulk_create([
+                    PropertyImage(related_property=property, image=f'property_images/{i}-{j}-{k}.jpg') for k in range(2)
+                ])
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        # the page and its hosts in one query, the images of the page in a second one
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/v0/booking/properties/?page_size=5')
+        self.assertEqual(len(response.json()['results']), 5)
+
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/v0/booking/properties/?page_size=25&sort=price')
+        results = response.json()['results']
+        self.assertEqual(len(results), 25)
+        self.assertEqual(len(results[0]['images']), 2)
+
+    def test_cache_timeout_setting_is_read_when_caching(self):
+        url = '/api/v0/booking/properties/?page_size=5'
+        with override_settings(PROPERTY_CACHE_TIMEOUT=0):
+            self.client.get(url)
+            # a zero timeout stores nothing, the next read goes to the database again
+            with self.assertNumQueries(2):
+                self.client.get(url)
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+    def test_cursor_pages_neither_skip_nor_repeat_rows(self):
+        seen, url = [], '/api/v0/booking/properties/?page_size=7&sort=price'
+        while url:
+            page = self.client.get(url).json()
+            seen += [property['id'] for property in page['results']]
+            url = page['next']
+        self.assertEqual(len(seen), 30)
+        self.assertEqual(len(set(seen)), 30)
+
+
+@override_settings(ALLOWED_HOSTS=['*'])
+class StayDatesFilterTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        host = create_host()
+        cls.check_in = date.today() + timedelta(days=10)
+        cls.free = create_property(host, title='Free')
+        cls.booked = create_property(host, title='Booked')
+        cls.blocked = create_property(host, title='Blocked', blocked_dates=[str(cls.check_in + timedelta(days=2))])
+        book(create_host('guest'), cls.booked, cls.check_in - timedelta(days=2), 3).save()
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def search(self, **params):
+        return self.client.get('/api/v0/booking/properties/', {'page_size': 10, **params})
+
+    def titles(self, check_in, check_out):
+        response = self.search(check_in_date=str(check_in), check_out_date=str(check_out))
+        self.assertEqual(response.status_code, 200)
+        return sorted(property['title'] for property in response.json()['results'])
+
+    def test_only_properties_free_for_the_whole_stay_are_listed(self):
+        self.assertEqual(self.titles(self.check_in, self.check_in + timedelta(days=3)), ['Free'])
+        # the booking checks out on the check-in day and the blocked night is the check-out day
+        self.assertEqual(self.titles(self.check_in + timedelta(days=1), self.check_in + timedelta(days=2)),
+                         ['Blocked', 'Booked', 'Free'])
+
+    def test_missing_check_out_is_rejected(self):
+        response = self.search(check_in_date=str(self.check_in))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Both check-in and check-out', str(response.json()))
+
+    def test_bad_date_format_is_rejected(self):
+        response = self.search(check_in_date='10/11/2026', check_out_date='12/11/2026')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('YYYY-MM-DD', str(response.json()))
+
+    def test_check_out_must_be_after_check_in(self):
+        for nights in (0, -1):
+            response = self.search(check_in_date=str(self.check_in),
+                                   check_out_date=str(self.check_in + timedelta(days=nights)))
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('after check-in', str(response.json()))
+
+
+class CalendarSyncTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.host = create_host()
+        cls.guest = create_host('guest')
+        cls.property = create_property(cls.host)
+
+    def nights(self):
+        return list(UnavailableNight.objects.filter(related_property=self.property).order_by('date').values_list('date', flat=True))
+
+    def test_booking_created_with_string_dates_holds_its_nights(self):
+        Booking.objects.create(guest=self.guest, property=self.property, check_in_date='2025-01-01',
+                               check_out_date='2025-01-03', total_price=10000)
+        self.assertEqual(self.nights(), [date(2025, 1, 1), date(2025, 1, 2)])
+
+    def test_canceled_booking_frees_its_nights(self):
+        booking = Booking.objects.create(guest=self.guest, property=self.property, check_in_date=date(2025, 1, 1),
+                                         check_out_date=date(2025, 1, 3), total_price=10000)
+        booking.status = PROPERTY_STATUS_CHOICES.CANCELED
+        booking.save(update_fields=['status'])
+        self.assertEqual(self.nights(), [])
+
+    def test_fixtures_do_not_write_calendar_rows(self):
+        fixture = json.dumps([{
+            'model': 'booking.booking', 'pk': 1000,
+            'fields': {'guest': self.guest.pk, 'property': self.property.pk, 'check_in_date': '2025-01-01',
+                       'check_out_date': '2025-01-03', 'total_price': '10000', 'status': PROPERTY_STATUS_CHOICES.PENDING,
+                       'created_at': '2025-01-01T00:00:00Z', 'updated_at': '2025-01-01T00:00:00Z'},
+        }])
+        for obj in serializers.deserialize('json', fixture):
+            obj.save()
+        self.assertTrue(Booking.objects.filter(pk=1000).exists())
+        self.assertEqual(self.nights(), [])
+
+
+def book(guest, property, check_in, nights):
+    serializer = BookingSerializer(
+        data={'check_in_date': check_in, 'check_out_date': check_in + timedelta(days=nights)},
+        context={'property_id': property.id, 'user': guest.id},
+    )
+    serializer.is_valid(raise_exception=True)
+    return serializer
+
+
+class BookingCreationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.guest = create_host('guest')
+        cls.property = create_property(create_host())
+        cls.check_in = date.today() + timedelta(days=30)
+
+    def test_overlapping_stay_is_rejected(self):
+        book(self.guest, self.property, self.check_in, 3).save()
+        with self.assertRaises(ValidationError):
+            book(self.guest, self.property, self.check_in + timedelta(days=2), 3)
+
+    def test_back_to_back_and_canceled_stays_do_not_block(self):
+        first = book(self.guest, self.property, self.check_in, 3).save()
+        book(self.guest, self.property, self.check_in + timedelta(days=3), 2).save()
+        first.status = PROPERTY_STATUS_CHOICES.CANCELED
+        first.save(update_fields=['status'])
+        book(self.guest, self.property, self.check_in, 3).save()
+        self.assertEqual(Booking.objects.filter(status__in=BLOCKING_STATUSES).count(), 2)
+
+    @override_settings(ALLOWED_HOSTS=['*'])
+    def test_stay_over_blocked_dates_is_rejected(self):
+        self.property.blocked_dates = [str(self.check_in + timedelta(days=1))]
+        self.property.save(update_fields=['blocked_dates'])
+        client = APIClient()
+        client.force_authenticate(self.guest)
+        response = client.post('/api/v0/booking/bookings/', {
+            'property': self.property.id,
+            'check_in_date': self.check_in,
+            'check_out_date': self.check_in + timedelta(days=3),
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('blocked', str(response.json()))
+        self.assertFalse(Booking.objects.exists())
+
+    def test_dates_blocked_after_validation_are_rejected_on_save(self):
+        late = book(self.guest, self.property, self.check_in, 3)
+        self.property.blocked_dates = [str(self.check_in)]
+        self.property.save(update_fields=['blocked_dates'])
+        with self.assertRaises(ValidationError):
+            late.save()
+
+    def test_dates_taken_after_validation_are_rejected_on_save(self):
+        # a concurrent request booking the dates between validate() and create()
+        late = book(self.guest, self.property, self.check_in, 3)
+        book(self.guest, self.property, self.check_in + timedelta(days=1), 1).save()
+        with self.assertRaises(ValidationError):
+            late.save()
+        self.assertEqual(Booking.objects.count(), 1)
+
+
+@skipUnless(connection.features.has_select_for_update, 'needs row locks, SQLite serializes writers on its own')
+class ConcurrentBookingTests(TransactionTestCase):
+    threads = 16
+
+    def setUp(self):
+        self.guest = create_host('guest')
+        host = create_host()
+        self.properties = [create_property(host, title=f'Villa {i}') for i in range(self.threads)]
+        self.check_in = date.today() + timedelta(days=30)
+
+    def book_from_threads(self, properties):
+        outcomes = []
+        barrier = threading.Barrier(len(properties))
+
+        def worker(property):
+            try:
+                barrier.wait()
+                book(self.guest, property, self.check_in, 3).save()
+                outcomes.append('created')
+            except ValidationError:
+                outcomes.append('rejected')
+            finally:
+                connection.close()
+
+        pool = [threading.Thread(target=worker, args=(property,)) for property in properties]
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        return outcomes
+
+    def test_same_dates_are_booked_once(self):
+        outcomes = self.book_from_threads([self.properties[0]] * self.threads)
+        self.assertEqual(outcomes.count('created'), 1)
+        self.assertEqual(outcomes.count('rejected'), self.threads - 1)
+        self.assertEqual(Booking.objects.filter(property=self.properties[0]).count(), 1)
+
+    def test_other_properties_are_not_blocked(self):
+        outcomes = self.book_from_threads(self.properties)
+        self.assertEqual(outcomes, ['created'] * self.threads)
+
+
+@override_settings(ALLOWED_HOSTS=['*'])
+class CheckoutSessionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.guest = create_host('guest')
+        cls.property = create_property(create_host())
+        cls.check_in = date.today() + timedelta(days=30)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.guest)
+
+    def test_booking_is_canceled_when_the_session_task_cannot_be_enqueued(self):
+        with mock.patch('booking.views.create_checkout_session.delay', side_effect=ConnectionError('broker down')), \
+                self.assertLogs('booking.views', 'ERROR'):
+            response = self.client.post('/api/v0/booking/bookings/', {
+                'property': self.property.id,
+                'check_in_date': self.check_in,
+                'check_out_date': self.check_in + timedelta(days=2),
+            }, format='json')
+        self.assertEqual(response.status_code, 503)
+        booking = Booking.objects.get()
+        self.assertEqual(booking.status, PROPERTY_STATUS_CHOICES.CANCELED)
+        self.assertEqual(booking.payment_session_status, PAYMENT_SESSION_STATUS_CHOICES.FAILED)
+        self.assertFalse(UnavailableNight.objects.exists())
+
+    def test_sweep_cancels_stale_bookings_without_a_session(self):
+        stale = book(self.guest, self.property, self.check_in, 2).save()
+        with_session = book(self.guest, self.property, self.check_in + timedelta(days=5), 2).save()
+        fresh = book(self.guest, self.property, self.check_in + timedelta(days=10), 2).save()
+        Booking.objects.filter(id__in=[stale.id, with_session.id]).update(created_at=now() - timedelta(hours=2))
+        Booking.objects.filter(id=with_session.id).update(stripe_session_id='cs_test')
+
+        self.assertEqual(expire_unpaid_bookings(), 1)
+        statuses = dict(Booking.objects.values_list('id', 'status'))
+        self.assertEqual(statuses[stale.id], PROPERTY_STATUS_CHOICES.CANCELED)
+        self.assertEqual(statuses[with_session.id], PROPERTY_STATUS_CHOICES.PENDING)
+        self.assertEqual(statuses[fresh.id], PROPERTY_STATUS_CHOICES.PENDING)
+        self.assertFalse(UnavailableNight.objects.filter(booking=stale).exists())
+
+
+@override_settings(ALLOWED_HOSTS=['*'], STRIPE_WEBHOOK_SECRET='whsec_test')
+class StripeWebhookTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.guest = create_host('guest')
+        cls.property = create_property(create_host())
+        cls.check_in = date.today() + timedelta(days=30)
+
+    def setUp(self):
+        self.booking = book(self.guest, self.property, self.check_in, 2).save()
+        Booking.objects.filter(id=self.booking.id).update(stripe_session_id='cs_test')
+
+    def post_event(self, event_id, event_type, **session):
+        payload = json.dumps({
+            'id': event_id, 'object': 'event', 'type': event_type,
+            'data': {'object': {'id': 'cs_test', 'object': 'checkout.session', **session}},
+        })
+        timestamp = int(time.time())
+        signature = hmac.new(b'whsec_test', f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+        return self.client.post('/api/v0/booking/stripe/webhook/', payload, content_type='application/json',
+                                HTTP_STRIPE_SIGNATURE=f't={timestamp},v1={signature}')
+
+    def test_redelivered_events_are_stored_and_queued_once(self):
+        with mock.patch('booking.views.process_stripe_events.delay') as delay:
+            for _ in range(3):
+                response = self.post_event('evt_1', 'checkout.session.completed', payment_status='paid')
+                self.assertEqual(response.status_code, 200)
+        self.assertEqual(StripeEvent.objects.count(), 1)
+        delay.assert_called_once()
+
+        self.assertEqual(process_stripe_events(), 1)
+        self.booking.refresh_from_db()
+        self.assertTrue(self.booking.is_paid)
+        self.assertEqual(self.booking.status, PROPERTY_STATUS_CHOICES.CONFIRMED)
+
+    def test_invalid_signature_is_rejected(self):
+        response = self.client.post('/api/v0/booking/stripe/webhook/', '{}', content_type='application/json',
+                                    HTTP_STRIPE_SIGNATURE='t=1,v1=bad')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_payment_of_a_canceled_booking_is_refunded_not_confirmed(self):
+        Booking.objects.filter(id=self.booking.id).update(status=PROPERTY_STATUS_CHOICES.CANCELED)
+        with mock.patch('booking.views.process_stripe_events.delay'):
+            self.post_event('evt_1', 'checkout.session.completed', payment_status='paid', payment_intent='pi_test')
+        with mock.patch('booking.tasks.refund_checkout_session.delay') as refund, \
+                self.assertLogs('booking.tasks', 'WARNING'), self.captureOnCommitCallbacks(execute=True):
+            process_stripe_events()
+        refund.assert_called_once_with(self.booking.id, 'pi_test')
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.status, PROPERTY_STATUS_CHOICES.CANCELED)
+
+    def test_failed_payment_cancels_the_booking_and_its_cached_availability(self):
+        cache.clear()
+        version = get_version(AVAILABILITY_VERSION_KEY)
+        with mock.patch('booking.views.process_stripe_events.delay'):
+            self.post_event('evt_1', 'checkout.session.expired', payment_status='unpaid')
+        process_stripe_events()
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.status, PROPERTY_STATUS_CHOICES.CANCELED)
+        self.assertFalse(UnavailableNight.objects.filter(booking=self.booking).exists())
+        self.assertNotEqual(get_version(AVAILABILITY_VERSION_KEY), version)
+
+
+class MessageBufferTests(TransactionTestCase):
+    # a real commit per flush, foreign keys are only checked there
+
+    def setUp(self):
+        self.user = create_host()
+        self.conversation = Conversation.objects.create()
+        self.buffer = MessageBuffer(flush_interval=60, batch_size=100)
+
+    async def test_a_row_the_database_refuses_does_not_block_the_others(self):
+        futures = [
+            self.buffer.add(self.conversation.id, self.user.id, 'first'),
+            # a sender deleted since the frame was sent
+            self.buffer.add(self.conversation.id, 10_000, 'orphan'),
+            self.buffer.add(self.conversation.id, self.user.id, 'second'),
+        ]
+        with self.assertLogs('booking.message_buffer', 'ERROR'):
+            await self.buffer.flush()
+
+        first, orphan, second = [future.result() for future in futures]
+        self.assertIsNone(orphan)
+        self.assertEqual((first.content, second.content), ('first', 'second'))
+        self.assertEqual(self.buffer._pending, [])
+        self.assertEqual(await Message.objects.acount(), 2)
+
+        # later flushes are not held back by the refused row
+        future = self.buffer.add(self.conversation.id, self.user.id, 'third')
+        await self.buffer.flush()
+        self.assertEqual(future.result().content, 'third')
+
+
+@override_settings(ALLOWED_HOSTS=['*'])
+class ConversationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.guest, cls.host = create_host('guest'), create_host('host')
+        cls.conversation = Conversation.objects.create(property=create_property(cls.host))
+        cls.conversation.participants.add(cls.guest, cls.host)
+        cls.messages = [
+            Message.objects.create(conversation=cls.conversation, sender=cls.host if i % 2 else cls.guest, content=f'm{i}')
+            for i in range(7)
+        ]
+        # a second thread where nothing was said yet
+        cls.empty = Conversation.objects.create()
+        cls.empty.participants.add(cls.guest, cls.host)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.guest)
+
+    def url(self, conversation, route=''):
+        return f'/api/v0/booking/conversations/{conversation.id}/{route}'
+
+    def inbox(self):
+        return {conversation['id']: conversation for conversation in self.client.get('/api/v0/booking/conversations/').json()}
+
+    def history(self, **params):
+        return self.client.get(self.url(self.conversation, 'messages/'), params).json()
+
+    def test_inbox_has_the_last_message_and_unread_count(self):
+        # conversations with their counts, the participants and the last messages
+        with self.assertNumQueries(3):
+            inbox = self.inbox()
+        preview = inbox[self.conversation.id]
+        self.assertEqual(preview['last_message']['content'], 'm6')
+        self.assertEqual(preview['other_user']['id'], self.host.id)
+        self.assertNotIn('messages', preview)
+        # only the messages of the other participant are unread
+        self.assertEqual(preview['unread_count'], 3)
+        self.assertEqual((inbox[self.empty.id]['last_message'], inbox[self.empty.id]['unread_count']), (None, 0))
+
+    def test_marking_as_read(self):
+        response = self.client.post(self.url(self.conversation, 'read/'), {'message_id': self.messages[3].id})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.inbox()[self.conversation.id]['unread_count'], 1)
+
+        # the marker never moves backwards, and defaults to the latest message
+        self.client.post(self.url(self.conversation, 'read/'), {'message_id': self.messages[1].id})
+        self.assertEqual(self.inbox()[self.conversation.id]['unread_count'], 1)
+        self.client.post(self.url(self.conversation, 'read/'))
+        self.assertEqual(ConversationReadState.objects.get(user=self.guest).last_read_message_id, self.messages[-1].id)
+        self.assertEqual(self.client.post(self.url(self.conversation, 'read/'), {'message_id': 'x'}).status_code, 400)
+
+    def test_reading_the_history_does_not_mark_it_as_read(self):
+        self.history()
+        self.assertFalse(ConversationReadState.objects.exists())
+
+    def test_history_pages_by_before_and_after(self):
+        ids = [message.id for message in self.messages]
+        latest = self.history(page_size=3)
+        self.assertEqual([message['id'] for message in latest['results']], ids[4:])
+        self.assertEqual((latest['has_more'], latest['before'], latest['after']), (True, ids[4], ids[6]))
+
+        older = self.history(page_size=3, before=latest['before'])
+        self.assertEqual([message['id'] for message in older['results']], ids[1:4])
+        oldest = self.history(page_size=3, before=older['before'])
+        self.assertEqual(([message['id'] for message in oldest['results']], oldest['has_more'], oldest['before']),
+                         ([ids[0]], False, None))
+
+        newer = self.history(page_size=3, after=ids[1])
+        self.assertEqual([message['id'] for message in newer['results']], ids[2:5])
+        self.assertTrue(newer['has_more'])
+        caught_up = self.history(page_size=3, after=ids[6])
+        self.assertEqual((caught_up['results'], caught_up['has_more'], caught_up['after']), ([], False, ids[6]))
+
+    def test_detail_keeps_the_messages(self):
+        detail = self.client.get(self.url(self.conversation)).json()
+        self.assertEqual([message['content'] for message in detail['messages']], [f'm{i}' for i in range(7)])
+        self.assertEqual(detail['property']['id'], self.conversation.property_id)
+        self.assertEqual(detail['unread_count'], 3)
+
+    def test_other_users_cannot_read_the_thread(self):
+        self.client.force_authenticate(create_host('stranger'))
+        self.assertEqual(self.client.get(self.url(self.conversation, 'messages/')).status_code, 404)
+        self.assertEqual(self.client.post(self.url(self.conversation, 'read/')).status_code, 404)
+
+
+def chat_communicator(conversation, user):
+    router = URLRouter(websocket_urlpatterns)
+
+    async def application(scope, receive, send):
+        # what the JWT middleware puts in the scope
+        return await router({**scope, 'user_id': user.id}, receive, send)
+
+    return WebsocketCommunicator(application, f'ws/chat/{conversation.id}/')
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ChatMembershipTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.member, self.stranger = create_host('member'), create_host('stranger')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.member)
+
+    async def connects(self, user):
+        communicator = chat_communicator(self.conversation, user)
+        connected, _ = await communicator.connect()
+        if connected:
+            await communicator.disconnect()
+        return connected
+
+    async def test_non_participant_is_closed_before_joining_the_room(self):
+        with mock.patch('channels.layers.InMemoryChannelLayer.group_add') as group_add:
+            self.assertFalse(await self.connects(self.stranger))
+        group_add.assert_not_called()
+
+    async def test_membership_cache_follows_participant_changes(self):
+        # both answers are cached, the refusal included
+        self.assertTrue(await self.connects(self.member))
+        self.assertFalse(await self.connects(self.stranger))
+
+        await self.conversation.participants.aadd(self.stranger)
+        self.assertTrue(await self.connects(self.stranger))
+        await self.conversation.participants.aremove(self.member)
+        self.assertFalse(await self.connects(self.member))
+        # and from the user's side of the relation
+        await self.stranger.conversations.aclear()
+        self.assertFalse(await self.connects(self.stranger))
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class WebsocketAuthTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_host('member')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user)
+        self.token = str(AccessToken.for_user(self.user))
+        self.application = JWTAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+
+    async def handshake(self, path='', subprotocols=None):
+        communicator = WebsocketCommunicator(
+            self.application, f'ws/chat/{self.conversation.id}/{path}', subprotocols=subprotocols)
+        connected, subprotocol = await communicator.connect()
+        if connected:
+            await communicator.disconnect()
+        return connected, subprotocol
+
+    async def test_token_in_the_query_string(self):
+        self.assertEqual(await self.handshake(f'?token={self.token}'), (True, None))
+        with self.assertLogs('booking.middleware', 'INFO'):
+            self.assertFalse((await self.handshake('?token=nope'))[0])
+        self.assertFalse((await self.handshake())[0])
+
+    async def test_token_in_the_subprotocols_is_echoed_back(self):
+        self.assertEqual(await self.handshake(subprotocols=['bearer', self.token]), (True, 'bearer'))
+        self.assertFalse((await self.handshake(subprotocols=['bearer']))[0])
+
+    async def test_verified_tokens_skip_the_signature_check(self):
+        with mock.patch('booking.middleware.AccessToken', wraps=AccessToken) as decode:
+            for _ in range(3):
+                self.assertTrue((await self.handshake(f'?token={self.token}'))[0])
+        self.assertEqual(decode.call_count, 1)
+
+    def test_token_cache_evicts_the_least_recently_used(self):
+        tokens = VerifiedTokenCache(2)
+        exp = time.time() + 60
+        tokens.set('a', 1, exp)
+        tokens.set('b', 2, exp)
+        self.assertEqual(tokens.get('a'), 1)
+        tokens.set('c', 3, exp)
+        self.assertEqual((tokens.get('a'), tokens.get('b'), tokens.get('c')), (1, None, 3))
+
+    def test_token_cache_drops_expired_tokens(self):
+        tokens = VerifiedTokenCache(2)
+        tokens.set('a', 1, time.time() - 1)
+        self.assertIsNone(tokens.get('a'))
+        self.assertNotIn('a', tokens._entries)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ReadReceiptTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.reader, self.writer = create_host('reader'), create_host('writer')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.reader, self.writer)
+        self.latest = Message.objects.create(conversation=self.conversation, sender=self.writer, content='hi')
+
+    def connect(self, user):
+        return chat_communicator(self.conversation, user)
+
+    def test_stored_position_is_capped_at_the_latest_message(self):
+        ReadStateBuffer()._write({(self.conversation.id, self.reader.id): 1_000_000})
+        state = ConversationReadState.objects.get(user=self.reader)
+        self.assertEqual(state.last_read_message_id, self.latest.id)
+
+    async def test_relayed_position_is_capped_at_the_latest_message(self):
+        writer, reader = self.connect(self.writer), self.connect(self.reader)
+        self.assertTrue((await writer.connect())[0])
+        self.assertTrue((await reader.connect())[0])
+        await writer.receive_json_from()  # the reader coming online
+
+        await reader.send_json_to({'type': 'read', 'message_id': 1_000_000})
+        frame = await writer.receive_json_from()
+        self.assertEqual((frame['type'], frame['message_id']), ('read', self.latest.id))
+        await writer.disconnect()
+        await reader.disconnect()
+
+
+class WaitlistReleaseTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.guest = create_host('guest')
+        cls.property = create_property(create_host())
+
+    def test_only_the_change_into_canceled_releases_the_dates(self):
+        booking = book(self.guest, self.property, date.today() + timedelta(days=30), 2).save()
+        with mock.patch('booking.signals.handlers.waitlist.release_properties') as release:
+            booking.status = PROPERTY_STATUS_CHOICES.CANCELED
+            booking.save()
+            # admin edits and timestamp touches of the canceled booking
+            booking.save()
+            booking.save(update_fields=['status', 'updated_at'])
+            Booking.objects.get(pk=booking.pk).save()
+        release.assert_called_once_with([self.property.id])
+
+
+@override_settings(ALLOWED_HOSTS=['*'])
+class PropertySearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        host = create_host()
+        create_property(host, title='Villa in Oran', city_name='Oran', category='villa')
+        create_property(host, title='Apartment', description='Close to the villa district')
+        create_property(host, title='Studio', city_name='Constantine', category='studio')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def titles(self, text, **params):
+        response = self.client.get('/api/v0/booking/properties/', {'q': text, 'page_size': 10, **params})
+        self.assertEqual(response.status_code, 200)
+        return [property['title'] for property in response.json()['results']]
+
+    def test_title_matches_rank_above_description_matches(self):
+        self.assertEqual(self.titles('villa'), ['Villa in Oran', 'Apartment'])
+        # an explicit sort wins over relevance
+        self.assertEqual(self.titles('villa', sort='oldest'), ['Villa in Oran', 'Apartment'])
+        self.assertEqual(self.titles('villa', sort='newest'), ['Apartment', 'Villa in Oran'])
+
+    def test_terms_match_word_prefixes(self):
+        self.assertEqual(self.titles('vill ora'), ['Villa in Oran'])
+        self.assertEqual(self.titles('CONST'), ['Studio'])
+
+    def test_every_term_must_match(self):
+        self.assertEqual(self.titles('villa constantine'), [])
+        self.assertEqual(self.titles('!!'), [])
+
+    @skipUnless(connection.vendor == 'postgresql', 'trigram similarity needs PostgreSQL')
+    def test_misspelt_title_or_city_still_matches(self):
+        self.assertEqual(self.titles('Costantine'), ['Studio'])
+
+    @skipUnless(connection.vendor != 'postgresql', 'the icontains fallback only runs off PostgreSQL')
+    def test_fallback_has_no_typo_tolerance(self):
+        self.assertEqual(self.titles('Costantine'), [])
+
+
+class AutocompleteTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.host = create_host()
+        for title in ('Villa Oran', 'Studio', 'Loft'):
+            create_property(cls.host, title=title, city_name='Oran')
+        create_property(cls.host, title='Villa Béjaïa', city_name='Béjaïa')
+        create_property(cls.host, title='Riad', city_name='Oujda')
+        create_property(cls.host, title='Hidden', city_name='Orléans', is_available=False)
+
+    def setUp(self):
+        cache.clear()
+        self.index = AutocompleteIndex(refresh_interval=3600)
+        self.index.build()
+
+    def texts(self, prefix, limit=8, index=None):
+        return [(suggestion['text'], suggestion['count']) for suggestion in (index or self.index).suggest(prefix, limit)]
+
+    def test_prefixes_match_without_case_nor_accents(self):
+        self.assertEqual(self.texts('VIL'), [('Villa Béjaïa', 1), ('Villa Oran', 1)])
+        self.assertEqual(self.texts('beja'), [('Béjaïa', 1)])
+        self.assertEqual(self.texts('villa  o'), [('Villa Oran', 1)])
+        self.assertEqual(self.texts('x'), [])
+        self.assertEqual(self.texts('  '), [])
+
+    def test_most_listed_first_and_unlisted_left_out(self):
+        self.assertEqual(self.texts('o'), [('Oran', 3), ('Oujda', 1)])
+        self.assertEqual(self.texts('o', limit=1), [('Oran', 3)])
+        self.assertEqual([suggestion['kind'] for suggestion in self.index.suggest('r')], [TITLE])
+
+    def test_apply_updates_the_index_in_place(self):
+        self.assertEqual(self.texts('ou'), [('Oujda', 1)])
+        version = get_version(AUTOCOMPLETE_VERSION_KEY)
+        self.index.apply([(TITLE, 'Riad')], [(CITY, 'Oujda'), (TITLE, 'Oujda Riad')], version + 1)
+        # the remembered top of "ou" and "r" were dropped
+        self.assertEqual(self.texts('ou'), [('Oujda', 2), ('Oujda Riad', 1)])
+        self.assertEqual(self.texts('r'), [])
+
+        # an index that missed a write in between is left for the rebuild
+        self.index.apply([], [(CITY, 'Tlemcen')], version + 3)
+        self.assertEqual(self.texts('tl'), [])
+
+    def test_requests_are_served_by_the_stale_index_while_it_rebuilds(self):
+        index = AutocompleteIndex(refresh_interval=0.001)
+        builders = []
+        with mock.patch('booking.autocomplete.threading.Thread') as thread:
+            # builds that already finished, warm() starts a new one whenever asked
+            thread.side_effect = lambda **kwargs: builders.append(kwargs) or mock.Mock(**{'is_alive.return_value': False})
+            # never built: nothing to serve, the build runs in the background
+            self.assertEqual(self.texts('o', index=index), [])
+            self.assertEqual((len(builders), builders[0]['target']), (1, index._build_in_background))
+            index.build()
+
+            Property.objects.bulk_create([Property(host=self.host, title='Dar', city_name='Oran', address='1 rue',
+                                                   max_guests=2, price_per_night=100)])
+            bump_version(AUTOCOMPLETE_VERSION_KEY)  # another process wrote
+            time.sleep(0.002)
+            self.assertEqual(self.texts('o', index=index), [('Oran', 3), ('Oujda', 1)])
+            self.assertEqual(len(builders), 2)
+        index.build()
+        self.assertEqual(self.texts('o', index=index), [('Oran', 4), ('Oujda', 1)])
+
+    def test_one_build_at_a_time(self):
+        index = AutocompleteIndex()
+        with mock.patch('booking.autocomplete.threading.Thread') as thread:
+            thread.return_value.is_alive.return_value = True
+            index.warm()
+            index.warm()
+        thread.assert_called_once()
+
+    def test_property_signals_update_the_index_of_this_process(self):
+        autocomplete_index.build()
+        studio = Property.objects.get(title='Studio')
+        with self.captureOnCommitCallbacks(execute=True):
+            studio.title = 'Chalet'
+            studio.save()
+        self.assertEqual(self.texts('chal', index=autocomplete_index), [('Chalet', 1)])
+        self.assertEqual(self.texts('stu', index=autocomplete_index), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Property.objects.get(title='Riad').delete()
+        self.assertEqual(self.texts('ri', index=autocomplete_index), [])
+        self.assertEqual(self.texts('ou', index=autocomplete_index), [])
+
+        loft = Property.objects.get(title='Loft')
+        with self.captureOnCommitCallbacks(execute=True):
+            loft.is_available = False
+            loft.save(update_fields=['is_available'])
+        self.assertEqual(self.texts('o', index=autocomplete_index), [('Oran', 2)])
+
+
+@override_settings(ALLOWED_HOSTS=['*'])
+class GeoSearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        host = create_host()
+        places = {
+            'center': (36.75, 3.06), 'north': (36.80, 3.06), 'far': (38.75, 3.06),
+            'fiji-east': (-17.0, 179.5), 'fiji-west': (-17.0, -179.5), 'vanuatu': (-17.0, 170.0),
+        }
+        # same spot, same distance from anywhere: only the id tells them apart
+        places.update({f'tie-{i}': (36.75, 3.16) for i in range(5)})
+        for title, (latitude, longitude) in places.items():
+            create_property(host, title=title, latitude=latitude, longitude=longitude)
+        create_property(host, title='unlocated')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def search(self, **params):
+        response = self.client.get('/api/v0/booking/properties/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def titles(self, **params):
+        return [property['title'] for property in self.search(**params)]
+
+    def test_radius_keeps_the_properties_in_range_nearest_first(self):
+        results = self.search(lat=36.75, lng=3.06, radius=50)
+        self.assertEqual([property['title'] for property in results[:2]], ['center', 'north'])
+        self.assertEqual(sorted(property['title'] for property in results[2:]), [f'tie-{i}' for i in range(5)])
+        distances = [property['distance'] for property in results]
+        self.assertEqual(distances, sorted(distances))
+        self.assertAlmostEqual(distances[1], 5.56, places=2)
+        self.assertEqual(len(self.titles(lat=36.75, lng=3.06, radius=300)), 8)
+
+    def test_bbox_keeps_the_properties_inside(self):
+        self.assertEqual(sorted(self.titles(bbox='36.7,3.0,36.77,3.2')), ['center'] + [f'tie-{i}' for i in range(5)])
+        # the plain listing answers an empty result with a 404
+        self.assertEqual(self.client.get('/api/v0/booking/properties/', {'bbox': '0,0,1,1'}).status_code, 404)
+
+    def test_boxes_crossing_the_antimeridian(self):
+        self.assertEqual(sorted(self.titles(bbox='-18,179,-16,-179')), ['fiji-east', 'fiji-west'])
+        self.assertEqual(self.titles(lat=-17.0, lng=179.9, radius=100), ['fiji-east', 'fiji-west'])
+
+    def test_nearest_first_pages_neither_skip_nor_repeat_ties(self):
+        expected = [property['id'] for property in self.search(lat=36.75, lng=3.06, radius=50)]
+        pages, url = [], '/api/v0/booking/properties/?lat=36.75&lng=3.06&radius=50&page_size=2'
+        while url:
+            page = self.client.get(url).json()
+            pages.append(page)
+            url = page['next']
+        self.assertEqual([property['id'] for page in pages for property in page['results']], expected)
+
+        # and back from the last page
+        previous = self.client.get(pages[-1]['previous']).json()
+        self.assertEqual(previous['results'], pages[-2]['results'])
+        self.assertIsNone(pages[0]['previous'])
+
+    def test_bad_nearest_cursor_is_not_found(self):
+        response = self.client.get('/api/v0/booking/properties/?lat=36.75&lng=3.06&cursor=cD1ub3BlJnI9MA%3D%3D')
+        self.assertEqual(response.status_code, 404)
+
+
+def viewport_bbox(latitude, longitude, zoom, width=1920, height=1080):
+    """bbox of a web mercator map of width x height pixels centred on the point."""
+    scale = 256 * 2 ** zoom
+    x = (longitude + 180) / 360 * scale
+    y = (1 - math.asinh(math.tan(math.radians(latitude))) / math.pi) / 2 * scale
+
+    def unproject(x, y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / scale)))), x / scale * 360 - 180
+
+    north, west = unproject(x - width / 2, y - height / 2)
+    south, east = unproject(x + width / 2, y + height / 2)
+    return south, west, north, east
+
+
+@override_settings(ALLOWED_HOSTS=['*'])
+class MapClusterTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        host = create_host()
+        for i in range(3):
+            create_property(host, title=f'Villa {i}', latitude=36.75 + i * 0.0002, longitude=3.06 + i * 0.0003)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_full_hd_map_is_clustered_at_every_zoom(self):
+        for zoom in range(3, 21):
+            bbox = ','.join(str(value) for value in viewport_bbox(36.75, 3.06, zoom))
+            response = self.client.get(f'/api/v0/booking/properties/clusters/?bbox={bbox}&zoom={zoom}')
+            self.assertEqual(response.status_code, 200, f'zoom {zoom}')
+            self.assertEqual(sum(cluster['count'] for cluster in response.json()['clusters']), 3, f'zoom {zoom}')
+
+
+class PropertyImportExportTests(TestCase):
+
+    fields = ('title', 'city_name', 'address', 'price_per_night', 'max_guests', 'description', 'category',
+              'latitude', 'longitude', 'host__username')
+
+    def setUp(self):
+        self.host = create_host()
+        create_property(self.host, title='Villa, sea view', description='Line one\nline "two"',
+                        category='villa', latitude=36.75, longitude=3.06)
+        # no coordinates, an empty csv cell
+        create_property(self.host, title='Studio', city_name='Oran', price_per_night=2500)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def run_command(self, *args, **options):
+        out, err = io.StringIO(), io.StringIO()
+        call_command(*args, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def rows(self):
+        return sorted(Property.objects.values_list(*self.fields))
+
+    def test_export_then_import_gives_the_same_properties(self):
+        exported = self.rows()
+        for name in ('properties.csv', 'properties.jsonl'):
+            with self.subTest(name):
+                self.run_command('export_properties', self.path(name))
+                Property.objects.all().delete()
+                out, _ = self.run_command('import_properties', self.path(name))
+                self.assertIn('Imported 2 properties, skipped 0', out)
+                self.assertEqual(self.rows(), exported)
+                self.assertEqual(set(Property.objects.values_list('city__name', flat=True)), {'Alger', 'Oran'})
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        rows = [
+            {'title': 'Fine', 'city': 'Alger', 'address': '1 rue', 'price_per_night': 100, 'max_guests': 2, 'host': 'host'},
+            {'title': 'Free', 'city': 'Alger', 'address': '1 rue', 'price_per_night': 0, 'max_guests': 2, 'host': 'host'},
+            {'title': 'Orphan', 'city': 'Alger', 'address': '1 rue', 'price_per_night': 100, 'max_guests': 2, 'host': 'nobody'},
+            {'title': 'Nowhere', 'city': 'Alger', 'address': '1 rue', 'price_per_night': 100, 'max_guests': 2,
+             'latitude': 95, 'longitude': 3, 'host': 'host'},
+        ]
+        with open(self.path('new.jsonl'), 'w') as stream:
+            stream.writelines(json.dumps(row) + '\n' for row in rows)
+        out, err = self.run_command('import_properties', self.path('new.jsonl'), batch_size=2)
+        self.assertIn('Imported 1 properties, skipped 3', out)
+        self.assertIn('row 2 skipped: {"price_per_night": ["Price must be greater than 0"]}', err)
+        self.assertIn("row 3 skipped: {\"host\": [\"No user named 'nobody'\"]}", err)
+        self.assertIn('row 4 skipped', err)
+        self.assertTrue(Property.objects.filter(title='Fine', host=self.host).exists())
+
+    def test_dry_run_writes_nothing(self):
+        self.run_command('export_properties', self.path('properties.csv'))
+        Property.objects.all().delete()
+        version = get_version(LIST_VERSION_KEY)
+        out, _ = self.run_command('import_properties', self.path('properties.csv'), dry_run=True)
+        self.assertIn('Validated 2 properties', out)
+        self.assertFalse(Property.objects.exists())
+        self.assertEqual(get_version(LIST_VERSION_KEY), version)
+
+
+@override_settings(ALLOWED_HOSTS=['*'])
+class CityTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.host = create_host()
+        cls.tizi = create_property(cls.host, title='Villa', city_name='Tizi Ouzou')
+        create_property(cls.host, title='Studio', city_name=' tizi  OUZOU')
+        create_property(cls.host, title='Loft', city_name='Oran')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def titles(self, city):
+        response = self.client.get('/api/v0/booking/properties/', {'city': city, 'sort': 'oldest'})
+        self.assertEqual(response.status_code, 200)
+        return [property['title'] for property in response.json()]
+
+    def test_spellings_share_one_city(self):
+        self.assertEqual(list(City.objects.values_list('name', 'slug')), [('Oran', 'oran'), ('Tizi Ouzou', 'tizi-ouzou')])
+        self.assertEqual(set(Property.objects.exclude(title='Loft').values_list('city_name', flat=True)), {'Tizi Ouzou'})
+
+    def test_listing_filters_by_city_id_and_slug(self):
+        self.assertEqual(self.titles(self.tizi.city_id), ['Villa', 'Studio'])
+        self.assertEqual(self.titles('tizi-ouzou'), ['Villa', 'Studio'])
+        self.assertEqual(self.titles('TIZI OUZOU'), ['Villa', 'Studio'])
+        self.assertEqual(self.client.get('/api/v0/booking/properties/', {'city': 'alger'}).status_code, 404)
+
+    def test_city_id_is_serialized(self):
+        property = self.client.get(f'/api/v0/booking/properties/{self.tizi.id}/').json()
+        self.assertEqual((property['city'], property['city_id']), ('Tizi Ouzou', self.tizi.city_id))
+
+    def test_city_is_only_resolved_when_the_name_changes(self):
+        property = Property.objects.get(id=self.tizi.id)
+        with mock.patch.object(City, 'for_names', wraps=City.for_names) as for_names:
+            property.price_per_night = 7000
+            property.save()
+            for_names.assert_not_called()
+
+            property.city_name = 'oran'
+            property.save()
+            self.assertEqual((property.city.slug, property.city_name), ('oran', 'Oran'))
+            self.assertEqual(for_names.call_count, 1)
+
+            create_property(self.host, city_name='Oran')
+            self.assertEqual(for_names.call_count, 2)
+
+
+class CityMigrationTests(TransactionTestCase):
+    migrate_from = [('booking', '0014_property_search_indexes')]
+    migrate_to = [('booking', '0015_city')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_typed_names_are_grouped_under_their_most_used_spelling(self):
+        apps = self.migrate(self.migrate_from)
+        OldProperty = apps.get_model('booking', 'Property')
+        host = create_host()
+        for index, name in enumerate(['Béjaïa', 'bejaia', ' Béjaïa ', 'Oran', '???']):
+            OldProperty.objects.create(title=f'p{index}', address='1 rue', city=name, max_guests=2,
+                                       price_per_night=100, host_id=host.id)
+
+        apps = self.migrate(self.migrate_to)
+        City = apps.get_model('booking', 'City')
+        NewProperty = apps.get_model('booking', 'Property')
+        self.assertEqual(sorted(City.objects.values_list('slug', 'name')), [('bejaia', 'Béjaïa'), ('oran', 'Oran')])
+        self.assertEqual(
+            sorted(NewProperty.objects.values_list('title', 'city_name', 'city__slug')),
+            [('p0', 'Béjaïa', 'bejaia'), ('p1', 'Béjaïa', 'bejaia'), ('p2', 'Béjaïa', 'bejaia'),
+             ('p3', 'Oran', 'oran'), ('p4', '???', None)],
+        )
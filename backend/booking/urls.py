@@ -35,6 +35,7 @@ urlpatterns = [
     path('public-key/', views.StripePublicKeyView.as_view(), name='stripe-public-key'),
     path('stripe/success/',views.success,name='stripe-success'),
     path('stripe/cancel/',views.cancel,name='stripe-cancel'),
+    path('stripe/webhook/',views.stripe_webhook,name='stripe-webhook'),
     
     # Add availability check endpoint
     path('properties/<int:pk>/check-availability/', 
@@ -1,17 +1,22 @@
+import logging
 from datetime import datetime
 from django.core.validators import ValidationError
-from django.db.models import Q
+from django.db.models import Count, OuterRef, Prefetch, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils.timezone import now
 from django.views.generic import detail
 from rest_framework.generics import get_object_or_404
 import stripe
 from django.conf import settings
+from django.core.cache import cache
 from django.shortcuts import HttpResponse, redirect, render, reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from rest_framework import (
     viewsets,
     status,
     permissions,
     mixins,
-    filters,
 )
 from rest_framework.viewsets import ReadOnlyModelViewSet, ModelViewSet
 from rest_framework.decorators import action
@@ -23,29 +28,125 @@ from rest_framework.views import APIView
 from rest_framework import viewsets
 from rest_framework import mixins
 from rest_framework import viewsets
+from booking import geo, waitlist
+from booking.autocomplete import DEFAULT_LIMIT, autocomplete_index
+from booking.availability import filter_available_between, first_unavailable_night
+from booking.cache import (
+    AVAILABILITY_VERSION_KEY, LIST_VERSION_KEY, PropertyCacheMixin, cluster_key_prefix, property_version_key,
+)
+from booking.message_buffer import read_state_buffer
+from booking.pagination import MessageHistoryPagination, PropertyCursorPagination
 from booking.permissions import IsHostOrReadOnly
+from booking.search import PropertySearchFilter, search
 from booking.serializers import (
     BookingSerializer,
     CreateConversationSerializer,
     CreatePropertySerializer,
     PropertyImagesSerializer,
     PropertySerializer,
+    ConversationDetailSerializer,
+    ConversationListSerializer,
     ConversationSerializer,
     MessageSerializer,
 )
 
-from .models import Booking, Conversation, Property, PropertyImage, WaitListEntry, Message
+from .models import Booking, Conversation, ConversationReadState, Property, PropertyImage, StripeEvent, WaitListEntry, Message, city_slug
+from .tasks import create_checkout_session, process_stripe_events
+from BookingApplication.constants import PAYMENT_SESSION_STATUS_CHOICES, PROPERTY_STATUS_CHOICES
 from datetime import timedelta
 
+logger = logging.getLogger(__name__)
+
 
-class PropertyViewSet(ReadOnlyModelViewSet):
+class PropertyViewSet(PropertyCacheMixin, ReadOnlyModelViewSet):
     serializer_class = PropertySerializer
     permission_classes = [AllowAny]  # Allow anyone to view properties
+    pagination_class = PropertyCursorPagination
+    default_radius_km = 25
+    max_radius_km = 500
+    max_zoom = 20
+    max_cluster_tiles = 64
+    autocomplete_limit = DEFAULT_LIMIT
+    max_autocomplete_limit = 20
+    # query params narrowing the listing, the map clusters are cached per combination of them
+    listing_filters = ('q', 'city', 'category', 'min_price', 'max_price', 'max_guests', 'check_in_date', 'check_out_date')
+
+    def get_stay_dates(self):
+        """
+        Parse the optional check_in_date/check_out_date search params, both or neither must be given.
+        """
+        check_in_date = self.request.query_params.get("check_in_date")
+        check_out_date = self.request.query_params.get("check_out_date")
+        if not check_in_date and not check_out_date:
+            return None
+        if not check_in_date or not check_out_date:
+            raise ValidationError({"message": "Both check-in and check-out dates are required"})
+        try:
+            check_in = datetime.strptime(check_in_date, '%Y-%m-%d').date()
+            check_out = datetime.strptime(check_out_date, '%Y-%m-%d').date()
+        except ValueError:
+            raise ValidationError({"message": "Invalid date format. Use YYYY-MM-DD"})
+        if check_in >= check_out:
+            raise ValidationError({"message": "Check-out date must be after check-in date"})
+        return check_in, check_out
+
+    def get_float_params(self, *names):
+        try:
+            return [float(self.request.query_params[name]) for name in names]
+        except ValueError:
+            raise ValidationError({"message": f"{', '.join(names)} must be numbers"})
+
+    def get_area(self):
+        """
+        Parse the optional map search params:
+        * `bbox=south,west,north,east` : properties inside the box (west > east crosses the antimeridian)
+        * `lat`, `lng` and optional `radius` in km : properties around the point, nearest first
+        """
+        params = self.request.query_params
+        if 'lat' in params or 'lng' in params:
+            if 'lat' not in params or 'lng' not in params:
+                raise ValidationError({"message": "Both lat and lng are required"})
+            latitude, longitude = self.get_float_params('lat', 'lng')
+            radius = self.get_float_params('radius')[0] if 'radius' in params else self.default_radius_km
+            if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+                raise ValidationError({"message": "lat must be within [-90, 90] and lng within [-180, 180]"})
+            if not 0 < radius <= self.max_radius_km:
+                raise ValidationError({"message": f"radius must be between 0 and {self.max_radius_km} km"})
+            return 'radius', (latitude, longitude, radius)
+        if 'bbox' in params:
+            return 'bbox', self.get_bbox()
+        return None
+
+    def get_bbox(self):
+        try:
+            south, west, north, east = map(float, self.request.query_params['bbox'].split(','))
+        except KeyError:
+            raise ValidationError({"message": "bbox is required"})
+        except ValueError:
+            raise ValidationError({"message": "bbox must be south,west,north,east"})
+        if not -90 <= south <= north <= 90 or not -180 <= west <= 180 or not -180 <= east <= 180:
+            raise ValidationError({"message": "bbox must be south,west,north,east with valid coordinates"})
+        return south, west, north, east
+
+    def get_city_filter(self):
+        """
+        `city` is a City id or its slug/name ("tizi-ouzou", "Tizi Ouzou"), both served by an index.
+        the city facets count every city of the listing, they ignore it
+        """
+        city = self.request.query_params.get("city", "").strip()
+        if not city or self.action == 'cities':
+            return None
+        return {"city_id": int(city)} if city.isdigit() else {"city__slug": city_slug(city)}
 
     def get_queryset(self):
+        # only the listing and the map search by dates, detail routes keep resolving any available property
+        stay_dates = self.get_stay_dates() if self.action in ('list', 'clusters', 'cities') else None
+        city_filter = self.get_city_filter()
+        area = self.get_area() if self.action == 'list' else None
+        search_text = self.request.query_params.get("q", "").strip()
         try:
-            # Start with base queryset
-            queryset = Property.objects.all()
+            # Start with base queryset, host and images are loaded up front since the serializer needs them for every row
+            queryset = Property.objects.select_related('host').prefetch_related('images')
             
             # Apply filters
             category = self.request.query_params.get("category")
@@ -53,6 +154,8 @@ class PropertyViewSet(ReadOnlyModelViewSet):
             max_price = self.request.query_params.get("max_price")
             max_guests = self.request.query_params.get("max_guests")
             
+            if city_filter:
+                queryset = queryset.filter(**city_filter)
             if max_guests:
                 queryset = queryset.filter(max_guests__lte=max_guests)
             if category:
@@ -61,17 +164,42 @@ class PropertyViewSet(ReadOnlyModelViewSet):
                 queryset = queryset.filter(price_per_night__gte=min_price)
             if max_price:
                 queryset = queryset.filter(price_per_night__lte=max_price)
+            # free text search, best match first unless the listing is sorted otherwise
+            if search_text:
+                queryset = search(queryset, search_text)
                 
             # Only return available properties
             queryset = queryset.filter(is_available=True)
+
+            # Free for the whole stay, resolved in the same query instead of one check_availability call per card
+            if stay_dates:
+                queryset = filter_available_between(queryset, *stay_dates)
+
+            # map searches go through the geohash grid index, radius searches come back nearest first
+            if area:
+                kind, bounds = area
+                queryset = geo.within_radius(queryset, *bounds) if kind == 'radius' else geo.within_bbox(queryset, *bounds)
                 
             return queryset
             
         except Exception as e:
-            print(f'Error in get_queryset: {str(e)}')
+            logger.exception('Failed to build the property queryset')
             return Property.objects.none()
 
     def list(self, request, *args, **kwargs):
+        version_keys = [LIST_VERSION_KEY]
+        if "check_in_date" in request.query_params or "check_out_date" in request.query_params:
+            version_keys.append(AVAILABILITY_VERSION_KEY)
+        cache_key = self.get_cache_key(request, *version_keys)
+        return self.cached_response(request, cache_key, lambda: self.build_list_response(request))
+
+    def build_list_response(self, request):
+        # keyset paginated mode, an invalid cursor raises NotFound which DRF turns into a 404
+        if self.paginator.is_requested(request):
+            page = self.paginate_queryset(self.get_queryset())
+            serializer = PropertySerializer(page, many=True, context={"request": self.request})
+            return self.get_paginated_response(serializer.data)
+
         try:
             queryset = self.get_queryset()
             
@@ -83,7 +211,10 @@ class PropertyViewSet(ReadOnlyModelViewSet):
                 
             serializer = PropertySerializer(queryset, many=True, context={"request": self.request})
             return Response(serializer.data, status=status.HTTP_200_OK)
-            
+
+        except ValidationError:
+            # bad search params are the client's fault, let DRF answer with a 400
+            raise
         except Exception as e:
             return Response(
                 {"error": "Failed to fetch properties. Please try again."},
@@ -91,57 +222,131 @@ class PropertyViewSet(ReadOnlyModelViewSet):
             )
 
     def retrieve(self, request, pk=None):
-        print("\n=== Property Retrieve Debug ===")
-        print(f"Request path: {request.path}")
-        print(f"Request method: {request.method}")
-        print(f"Request user: {request.user}")
-        print(f"Request headers: {dict(request.headers)}")
-        
+        cache_key = self.get_cache_key(request, property_version_key(pk))
+        return self.cached_response(request, cache_key, lambda: self.build_retrieve_response(request))
+
+    def build_retrieve_response(self, request):
         property_instance = self.get_object()
         serializer = PropertySerializer(property_instance,context={"request":self.request})
         data = serializer.data
-        print(f"Serialized property: {data}")
         return Response(data, status=status.HTTP_200_OK)
     
+    @action(detail=False, methods=['get'])
+    def clusters(self, request):
+        """
+        Map markers of the listing for `bbox=south,west,north,east` at `zoom` (0-20), the other listing
+        filters apply. Properties are grouped by geohash cell sized for the zoom (see geo.precision_for_zoom).
+        NOTE: clusters are computed and cached per tile, a tile being the geohash cell one level coarser
+        (more when the map needs over max_cluster_tiles of them), so panning the map only queries the tiles it hasn't seen, all of them in one grouped query.
+        """
+        south, west, north, east = self.get_bbox()
+        try:
+            zoom = int(request.query_params.get('zoom', ''))
+        except ValueError:
+            raise ValidationError({"message": "zoom must be an integer"})
+        if not 0 <= zoom <= self.max_zoom:
+            raise ValidationError({"message": f"zoom must be between 0 and {self.max_zoom}"})
+
+        precision = geo.precision_for_zoom(zoom)
+        tile_precision = max(precision - 1, 1)
+        tiles = geo.grid_cells(south, west, north, east, tile_precision, self.max_cluster_tiles)
+        # wide screens need more tiles than the cap, coarser tiles cover them (the clusters keep their precision)
+        while tiles is None and tile_precision > 1:
+            tile_precision -= 1
+            tiles = geo.grid_cells(south, west, north, east, tile_precision, self.max_cluster_tiles)
+        if tiles is None:
+            raise ValidationError({"message": "The area is too large for this zoom level"})
+
+        filters = {key: request.query_params.getlist(key) for key in self.listing_filters if key in request.query_params}
+        version_keys = [LIST_VERSION_KEY]
+        if "check_in_date" in filters or "check_out_date" in filters:
+            version_keys.append(AVAILABILITY_VERSION_KEY)
+        prefix = cluster_key_prefix(precision, filters, version_keys)
+        keys = {tile: f'{prefix}:{tile}' for tile in tiles}
+        cached = cache.get_many(keys.values())
+
+        tile_clusters = {tile: cached[key] for tile, key in keys.items() if key in cached}
+        missing = tiles - tile_clusters.keys()
+        if missing:
+            queryset = self.get_queryset().select_related(None).prefetch_related(None).filter(geo.in_cells(missing))
+            for tile in missing:
+                tile_clusters[tile] = []
+            for cluster in geo.clusters(queryset, precision):
+                tile_clusters[cluster['geohash'][:tile_precision]].append(cluster)
+            cache.set_many({keys[tile]: tile_clusters[tile] for tile in missing}, self.cache_timeout)
+
+        # tiles overlap the edges of the map, only the clusters centred inside it are returned
+        markers = [
+            cluster for tile in sorted(tile_clusters) for cluster in tile_clusters[tile]
+            if south <= cluster['latitude'] <= north
+            and (west <= cluster['longitude'] <= east if west <= east else not east < cluster['longitude'] < west)
+        ]
+        return Response({"zoom": zoom, "precision": precision, "clusters": markers}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'])
+    def cities(self, request):
+        """
+        City facets of the listing: the cities with listed properties matching the other listing filters,
+        with their count, the most listed first. One query grouped on the city foreign key, cached like the listing.
+        """
+        version_keys = [LIST_VERSION_KEY]
+        if "check_in_date" in request.query_params or "check_out_date" in request.query_params:
+            version_keys.append(AVAILABILITY_VERSION_KEY)
+        cache_key = self.get_cache_key(request, *version_keys)
+        return self.cached_response(request, cache_key, lambda: self.build_cities_response(request))
+
+    def build_cities_response(self, request):
+        facets = (
+            self.get_queryset().select_related(None).prefetch_related(None)
+            .filter(city__isnull=False).order_by()
+            .values('city_id', 'city__name', 'city__slug').annotate(count=Count('id'))
+            .order_by('-count', 'city__name')
+        )
+        data = [
+            {"id": facet['city_id'], "name": facet['city__name'], "slug": facet['city__slug'], "count": facet['count']}
+            for facet in facets
+        ]
+        return Response(data, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        """
+        Cities and titles of listed properties starting with `q`, the most listed first, at most `limit` (8).
+        served from the in-memory prefix index, no query
+        """
+        try:
+            limit = int(request.query_params.get('limit', self.autocomplete_limit))
+        except ValueError:
+            raise ValidationError({"message": "limit must be an integer"})
+        if not 1 <= limit <= self.max_autocomplete_limit:
+            raise ValidationError({"message": f"limit must be between 1 and {self.max_autocomplete_limit}"})
+        return Response(autocomplete_index.suggest(request.query_params.get('q', ''), limit), status=status.HTTP_200_OK)
+
     @action(detail=True,methods=['post','delete'])
     def add_to_wish_list(self,request,pk=None):
-        print("\n=== Add to Wish List Debug ===")
-        print(f"Request path: {request.path}")
-        print(f"Request method: {request.method}")
-        print(f"Request user: {request.user}")
-        print(f"Request user authenticated: {request.user.is_authenticated}")
-        print(f"Request headers: {dict(request.headers)}")
-        print(f"Property ID: {pk}")
-        print(f"Request data: {request.data}")
-        
         try:
             property = self.get_object()
-            print(f"Found property: {property.id}")
             user = request.user
-            print(f"User: {user.id}")
 
             if request.method == "POST":
                 existing_entry = WaitListEntry.objects.filter(guest=user, related_property=property).first()
-                print(f"Existing entry: {existing_entry}")
 
                 if existing_entry:
-                    print("User is already in the waiting list")
                     return Response({"message": "You are already in the waiting list"},
                                     status=status.HTTP_400_BAD_REQUEST)
                 
                 try:
                     entry = WaitListEntry.objects.create(guest=user,
                                                   related_property=property)
-                    print(f"Created new entry: {entry.id}")
                     return Response({"message": "Added to wishlist"},
                                     status=status.HTTP_201_CREATED)
 
                 except ValidationError as e:
-                    print(f"Validation error: {str(e)}")
+                    logger.warning('Could not add property %s to the waitlist: %s', property.id, e)
                     return Response({"message":f"Error while adding to wishlist: {str(e)}"},
                                     status=status.HTTP_400_BAD_REQUEST)
                 except Exception as e:
-                    print(f"Unexpected error: {str(e)}")
+                    logger.exception('Failed to add property %s to the waitlist', property.id)
                     return Response({"message": "An unexpected error occurred"},
                                     status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -149,41 +354,37 @@ class PropertyViewSet(ReadOnlyModelViewSet):
                 entry = WaitListEntry.objects.filter(guest=user,related_property=property)
                 if entry:
                     entry.delete()
-                    print("Wait list canceled")
                     return Response({"message":"Waitlist canceled"},
                                     status=status.HTTP_204_NO_CONTENT)
-                print("User is not in the wait list")
                 return Response({"message":"You are not in the waitlist"},
                                 status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
-            print(f"Error in add_to_wish_list: {str(e)}")
+            logger.exception('Failed to update the waitlist of property %s', pk)
             return Response({"message": f"Error: {str(e)}"},
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     @action(detail=True,methods=["post"],url_path=r'confirm_wishlist/(?P<waitlist_entry_pk>\d+)')
     def confirm_wishlist(self,request,pk=None,waitlist_entry_pk=None):
-        print("\n=== Confirm Wish List Debug ===")
-        print(f"Request path: {request.path}")
-        print(f"Request method: {request.method}")
-        print(f"Request user: {request.user}")
-        print(f"Request headers: {dict(request.headers)}")
-        
         property=self.get_object()
         try: 
             entry =WaitListEntry.objects.get(id=waitlist_entry_pk,
                                              guest=request.user,
                                              related_property=property)
             if entry.confirmed :
-                print("Already confirmed")
                 return Response({"message":"You have already confirmed"},
                                     status=status.HTTP_400_BAD_REQUEST)
+            if entry.notified_at is None:
+                return Response({"message":"The property hasn't been offered to you yet"},
+                                    status=status.HTTP_400_BAD_REQUEST)
+            if entry.expired_at or entry.notified_at <= now() - waitlist.offer_timeout():
+                return Response({"message":"This offer has expired"},
+                                    status=status.HTTP_400_BAD_REQUEST)
             entry.confirmed=True 
-            entry.save()
-            print("Booking confirmed")
+            entry.save(update_fields=['confirmed'])
             return Response({"message":"Booking confirmed "},
                                 status=status.HTTP_200_OK)
         except ValidationError as e :
-           print(f"Error while confirming the reservation: {str(e)}")
+           logger.warning('Could not confirm waitlist entry %s: %s', waitlist_entry_pk, e)
            return Response({"message":f"Error while confirming the reservation {str(e)}"},
                            status=status.HTTP_400_BAD_REQUEST)
 
@@ -238,25 +439,15 @@ class PropertyViewSet(ReadOnlyModelViewSet):
                     'message': f'Property is only available until {property_instance.available_to.date()}'
                 }, status=status.HTTP_200_OK)
 
-            # Check blocked dates
-            if property_instance.blocked_dates:
-                requested_dates = set(check_in + timedelta(days=x) for x in range((check_out - check_in).days))
-                blocked_dates = set(datetime.strptime(date, '%Y-%m-%d').date() for date in property_instance.blocked_dates)
-                if requested_dates.intersection(blocked_dates):
+            # Blocked dates and bookings are both materialized in the calendar, one indexed range lookup
+            unavailable = first_unavailable_night(property_instance.id, check_in, check_out)
+            if unavailable:
+                _, booking_id = unavailable
+                if booking_id is None:
                     return Response({
                         'available': False,
                         'message': 'Some of the requested dates are blocked by the host'
                     }, status=status.HTTP_200_OK)
-
-            # Check for overlapping bookings
-            overlapping_bookings = Booking.objects.filter(
-                property=property_instance,
-                check_in_date__lt=check_out,
-                check_out_date__gt=check_in,
-                status__in=['CONFIRMED', 'PENDING']
-            ).exists()
-
-            if overlapping_bookings:
                 return Response({
                     'available': False,
                     'message': 'Property is not available for these dates'
@@ -277,16 +468,9 @@ class PropertyViewSet(ReadOnlyModelViewSet):
 
 class OwnedPropertyViewSet(ModelViewSet):
     permission_classes = [IsAuthenticated, IsHostOrReadOnly]
-    search_fields = ["title", "description"]
-    filter_backends = [filters.SearchFilter]
+    filter_backends = [PropertySearchFilter]
 
     def get_queryset(self):
-        print("\n=== Owned Property Query Debug ===")
-        print(f"Request path: {self.request.path}")
-        print(f"Request method: {self.request.method}")
-        print(f"Request user: {self.request.user}")
-        print(f"Request headers: {dict(self.request.headers)}")
-        
         return Property.objects.filter(host=self.request.user)
 
     def get_serializer_class(self):
@@ -304,25 +488,17 @@ class OwnedPropertyViewSet(ModelViewSet):
 
     def list(self, request, *args, **kwargs):
         try:
-            print("\n=== Owned Property List Debug ===")
-            print(f"Request path: {request.path}")
-            print(f"Request method: {request.method}")
-            print(f"Request user: {request.user}")
-            print(f"Request headers: {dict(request.headers)}")
-            
-            queryset = self.get_queryset()
+            queryset = self.filter_queryset(self.get_queryset())
             if not queryset.exists():
-                print("You don't have any properties listed yet")
                 return Response(
                     {"message": "You don't have any properties listed yet"},
                     status=status.HTTP_200_OK
                 )
             serializer = self.get_serializer(queryset, many=True, context={'request': request})
             data = serializer.data
-            print(f"Serialized {len(data)} properties")
             return Response(data, status=status.HTTP_200_OK)
         except Exception as e:
-            print(f"Error in list view: {str(e)}")
+            logger.exception('Failed to list owned properties')
             return Response(
                 {"error": str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -341,12 +517,6 @@ class PropertyImageViewSet(ModelViewSet):
         }
 
     def get_queryset(self):
-        print("\n=== Property Image Query Debug ===")
-        print(f"Request path: {self.request.path}")
-        print(f"Request method: {self.request.method}")
-        print(f"Request user: {self.request.user}")
-        print(f"Request headers: {dict(self.request.headers)}")
-        
         property_id = self.kwargs.get("property_pk")
         if not property_id:
             return PropertyImage.objects.none()
@@ -368,12 +538,6 @@ class PropertyImageViewSet(ModelViewSet):
 
     def create(self, request, *args, **kwargs):
         try:
-            print("\n=== Property Image Create Debug ===")
-            print(f"Request path: {request.path}")
-            print(f"Request method: {request.method}")
-            print(f"Request user: {request.user}")
-            print(f"Request headers: {dict(request.headers)}")
-            
             response = super().create(request, *args, **kwargs)
             return Response(
                 {
@@ -383,13 +547,13 @@ class PropertyImageViewSet(ModelViewSet):
                 status=status.HTTP_201_CREATED
             )
         except ValidationError as e:
-            print(f"Error while uploading image: {str(e)}")
+            logger.info('Rejected property image upload: %s', e)
             return Response(
                 {"error": str(e)},
                 status=status.HTTP_400_BAD_REQUEST
             )
         except Exception as e:
-            print(f"Failed to upload image: {str(e)}")
+            logger.exception('Failed to upload property image')
             return Response(
                 {"error": "Failed to upload image. Please try again."},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -401,12 +565,6 @@ class BookingViewSet(ModelViewSet):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        print("\n=== Booking Query Debug ===")
-        print(f"Request path: {self.request.path}")
-        print(f"Request method: {self.request.method}")
-        print(f"Request user: {self.request.user}")
-        print(f"Request headers: {dict(self.request.headers)}")
-        
         # For list action, return all user's bookings
         if self.action == 'list':
             return Booking.objects.filter(guest=self.request.user).select_related('property')
@@ -421,13 +579,6 @@ class BookingViewSet(ModelViewSet):
         return context
 
     def create(self, request, *args, **kwargs):
-        print("\n=== Booking Create Debug ===")
-        print(f"Request path: {request.path}")
-        print(f"Request method: {request.method}")
-        print(f"Request user: {request.user}")
-        print(f"Request headers: {dict(request.headers)}")
-        print(f"Request data: {request.data}")
-        
         property_id = request.data.get('property')
         if not property_id:
             return Response(
@@ -452,70 +603,72 @@ class BookingViewSet(ModelViewSet):
         try:
             booking = serializer.save()
             
-            property_obj = booking.property
             total_price = booking.total_price * 100
             YOUR_DOMAIN = request.build_absolute_uri("/")
 
             payment_method = request.data.get('payment_method', 'card')
 
             if payment_method == 'card':
-                # Handle credit card payment through Stripe
-                stripe.api_key = settings.STRIPE_KEY
-                session = stripe.checkout.Session.create(
-                    payment_method_types=["card"],
-                    line_items=[
-                        {
-                            "price_data": {
-                                "currency": "dzd",  # Change to DZD for Algerian Dinar
-                                "product_data": {
-                                    "name": f"Booking for {property_obj}",
-                                },
-                                "unit_amount": int(total_price),
-                            },
-                            "quantity": 1,
-                        }
-                    ],
-                    mode="payment",
-                    success_url=f'{YOUR_DOMAIN}{reverse("stripe-success")}?session_id={{CHECKOUT_SESSION_ID}}',
-                    cancel_url=f'{YOUR_DOMAIN}{reverse("stripe-cancel")}',
-                )
-                booking.stripe_session_id = session.id
-                booking.save()
+                # The Stripe session is created by a celery worker so a slow Stripe call doesn't hold
+                # this worker, the client polls payment_session until it is READY
+                booking.payment_session_status = PAYMENT_SESSION_STATUS_CHOICES.PENDING
+                booking.save(update_fields=['payment_session_status'])
+                try:
+                    create_checkout_session.delay(booking.id, YOUR_DOMAIN)
+                except Exception:
+                    # broker down: the booking would hold its nights with no way to pay, cancel it (frees the nights)
+                    logger.exception('Failed to enqueue the checkout session of booking %s', booking.id)
+                    booking.status = PROPERTY_STATUS_CHOICES.CANCELED
+                    booking.payment_session_status = PAYMENT_SESSION_STATUS_CHOICES.FAILED
+                    booking.save(update_fields=['status', 'payment_session_status'])
+                    return Response(
+                        {"error": "Payment is unavailable right now, please try again later."},
+                        status=status.HTTP_503_SERVICE_UNAVAILABLE
+                    )
                 return Response({
                     "id": booking.id,
-                    "stripe_session_id": session.id,
-                })
+                    "payment_session_status": booking.payment_session_status,
+                    "payment_session_url": reverse("bookings-payment-session", kwargs={"pk": booking.id}),
+                }, status=status.HTTP_202_ACCEPTED)
             elif payment_method == 'ccp':
                 # Handle CCP Edahabia payment
                 ccp_payment_url = f"https://edahabia.poste.dz/payment?amount={total_price}&reference={booking.id}"
                 booking.payment_method = 'ccp'
-                booking.save()
+                booking.save(update_fields=['payment_method'])
                 return Response({
                     "id": booking.id,
                     "ccp_payment_url": ccp_payment_url
                 })
             else:
-                print("Invalid payment method")
                 return Response(
                     {"error": "Invalid payment method"}, 
                     status=status.HTTP_400_BAD_REQUEST
                 )
+        except ValidationError as e:
+            # dates taken by a concurrent booking while we waited for the property lock
+            return Response(e.detail, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
-            print(f"Error while creating booking: {str(e)}")
+            logger.exception('Failed to create booking')
             return Response(
                 {"error": str(e)}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @action(detail=True, methods=['get'])
+    def payment_session(self, request, pk=None):
+        """
+        Poll the checkout session of a card booking, stripe_session_id is set once the status is READY
+        """
+        booking = self.get_object()
+        return Response({
+            "id": booking.id,
+            "payment_session_status": booking.payment_session_status,
+            "stripe_session_id": booking.stripe_session_id,
+        }, status=status.HTTP_200_OK)
+
 
 class StripePublicKeyView(APIView):
     def get(self, request, *args, **kwargs):
-        print("\n=== Stripe Public Key Debug ===")
-        print(f"Request path: {request.path}")
-        print(f"Request method: {request.method}")
-        print(f"Request user: {request.user}")
-        print(f"Request headers: {dict(request.headers)}")
-        
         # Fetch the Stripe public key from the settings
         stripe_public_key = settings.STRIPE_PUBLIC_KEY
         return Response({"stripe_public_key": stripe_public_key})
@@ -534,12 +687,53 @@ class ConversationViewSet(viewsets.ModelViewSet):
     serializer_class = ConversationSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return ConversationListSerializer
+        if self.action == 'retrieve':
+            return ConversationDetailSerializer
+        return ConversationSerializer
+
     def get_queryset(self):
-        return Conversation.objects.filter(participants=self.request.user)
+        user = self.request.user
+        queryset = Conversation.objects.filter(participants=user)
+        if self.action not in ('list', 'retrieve'):
+            return queryset
 
-    @action(detail=True, methods=['post'])
+        # summary only: the latest message is prefetched with a sliced (window function) query and the
+        # unread count is a correlated subquery, so the payload doesn't grow with the thread
+        last_read = ConversationReadState.objects.filter(
+            conversation=OuterRef('pk'), user=user
+        ).values('last_read_message_id')[:1]
+        unread = Message.objects.filter(
+            conversation=OuterRef('pk'), id__gt=OuterRef('last_read')
+        ).exclude(sender=user).order_by().values('conversation').annotate(count=Count('id')).values('count')
+        if self.action == 'retrieve':
+            # the detail nests the full property
+            queryset = queryset.select_related('property__host').prefetch_related('property__images')
+        return queryset.select_related('property').prefetch_related(
+            'participants',
+            Prefetch(
+                'messages',
+                queryset=Message.objects.select_related('sender').order_by('-created_at', '-id')[:1],
+                to_attr='latest_messages',
+            ),
+        ).annotate(
+            last_read=Coalesce(Subquery(last_read), Value(0)),
+        ).annotate(
+            unread_count=Coalesce(Subquery(unread), Value(0)),
+        )
+
+    @action(detail=True, methods=['get', 'post'])
     def messages(self, request, pk=None):
         conversation = self.get_object()
+
+        if request.method == 'GET':
+            paginator = MessageHistoryPagination()
+            page = paginator.paginate_queryset(
+                Message.objects.filter(conversation=conversation).select_related('sender'), request, view=self)
+            # NOTE: fetching history doesn't mark it as read (prefetches, previews), clients POST to read/
+            return paginator.get_paginated_response(MessageSerializer(page, many=True).data)
         
         if request.user not in conversation.participants.all():
             return Response(
@@ -558,6 +752,23 @@ class ConversationViewSet(viewsets.ModelViewSet):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=True, methods=['post'])
+    def read(self, request, pk=None):
+        """
+        Move the caller's read marker to `message_id`, the latest message when it is omitted.
+        the marker never moves backwards nor past the latest message
+        """
+        conversation = self.get_object()
+        message_id = request.data.get('message_id')
+        if message_id is None:
+            message_id = conversation.messages.order_by('-id').values_list('id', flat=True).first() or 0
+        try:
+            message_id = int(message_id)
+        except (TypeError, ValueError):
+            raise ValidationError({"message": "message_id must be a message id"})
+        read_state_buffer.save(conversation.id, request.user.id, message_id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
     def create(self, request):
         property_id = request.data.get('property_id')
         initial_message = request.data.get('initial_message')
@@ -587,31 +798,23 @@ class ConversationViewSet(viewsets.ModelViewSet):
 
 
 def cancel(request):
-    print("\n=== Cancel Debug ===")
-    print(f"Request path: {request.path}")
-    print(f"Request method: {request.method}")
-    print(f"Request user: {request.user}")
-    print(f"Request headers: {dict(request.headers)}")
-    
     return render(request, "stripe/cancel.html")
 
 
 def success(request):
-    print("\n=== Success Debug ===")
-    print(f"Request path: {request.path}")
-    print(f"Request method: {request.method}")
-    print(f"Request user: {request.user}")
-    print(f"Request headers: {dict(request.headers)}")
-    
     session_id = request.GET.get("session_id")
     if not session_id:
-        print("Session Id missing")
         return HttpResponse("Session Id missing", status.HTTP_400_BAD_REQUEST)
 
+    # the webhook usually confirmed the payment already, only ask Stripe when it hasn't landed yet
+    if Booking.objects.filter(stripe_session_id=session_id, is_paid=True).exists():
+        return render(request, "stripe/success.html")
+
     try:
+        stripe.api_key = settings.STRIPE_KEY
         session = stripe.checkout.Session.retrieve(session_id)
     except stripe.error.StripeError as e:
-        print(f"Error retrieving session: {str(e)}")
+        logger.error('Error retrieving stripe session %s: %s', session_id, e)
         return HttpResponse(
             f"Error retrieving sesison:{str(e)}",
             status=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -621,42 +824,55 @@ def success(request):
         try:
             booking = Booking.objects.get(stripe_session_id=session.id)
             booking.is_paid = True
-            booking.save()
+            booking.save(update_fields=['is_paid'])
         except Booking.DoesNotExist:
-            print("Booking not found")
+            logger.warning('No booking for paid stripe session %s', session.id)
             return HttpResponse(
                 "Booking not found ", status=status.HTTP_400_BAD_REQUEST
             )
     else:
-        print("Payment not paid")
         return redirect("stripe-cancel")
     return render(request, "stripe/success.html")
 
 
+@csrf_exempt
+@require_POST
+def stripe_webhook(request):
+    """
+    Receive Stripe events: verify the signature, store the event once and let a celery task apply it.
+    Redelivered events hit the unique event_id and are acknowledged without being stored again.
+    """
+    try:
+        event = stripe.Webhook.construct_event(
+            request.body,
+            request.headers.get("Stripe-Signature", ""),
+            settings.STRIPE_WEBHOOK_SECRET,
+        )
+    except ValueError:
+        return HttpResponse("Invalid payload", status=status.HTTP_400_BAD_REQUEST)
+    except stripe.error.SignatureVerificationError:
+        return HttpResponse("Invalid signature", status=status.HTTP_400_BAD_REQUEST)
+
+    _, created = StripeEvent.objects.get_or_create(
+        event_id=event["id"],
+        defaults={"type": event["type"], "payload": event.to_dict_recursive()},
+    )
+    if created:
+        process_stripe_events.delay()
+    return HttpResponse(status=status.HTTP_200_OK)
+
+
 class WishlistViewSet(ReadOnlyModelViewSet):
     permission_classes = [IsAuthenticated]
     serializer_class = PropertySerializer
 
     def get_queryset(self):
-        print("\n=== Wish List Query Debug ===")
-        print(f"Request path: {self.request.path}")
-        print(f"Request method: {self.request.method}")
-        print(f"Request user: {self.request.user}")
-        print(f"Request headers: {dict(self.request.headers)}")
-        
         return Property.objects.filter(
             waitlistentry__guest=self.request.user
         ).prefetch_related('property')
 
     def list(self, request):
-        print("\n=== Wish List Debug ===")
-        print(f"Request path: {request.path}")
-        print(f"Request method: {request.method}")
-        print(f"Request user: {request.user}")
-        print(f"Request headers: {dict(request.headers)}")
-        
         queryset = self.get_queryset()
         serializer = self.serializer_class(queryset, many=True, context={'request': request})
         data = serializer.data
-        print(f"Serialized {len(data)} properties")
         return Response(data)
@@ -0,0 +1,89 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils.timezone import now
+from authapp.models import OutgoingEmail
+from authapp.tasks import wake_email_worker
+from .email import WaitlistOfferEmail
+from .models import Property, WaitListEntry, WaitListRelease
+
+# A property's waitlist is a FIFO of entries (created_at, id), the head gets an offer when dates free up:
+# * waiting : notified_at is None
+# * offered : notified_at is set, the guest has WAITLIST_OFFER_HOURS to confirm
+# * confirmed / expired : done, an expired offer moves the property to its next guest
+
+
+def offer_timeout():
+    return timedelta(hours=settings.WAITLIST_OFFER_HOURS)
+
+
+def running_offers():
+    return WaitListEntry.objects.filter(notified_at__isnull=False, confirmed=False, expired_at=None)
+
+
+def release_properties(property_ids):
+    """
+    Record that dates of these properties freed up, process_waitlist offers them to the next guests.
+    * written once the transaction commits, a property deleted along with its bookings is skipped
+    * a property already waiting for the sweep isn't recorded twice
+    """
+    property_ids = set(property_ids)
+
+    def record():
+        pending = WaitListRelease.objects.filter(processed_at=None).values('related_property_id')
+        released = Property.objects.filter(id__in=property_ids).exclude(id__in=pending).values_list('id', flat=True)
+        WaitListRelease.objects.bulk_create([WaitListRelease(related_property_id=property_id) for property_id in released])
+
+    if property_ids:
+        transaction.on_commit(record)
+
+
+def expire_offers(batch_size):
+    """
+    Expire the offers older than WAITLIST_OFFER_HOURS, returns their properties so they move to the next guest.
+    must run inside a transaction, the rows are claimed with skip_locked
+    """
+    expired = list(
+        running_offers().select_for_update(skip_locked=True)
+        .filter(notified_at__lte=now() - offer_timeout())
+        .order_by('notified_at')
+        .values_list('id', 'related_property_id')[:batch_size]
+    )
+    WaitListEntry.objects.filter(id__in=[entry_id for entry_id, _ in expired]).update(expired_at=now())
+    return {property_id for _, property_id in expired}
+
+
+def next_entries(property_ids):
+    """
+    Head of the queue of each property that has no running offer, in one query.
+    must run inside a transaction, a head locked by another worker is skipped rather than waited for
+    """
+    head = WaitListEntry.objects.filter(
+        related_property=OuterRef('related_property'), confirmed=False, notified_at=None,
+    ).order_by('created_at', 'id').values('id')[:1]
+    return list(
+        WaitListEntry.objects.select_for_update(skip_locked=True, of=('self',))
+        .filter(related_property_id__in=property_ids, id=Subquery(head))
+        .exclude(related_property_id__in=running_offers().values('related_property_id'))
+        .select_related('guest', 'related_property')
+    )
+
+
+def send_offers(entries, expires_at):
+    """
+    Render one offer email per entry and store them all in the outbox with one insert.
+    """
+    emails = []
+    for entry in entries:
+        email = WaitlistOfferEmail(context={
+            'user': entry.guest,
+            'property': entry.related_property,
+            'entry': entry,
+            'expires_at': expires_at,
+        })
+        email.to = [entry.guest.email]
+        email.render()
+        emails.append(email)
+    OutgoingEmail.objects.bulk_create([email.to_outbox() for email in emails])
+    wake_email_worker()